@@ -1,10 +1,24 @@
-"""Copy all required static content out of `pywb` so NGINX can serve it."""
+"""Build the static content NGINX serves, from `pywb` and our own files.
 
+As well as copying `pywb`'s static content, this adds a copy of each file
+with a hash of its content in the name, like `wombat.1a2b3c4d5e6f.js`.
+These never change, so NGINX lets browsers cache them forever. A manifest
+maps the plain names to the hashed ones, for the templates to link to.
+
+Every file also gets gzip and Brotli compressed copies for NGINX to serve.
+"""
+
+import hashlib
+import json
 import os
 import os.path
-from shutil import copytree, rmtree
+from shutil import copyfile, copytree, rmtree
 
 import importlib_resources
+from whitenoise.compress import main as compress
+
+HASH_LENGTH = 12
+"""The number of hex digits of the content hash to put in file names."""
 
 
 def _create_static(source, target):
@@ -16,11 +30,59 @@ def _create_static(source, target):
     copytree(source, target)
 
 
+def _fingerprint(root):
+    """Add copies of the files in `root` with their content hash in the name.
+
+    :return: A dict of the paths of files relative to `root`, to those of
+        their hashed copies
+    """
+    print(f"Adding content hashed copies of files in: {root}")
+
+    paths = [
+        os.path.join(dir_path, filename)
+        for dir_path, _dirs, filenames in os.walk(root)
+        for filename in filenames
+    ]
+
+    manifest = {}
+    for path in sorted(paths):
+        with open(path, "rb") as handle:
+            digest = hashlib.md5(handle.read(), usedforsecurity=False).hexdigest()
+
+        stem, extension = os.path.splitext(path)
+        hashed_path = f"{stem}.{digest[:HASH_LENGTH]}{extension}"
+        copyfile(path, hashed_path)
+
+        manifest[_url_path(path, root)] = _url_path(hashed_path, root)
+
+    return manifest
+
+
+def _url_path(path, root):
+    return os.path.relpath(path, root).replace(os.path.sep, "/")
+
+
+def _write_manifest(manifest, path):
+    print(f"Writing the static content manifest: {path}")
+
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+
+
 if __name__ == "__main__":
     bin_dir = os.path.abspath(os.path.dirname(__file__))
-    root_dir = os.path.abspath(os.path.join(bin_dir, "../static/static/pywb"))
+    static_dir = os.path.abspath(os.path.join(bin_dir, "../static"))
+    pywb_dir = os.path.join(static_dir, "static/pywb")
 
     _create_static(
         source=importlib_resources.files("pywb") / "static",
-        target=root_dir,
+        target=pywb_dir,
     )
+    # This is outside of the directory NGINX serves
+    _write_manifest(
+        _fingerprint(pywb_dir), path=os.path.join(static_dir, "manifest.json")
+    )
+
+    served_dir = os.path.join(static_dir, "static")
+    print(f"Compressing static content: {served_dir}")
+    compress(["--quiet", served_dir])
@@ -1,14 +1,22 @@
-"""Collect stats from uWSGI and send them to New Relic."""
+"""Collect stats from uWSGI and send them to New Relic.
+
+If `VIA_OPENMETRICS_PORT` is set, this also serves them in the OpenMetrics
+format at `/metrics` on that port, read from uWSGI for every scrape.
+"""
 
 import logging
+import os
 import sys
+from threading import Thread
 from time import sleep
+from wsgiref.simple_server import WSGIRequestHandler, make_server
 
 import importlib_resources
 import newrelic.agent
 
-from viahtml.stats import UWSGINewRelicStatsGenerator
+from viahtml.stats import UWSGINewRelicStatsGenerator, UWSGIOpenMetricsGenerator
 
+STATS_ENDPOINT = "http://localhost:3033"
 METRICS_INTERVAL = 60
 LOG = logging.getLogger(__name__)
 # If you set this to DEBUG, you get a lot of New Relic info in there, but it
@@ -26,14 +34,46 @@ def _report_stats():
     newrelic.agent.register_application(timeout=5)
     application = newrelic.agent.application()
 
-    generate_stats = UWSGINewRelicStatsGenerator(stats_endpoint="http://localhost:3033")
+    generate_stats = UWSGINewRelicStatsGenerator(stats_endpoint=STATS_ENDPOINT)
 
     while True:
         application.record_custom_metrics(generate_stats())
         sleep(METRICS_INTERVAL)
 
 
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        # Scrapers call every few seconds, which would drown out everything
+        pass
+
+
+def _serve_openmetrics(port):
+    generate_openmetrics = UWSGIOpenMetricsGenerator(stats_endpoint=STATS_ENDPOINT)
+
+    def app(environ, start_response):
+        if environ["PATH_INFO"] != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b"Not found"]
+
+        body = generate_openmetrics().encode("utf-8")
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", UWSGIOpenMetricsGenerator.CONTENT_TYPE),
+                ("Content-Length", str(len(body))),
+            ],
+        )
+        return [body]
+
+    server = make_server("", port, app, handler_class=_QuietRequestHandler)
+    LOG.info("Serving OpenMetrics on port %s", port)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+
 if __name__ == "__main__":
+    if os.environ.get("VIA_OPENMETRICS_PORT"):
+        _serve_openmetrics(int(os.environ["VIA_OPENMETRICS_PORT"]))
+
     try:
         _report_stats()
     finally:
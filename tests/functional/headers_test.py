@@ -21,3 +21,9 @@ class TestHeaders:
         self, proxied_content, header_name
     ):
         assert header_name not in proxied_content.headers
+
+    def test_outbound_headers_have_server_timings_in_debug_mode(self, proxied_content):
+        server_timing = proxied_content.headers["Server-Timing"]
+
+        for name in ("views", "upstream", "template", "deferred"):
+            assert f"{name};dur=" in server_timing
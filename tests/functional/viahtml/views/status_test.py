@@ -2,6 +2,7 @@ import json
 
 import httpretty
 import pytest
+from h_matchers import Any
 
 
 @pytest.mark.usefixtures("httpretty")
@@ -19,4 +20,10 @@ class TestStatusView:
             status=500,  # The status endpoint reports failure.
         )
 
-        assert json.loads(response.body) == {"status": "down", "down": ["checkmate"]}
+        assert json.loads(response.body) == {
+            "status": "down",
+            "down": ["checkmate"],
+            # Other tests share this app and may have opened the circuit
+            "checkmate_circuit": Any.dict.containing(["state", "failures"]),
+            "upstream_pool": Any.dict.containing(["hosts", "idle_connections"]),
+        }
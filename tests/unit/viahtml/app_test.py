@@ -1,4 +1,4 @@
-from unittest.mock import create_autospec, patch
+from unittest.mock import call, create_autospec, patch
 
 import pytest
 from h_matchers import Any
@@ -6,6 +6,10 @@ from pytest import param
 from pywb.apps.rewriterapp import RewriterApp
 
 from viahtml.app import Application, asbool
+from viahtml.checkmate import CircuitBreaker
+from viahtml.dns_cache import DNSCache
+from viahtml.views.accel_redirect import AccelRedirectView
+from viahtml.views.security import SecurityView
 
 
 @pytest.mark.usefixtures("os", "Hooks", "with_patched_views")
@@ -21,9 +25,99 @@ class TestApplicationCreate:
         Application()
 
         apply_post_app_hooks.assert_called_once_with(
-            Any.instance_of(RewriterApp), Hooks.return_value
+            Any.instance_of(RewriterApp), Hooks.return_value, None
         )
 
+    @patch("viahtml.app.apply_post_app_hooks", autospec=True)
+    @patch("viahtml.app.RenderCache", autospec=True)
+    def test_it_can_cache_rendered_pages(
+        self, RenderCache, apply_post_app_hooks, Hooks, os
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        os.environ["VIA_RENDER_CACHE_SIZE"] = "2"
+        os.environ["VIA_RENDER_CACHE_FRESH_TTL"] = "10"
+        os.environ["VIA_RENDER_CACHE_TTL"] = "20"
+
+        Application()
+
+        RenderCache.assert_called_once_with(
+            max_size=2 * 1024 * 1024, fresh_ttl=10, stale_ttl=20
+        )
+        apply_post_app_hooks.assert_called_once_with(
+            Any.instance_of(RewriterApp), Hooks.return_value, RenderCache.return_value
+        )
+
+    def test_it_can_offload_subresources_to_nginx(self, os, with_patched_views):
+        os.environ["VIA_ACCEL_REDIRECT"] = "true"
+
+        app = Application()
+
+        assert app.views == (
+            with_patched_views["StatusView"].return_value,
+            with_patched_views["SecurityView"].return_value,
+            Any.instance_of(AccelRedirectView),
+            with_patched_views["RoutingView"].return_value,
+        )
+
+    def test_it_refuses_to_offload_with_inbound_header_rules(self, os):
+        os.environ["VIA_ACCEL_REDIRECT"] = "true"
+        os.environ["VIA_INBOUND_HEADER_RULES"] = "block X-One"
+
+        with pytest.raises(EnvironmentError):
+            Application()
+
+    def test_it_does_not_offload_subresources_by_default(self, with_patched_views):
+        app = Application()
+
+        assert app.views == (
+            with_patched_views["StatusView"].return_value,
+            with_patched_views["SecurityView"].return_value,
+            with_patched_views["RoutingView"].return_value,
+        )
+
+    @patch("viahtml.app.UpstreamPool", autospec=True)
+    def test_it_pools_upstream_connections(self, UpstreamPool, os, with_patched_views):
+        os.environ["VIA_UPSTREAM_POOL_HOSTS"] = "5"
+        os.environ["VIA_UPSTREAM_POOL_CONNECTIONS"] = "2"
+        os.environ["VIA_UPSTREAM_POOL_IDLE_TIMEOUT"] = "15"
+
+        Application()
+
+        UpstreamPool.assert_called_once_with(
+            max_hosts=5,
+            max_connections_per_host=2,
+            idle_timeout=15,
+            dns_cache=Any.instance_of(DNSCache),
+        )
+        UpstreamPool.return_value.install.assert_called_once_with()
+        with_patched_views["StatusView"].assert_called_once_with(
+            Any(), Any(), UpstreamPool.return_value
+        )
+
+    @patch("viahtml.app.UpstreamPool", autospec=True)
+    @patch("viahtml.app.DNSCache", autospec=True)
+    def test_it_caches_dns_lookups(self, DNSCache, UpstreamPool, os):
+        os.environ["VIA_DNS_CACHE_SIZE"] = "50"
+        os.environ["VIA_DNS_CACHE_TTL"] = "20"
+        os.environ["VIA_DNS_CACHE_NEGATIVE_TTL"] = "2"
+
+        Application()
+
+        DNSCache.assert_called_once_with(max_size=50, ttl=20, negative_ttl=2)
+        UpstreamPool.assert_called_once_with(
+            max_hosts=Any(),
+            max_connections_per_host=Any(),
+            idle_timeout=Any(),
+            dns_cache=DNSCache.return_value,
+        )
+
+    @patch("viahtml.app.UpstreamPool", autospec=True)
+    def test_it_can_disable_the_dns_cache(self, UpstreamPool, os):
+        os.environ["VIA_DNS_CACHE_SIZE"] = "0"
+
+        Application()
+
+        assert UpstreamPool.call_args.kwargs["dns_cache"] is None
+
     @pytest.mark.parametrize(
         "variable,value,expected",
         (
@@ -34,6 +128,26 @@ class TestApplicationCreate:
                 {"ignore_prefixes": ["value_1", "value_2"]},
             ),
             ("VIA_H_EMBED_URL", "value", {"h_embed_url": "value"}),
+            ("CHECKMATE_TIMEOUT", "0.25", {"checkmate_timeout": 0.25}),
+            ("CHECKMATE_FAIL_CLOSED", "true", {"checkmate_fail_closed": True}),
+            ("VIA_HEAD_FLUSH_SIZE", "1024", {"head_flush_size": 1024}),
+            (
+                "VIA_INBOUND_HEADER_RULES",
+                "block X-One, inject X-Two value",
+                {"inbound_header_rules": ["block X-One", "inject X-Two value"]},
+            ),
+            ("VIA_COMPRESSION_GZIP_LEVEL", "9", {"compression_gzip_level": 9}),
+            (
+                "VIA_COMPRESSION_BROTLI_QUALITY",
+                "0",
+                {"compression_brotli_quality": 0},
+            ),
+            ("VIA_COMPRESSION_MIN_SIZE", "0", {"compression_min_size": 0}),
+            (
+                "VIA_STATIC_MANIFEST",
+                "manifest.json",
+                {"static_manifest": "manifest.json"},
+            ),
         ),
     )
     # pylint: disable=too-many-arguments
@@ -46,6 +160,27 @@ class TestApplicationCreate:
 
         Hooks.assert_called_once_with(Any.dict.containing(expected))
 
+    @patch("viahtml.app.Compression", autospec=True)
+    def test_it_sets_up_compression(self, Compression, os):
+        os.environ["VIA_COMPRESSION_GZIP_LEVEL"] = "9"
+
+        app = Application()
+
+        Compression.assert_called_once_with(
+            gzip_level=9, brotli_quality=4, min_size=1024
+        )
+        assert app.compression == Compression.return_value
+
+    @patch("viahtml.app.Compression", autospec=True)
+    def test_it_can_disable_compression(self, Compression, os):
+        os.environ["VIA_COMPRESSION_GZIP_LEVEL"] = "0"
+        os.environ["VIA_COMPRESSION_BROTLI_QUALITY"] = "0"
+
+        app = Application()
+
+        Compression.assert_not_called()
+        assert app.compression is None
+
     def test_it_sets_the_config_file_for_pywb(self, os):
         Application()
 
@@ -81,7 +216,224 @@ class TestApplicationCreate:
 
 
 @pytest.mark.usefixtures("os", "Hooks", "with_patched_views")
-class TestApplication:
+class TestApplicationCheckmate:
+    def test_it_caches_checkmate_verdicts(self, os, VerdictCache, with_patched_views):
+        os.environ["CHECKMATE_CACHE_SIZE"] = "100"
+        os.environ["CHECKMATE_CACHE_ALLOWED_TTL"] = "10"
+        os.environ["CHECKMATE_CACHE_BLOCKED_TTL"] = "20"
+
+        Application()
+
+        VerdictCache.assert_called_once_with(
+            Any.function(), max_size=100, allowed_ttl=10, blocked_ttl=20
+        )
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            VerdictCache.return_value,
+            document_tokens=None,
+            fail_closed=False,
+            speculative=False,
+        )
+
+    def test_it_can_disable_the_checkmate_cache(
+        self, os, VerdictCache, with_patched_views
+    ):
+        os.environ["CHECKMATE_CACHE_SIZE"] = "0"
+
+        Application()
+
+        VerdictCache.assert_not_called()
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            Any.instance_of(CircuitBreaker),
+            document_tokens=None,
+            fail_closed=False,
+            speculative=False,
+        )
+
+    def test_it_shares_checkmate_verdicts_between_workers(
+        self, os, SharedVerdictCache, VerdictCache
+    ):
+        os.environ["CHECKMATE_SHARED_CACHE"] = "checkmate"
+        os.environ["CHECKMATE_CACHE_ALLOWED_TTL"] = "10"
+        os.environ["CHECKMATE_CACHE_BLOCKED_TTL"] = "20"
+
+        Application()
+
+        SharedVerdictCache.assert_called_once_with(
+            Any.function(), cache_name="checkmate", allowed_ttl=10, blocked_ttl=20
+        )
+        VerdictCache.assert_called_once_with(
+            SharedVerdictCache.return_value,
+            max_size=Any(),
+            allowed_ttl=Any(),
+            blocked_ttl=Any(),
+        )
+
+    def test_it_only_shares_checkmate_verdicts_in_uwsgi(
+        self, os, SharedVerdictCache, caplog
+    ):
+        os.environ["CHECKMATE_SHARED_CACHE"] = "checkmate"
+        SharedVerdictCache.is_supported.return_value = False
+
+        Application()
+
+        SharedVerdictCache.assert_not_called()
+        assert "Not using the shared Checkmate cache" in caplog.text
+
+    def test_it_can_let_subresources_of_checked_pages_skip_checkmate(
+        self, os, DocumentTokens, with_patched_views
+    ):
+        os.environ["VIA_SUBRESOURCE_TOKEN_SECRET"] = "secret"
+        os.environ["VIA_SUBRESOURCE_TOKEN_TTL"] = "30"
+
+        Application()
+
+        DocumentTokens.assert_called_once_with("secret", ttl=30)
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            Any(),
+            document_tokens=DocumentTokens.return_value,
+            fail_closed=False,
+            speculative=False,
+        )
+
+    def test_it_puts_a_circuit_breaker_around_checkmate(
+        self, os, CircuitBreaker, VerdictCache, with_patched_views
+    ):
+        os.environ["CHECKMATE_TIMEOUT"] = "0.25"
+        os.environ["CHECKMATE_CIRCUIT_FAILURES"] = "3"
+        os.environ["CHECKMATE_CIRCUIT_RESET"] = "10"
+
+        Application()
+
+        CircuitBreaker.assert_called_once_with(
+            Any.function(), timeout=0.25, failure_threshold=3, reset_timeout=10
+        )
+        # The breaker goes inside the caches, so cached verdicts are still
+        # available while it's open
+        VerdictCache.assert_called_once_with(
+            CircuitBreaker.return_value,
+            max_size=Any(),
+            allowed_ttl=Any(),
+            blocked_ttl=Any(),
+        )
+        with_patched_views["StatusView"].assert_called_once_with(
+            Any(), CircuitBreaker.return_value, Any()
+        )
+
+    def test_it_counts_the_checks_which_reach_checkmate(self, CircuitBreaker, patch):
+        CheckmateClient = patch("viahtml.app.CheckmateClient")
+        metrics = patch("viahtml.app.metrics")
+        Application()
+        check_url = CircuitBreaker.call_args.args[0]
+
+        verdict = check_url("http://example.com", allow_all=True)
+
+        metrics.increment.assert_called_once_with("checkmate.calls")
+        CheckmateClient.return_value.check_url.assert_called_once_with(
+            "http://example.com", allow_all=True, ignore_reasons=Any()
+        )
+        assert verdict == CheckmateClient.return_value.check_url.return_value
+
+    def test_it_can_disable_the_circuit_breaker(
+        self, os, CircuitBreaker, with_patched_views
+    ):
+        os.environ["CHECKMATE_CIRCUIT_FAILURES"] = "0"
+
+        Application()
+
+        CircuitBreaker.assert_not_called()
+        with_patched_views["StatusView"].assert_called_once_with(Any(), None, Any())
+
+    def test_it_can_fail_closed(self, os, with_patched_views):
+        os.environ["CHECKMATE_FAIL_CLOSED"] = "true"
+
+        Application()
+
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            Any(),
+            document_tokens=Any(),
+            fail_closed=True,
+            speculative=Any(),
+        )
+
+    def test_it_uses_a_local_blocklist(
+        self, os, LocalBlocklist, VerdictCache, with_patched_views
+    ):
+        os.environ["VIA_BLOCKLIST_PATH"] = "blocklist.txt"
+        os.environ["CHECKMATE_IGNORE_REASONS"] = "high-io"
+
+        Application()
+
+        LocalBlocklist.assert_called_once_with(
+            VerdictCache.return_value,
+            path="blocklist.txt",
+            checkmate_host=os.environ["CHECKMATE_URL"],
+            ignore_reasons="high-io",
+        )
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            LocalBlocklist.return_value,
+            document_tokens=Any(),
+            fail_closed=Any(),
+            speculative=Any(),
+        )
+
+    def test_it_works_without_a_local_blocklist(self, LocalBlocklist):
+        Application()
+
+        LocalBlocklist.assert_not_called()
+
+    def test_it_can_check_urls_speculatively(self, os, with_patched_views):
+        os.environ["CHECKMATE_SPECULATIVE"] = "true"
+
+        Application()
+
+        with_patched_views["SecurityView"].assert_called_once_with(
+            Any(),
+            Any(),
+            Any(),
+            Any(),
+            document_tokens=Any(),
+            fail_closed=Any(),
+            speculative=True,
+        )
+
+    @pytest.fixture
+    def LocalBlocklist(self, patch):
+        return patch("viahtml.app.LocalBlocklist")
+
+    @pytest.fixture
+    def CircuitBreaker(self, patch):
+        return patch("viahtml.app.CircuitBreaker")
+
+    @pytest.fixture
+    def DocumentTokens(self, patch):
+        return patch("viahtml.app.DocumentTokens")
+
+    @pytest.fixture
+    def VerdictCache(self, patch):
+        return patch("viahtml.app.VerdictCache")
+
+    @pytest.fixture
+    def SharedVerdictCache(self, patch):
+        return patch("viahtml.app.SharedVerdictCache")
+
+
+@pytest.mark.usefixtures("os", "Hooks", "with_patched_views")
+class TestApplication:  # pylint:disable=too-many-public-methods
     # Test the WSGI middleware wrapping behavior
     # This is a small amount code which generates a huge and annoying amount of
     # test code as it's very nested and functional
@@ -107,7 +459,7 @@ class TestApplication:
 
         assert result == start_response.return_value
         modified_outbound = app.hooks.headers.modify_outbound
-        modified_outbound.assert_called_once_with(headers)
+        modified_outbound.assert_called_once_with(headers, [])
         start_response.assert_called_with(Any(), modified_outbound.return_value)
 
     def test_it_adds_context_headers(self, app, start_response, environ, Context):
@@ -117,13 +469,79 @@ class TestApplication:
 
         modified_outbound = app.hooks.headers.modify_outbound
         modified_outbound.assert_called_once_with(
-            [
-                # From the fixtures
-                ("Header", "Value"),
-                ("X-Foo", "Foo"),
-            ]
+            # From the fixtures
+            [("Header", "Value")],
+            [("X-Foo", "Foo")],
         )
 
+    def test_it_runs_deferred_functions_before_the_response_starts(
+        self, app, start_response, environ, Context
+    ):
+        def deferred():
+            # The response hasn't started yet
+            start_response.assert_not_called()
+
+        Context.return_value.deferred = [deferred]
+
+        result = app(environ, start_response)
+
+        assert result == start_response.return_value
+
+    def test_deferred_functions_can_replace_the_response(
+        self, app, start_response, environ, Context, FrontEndApp
+    ):  # pylint: disable=too-many-arguments
+        body = create_autospec(_Body, instance=True, spec_set=True)
+
+        def app_with_body(_environ, start_response):
+            write = start_response(self.STATUS, [])
+            # Anything written to the replaced response goes nowhere
+            write(b"Ignored")
+            return body
+
+        FrontEndApp.return_value.side_effect = app_with_body
+        Context.return_value.deferred = [lambda: None, lambda: ["Blocked"]]
+
+        result = app(environ, start_response)
+
+        assert result == ["Blocked"]
+        # The deferred function is responsible for starting the response
+        start_response.assert_not_called()
+        body.close.assert_called_once_with()
+
+    def test_it_compresses_proxied_responses(
+        self, app, start_response, environ, compression
+    ):
+        compressing_start_response, compress = compression.return_value
+
+        result = app(environ, start_response)
+
+        compression.assert_called_once_with(environ, start_response)
+        compressing_start_response.assert_called_once_with(
+            self.STATUS, app.hooks.headers.modify_outbound.return_value
+        )
+        start_response.assert_not_called()
+        assert result == compress.return_value
+
+    def test_it_does_not_compress_if_compression_is_disabled(
+        self, app, start_response, environ
+    ):
+        app.compression = None
+
+        result = app(environ, start_response)
+
+        assert result == start_response.return_value
+
+    def test_it_does_not_compress_replaced_responses(
+        self, app, start_response, environ, Context, compression
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        Context.return_value.deferred = [lambda: ["Blocked"]]
+
+        result = app(environ, start_response)
+
+        assert result == ["Blocked"]
+        _, compress = compression.return_value
+        compress.assert_not_called()
+
     @pytest.mark.parametrize("return_value", (["Hello"], []))
     # pylint: disable=too-many-arguments
     def test_it_applies_views(
@@ -146,11 +564,103 @@ class TestApplication:
 
         assert result == start_response.return_value
 
+    def test_it_times_the_parts_of_the_request(
+        self, app, start_response, environ, Context
+    ):
+        context = Context.return_value
+
+        app(environ, start_response)
+
+        assert context.timed.call_args_list == [call("views"), call("deferred")]
+
+    def test_it_adds_a_server_timing_header_in_debug_mode(
+        self, app, start_response, environ, Context
+    ):
+        context = Context.return_value
+        context.debug = True
+
+        app(environ, start_response)
+
+        app.hooks.headers.modify_outbound.assert_called_once_with(
+            Any(), [("Server-Timing", context.server_timing)]
+        )
+
+    def test_it_reports_the_timings_once_the_body_is_sent(
+        self, app, start_response, environ, Context, ClosingIterator, metrics
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        Context.return_value.timings = {"upstream": 0.25, "rewrite": 0.5}
+        Context.return_value.get_header.return_value = "document"
+
+        app(environ, start_response)
+
+        metrics.observe.assert_not_called()
+        _, report_timings = ClosingIterator.call_args.args
+        report_timings()
+        assert metrics.observe.call_args_list == [
+            call("latency.document", 1.5),
+            call("timing.upstream", 0.25),
+            call("timing.rewrite", 0.5),
+        ]
+
+    @pytest.mark.parametrize(
+        "destination,path,route",
+        (
+            ("document", "/proxy/js_/http://example.com", "document"),
+            ("iframe", "/proxy/http://example.com", "document"),
+            ("script", "/proxy/http://example.com", "subresource"),
+            (None, "/proxy/http://example.com", "document"),
+            (None, "/proxy/mp_/http://example.com", "document"),
+            (None, "/proxy/if_/http://example.com", "document"),
+            (None, "/proxy/js_/http://example.com", "subresource"),
+            (None, "/static/wombat.js", "subresource"),
+        ),
+    )
+    def test_it_reports_the_latency_by_route(
+        self,
+        app,
+        start_response,
+        environ,
+        Context,
+        ClosingIterator,
+        metrics,
+        destination,
+        path,
+        route,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        Context.return_value.get_header.return_value = destination
+        Context.return_value.path = path
+
+        app(environ, start_response)
+        _, report_timings = ClosingIterator.call_args.args
+        report_timings()
+
+        Context.return_value.get_header.assert_called_once_with("Sec-Fetch-Dest")
+        metrics.observe.assert_any_call(f"latency.{route}", 1.5)
+
+    def test_it_reports_the_latency_of_view_responses(
+        self, app, start_response, environ, view, metrics
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        view.return_value = ["Hello"]
+
+        app(environ, start_response)
+
+        metrics.observe.assert_called_once_with("latency.status", 1.5)
+
+    def test_it_reports_the_latency_of_replaced_responses(
+        self, app, start_response, environ, Context, metrics
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        Context.return_value.deferred = [lambda: ["Blocked"]]
+
+        app(environ, start_response)
+
+        metrics.observe.assert_called_once_with("latency.blocked", 1.5)
+
     @pytest.fixture
     def view(self, app):
         view = create_autospec(
-            lambda context: None, spec_set=True, return_value=None
+            lambda context: None, return_value=None
         )  # pragma: no cover
+        view.ROUTE = "status"
         app.views = [view]
 
         return view
@@ -169,6 +679,19 @@ class TestApplication:
     def headers(self):
         return [("Header", "Value")]
 
+    @pytest.fixture
+    def compression(self, app):
+        compressing_start_response = create_autospec(
+            lambda status, headers, exc_info=None: None
+        )  # pragma: no cover
+        compress = create_autospec(lambda body: None)  # pragma: no cover
+
+        app.compression = create_autospec(
+            lambda environ, start_response: None,
+            return_value=(compressing_start_response, compress),
+        )  # pragma: no cover
+        return app.compression
+
     @pytest.fixture(autouse=True)
     def FrontEndApp(self, patch, headers):
         FrontEndApp = patch("viahtml.app.FrontEndApp")
@@ -193,9 +716,39 @@ class TestApplication:
     @pytest.fixture(autouse=True)
     def Context(self, patch):
         Context = patch("viahtml.app.Context")
+        Context.return_value.debug = False
         Context.return_value.headers = []
+        Context.return_value.deferred = []
+        Context.return_value.timings = {}
         return Context
 
+    @pytest.fixture(autouse=True)
+    def ClosingIterator(self, patch):
+        ClosingIterator = patch("viahtml.app.ClosingIterator")
+        # Hand back the body, so the other tests can check what it is
+        ClosingIterator.side_effect = lambda iterable, callbacks: iterable
+        return ClosingIterator
+
+    @pytest.fixture
+    def metrics(self, patch):
+        return patch("viahtml.app.metrics")
+
+    @pytest.fixture(autouse=True)
+    def perf_counter(self, patch):
+        perf_counter = patch("viahtml.app.perf_counter")
+        perf_counter.side_effect = [1.0, 2.5]
+        return perf_counter
+
+
+class _Body:
+    """The interface of a WSGI response body we care about."""
+
+    def __iter__(self):  # pragma: no cover
+        return iter([])
+
+    def close(self):  # pragma: no cover
+        pass
+
 
 class TestAsBool:
     @pytest.mark.parametrize("uppercase", [True, False])
@@ -246,10 +799,16 @@ def Hooks():
 
 @pytest.fixture
 def with_patched_views(patch):
+    views = {}
     for view_class in (
         "StatusView",
         "SecurityView",
         "RoutingView",
     ):
-        view = patch(f"viahtml.app.{view_class}")
+        view = views[view_class] = patch(f"viahtml.app.{view_class}")
         view.return_value.return_value = None
+
+    # The app uses this to tell which proxied requests are for pages
+    views["SecurityView"].DOCUMENT_DESTINATIONS = SecurityView.DOCUMENT_DESTINATIONS
+
+    return views
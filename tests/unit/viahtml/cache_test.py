@@ -0,0 +1,76 @@
+import pytest
+
+from viahtml.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_it_returns_items_which_have_been_set(self, cache):
+        cache.set("key", "value", ttl=10)
+
+        assert cache.get("key") == "value"
+        assert cache.hits == 1
+        assert not cache.misses
+
+    def test_it_returns_the_default_for_missing_items(self, cache):
+        assert cache.get("missing", "default") == "default"
+        assert cache.misses == 1
+
+    def test_it_expires_items(self, cache, monotonic):
+        cache.set("key", "value", ttl=10)
+
+        monotonic.return_value += 10
+
+        assert cache.get("key") is None
+        assert not cache
+        assert not cache.size
+
+    @pytest.mark.parametrize("ttl", (0, -1))
+    def test_it_does_not_store_items_with_no_ttl(self, cache, ttl):
+        cache.set("key", "value", ttl=ttl)
+
+        assert not cache
+
+    def test_it_replaces_items(self, cache):
+        cache.set("key", "old", ttl=10)
+        cache.set("key", "new", ttl=10)
+
+        assert cache.get("key") == "new"
+        assert len(cache) == cache.size == 1
+
+    def test_it_evicts_the_least_recently_used_items(self, cache):
+        cache.set("a", 1, ttl=10)
+        cache.set("b", 2, ttl=10)
+        cache.set("c", 3, ttl=10)
+        cache.get("a")
+
+        cache.set("d", 4, ttl=10)
+
+        assert cache.get("b") is None
+        assert [cache.get(key) for key in "acd"] == [1, 3, 4]
+
+    def test_it_can_bound_by_the_size_of_items(self):
+        cache = LRUCache(max_size=10, size_of=len)
+
+        cache.set("a", "12345", ttl=10)
+        cache.set("b", "123456", ttl=10)
+
+        assert cache.get("a") is None
+        assert cache.get("b") == "123456"
+        assert cache.size == 6
+
+    def test_it_does_not_store_items_bigger_than_the_cache(self):
+        cache = LRUCache(max_size=10, size_of=len)
+
+        cache.set("a", "12345678901", ttl=10)
+
+        assert not cache
+
+    @pytest.fixture
+    def cache(self):
+        return LRUCache(max_size=3)
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.cache.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
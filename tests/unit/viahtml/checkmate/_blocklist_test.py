@@ -0,0 +1,180 @@
+import os
+from unittest.mock import create_autospec
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from checkmatelib import CheckmateClient
+
+from viahtml.checkmate import Blocklist, LocalBlocklist
+
+
+class TestBlocklist:
+    @pytest.mark.parametrize(
+        "url,reason",
+        (
+            ("https://example.com", "publisher-blocked"),
+            ("https://example.com/any/path", "publisher-blocked"),
+            ("https://EXAMPLE.com./", "publisher-blocked"),
+            ("https://www.example.com/", "publisher-blocked"),
+            ("https://docs.example.com/", "allowed"),
+            ("https://deep.docs.example.com/", "allowed"),
+            ("https://docs.example.com/bad/thing", "malicious"),
+            ("https://docs.example.com/bad?query", "malicious"),
+            ("https://docs.example.com/other?bad", "allowed"),
+            ("https://docs.example.com/worse", "high-io"),
+            ("https://example.org/", None),
+            ("https://com/", None),
+            ("https://notexample.com/", None),
+            ("not a url", None),
+            ("https://[bad/", None),
+        ),
+    )
+    def test_match(self, blocklist, url, reason):
+        assert blocklist.match(url) == reason
+
+    def test_size(self, blocklist):
+        assert blocklist.size == 4
+
+    def test_from_file(self, tmp_path):
+        path = tmp_path / "blocklist.txt"
+        path.write_text(
+            "# A comment\n"
+            "\n"
+            "example.com publisher-blocked  # Another comment\n"
+            "docs.example.com/bad malicious\n"
+            "this line is nonsense\n"
+        )
+
+        blocklist = Blocklist.from_file(path)
+
+        assert blocklist.size == 2
+        assert blocklist.match("https://www.example.com") == "publisher-blocked"
+        assert blocklist.match("https://docs.example.com/bad") == "malicious"
+
+    def test_the_dev_blocklist_loads(self):
+        blocklist = Blocklist.from_file("conf/blocklist-dev.txt")
+
+        assert blocklist.match("https://malicious.example.com/") == "malicious"
+
+    @pytest.fixture
+    def blocklist(self):
+        blocklist = Blocklist()
+        blocklist.add("example.com", "", "publisher-blocked")
+        blocklist.add("docs.example.com", "", "allowed")
+        blocklist.add("docs.example.com", "/bad", "malicious")
+        blocklist.add("docs.example.com", "/worse", "high-io")
+        return blocklist
+
+
+class TestLocalBlocklist:
+    def test_it_allows_urls_the_blocklist_allows(self, local_blocklist, check_url):
+        assert local_blocklist("https://allowed.example.com") is None
+
+        check_url.assert_not_called()
+
+    @pytest.mark.parametrize("blocked_for", (None, "lms"))
+    def test_it_blocks_urls_the_blocklist_blocks(
+        self, local_blocklist, check_url, blocked_for
+    ):
+        response = local_blocklist("https://example.com/page", blocked_for=blocked_for)
+
+        check_url.assert_not_called()
+        assert response.reason_codes == ["malicious"]
+        url = urlsplit(response.presentation_url)
+        assert (
+            url._replace(query="").geturl() == "http://checkmate.example.com/ui/block"
+        )
+        expected_query = {"url": ["https://example.com/page"], "reason": ["malicious"]}
+        if blocked_for:
+            expected_query["blocked_for"] = [blocked_for]
+        assert parse_qs(url.query) == expected_query
+
+    @pytest.mark.parametrize(
+        "url", ("https://example.org", "https://ignored.example.com")
+    )
+    def test_it_asks_checkmate_about_other_urls(self, local_blocklist, check_url, url):
+        result = local_blocklist(url, allow_all=True, blocked_for="lms")
+
+        check_url.assert_called_once_with(url=url, allow_all=True, blocked_for="lms")
+        assert result == check_url.return_value
+
+    def test_it_reloads_the_file_when_it_changes(
+        self, local_blocklist, blocklist_file, monotonic
+    ):
+        assert local_blocklist("https://new.example.org") is not None
+
+        blocklist_file.write_text("new.example.org allowed\n")
+        # Make sure the modification time changes
+        os_stat = blocklist_file.stat()
+        new_mtime = os_stat.st_mtime + 10
+        os.utime(blocklist_file, (new_mtime, new_mtime))
+
+        # Not straight away
+        assert local_blocklist("https://new.example.org") is not None
+
+        monotonic.return_value += 10
+        assert local_blocklist("https://new.example.org") is None
+
+    def test_it_does_not_reload_an_unchanged_file(
+        self, local_blocklist, monotonic, patch
+    ):
+        local_blocklist("https://example.com")
+        Blocklist = patch("viahtml.checkmate._blocklist.Blocklist")
+        monotonic.return_value += 10
+
+        local_blocklist("https://example.com")
+
+        Blocklist.from_file.assert_not_called()
+
+    def test_it_works_without_a_file(self, check_url, tmp_path, caplog):
+        local_blocklist = LocalBlocklist(
+            check_url,
+            path=tmp_path / "missing.txt",
+            checkmate_host="http://checkmate.example.com",
+        )
+
+        assert local_blocklist("https://example.com") == check_url.return_value
+        assert "Cannot find the blocklist" in caplog.text
+
+    def test_it_keeps_the_old_rules_if_the_file_is_unreadable(
+        self, local_blocklist, blocklist_file, check_url, monotonic
+    ):
+        local_blocklist("https://example.com")
+        blocklist_file.write_bytes(b"\xff\xfe\xfa")
+        new_mtime = blocklist_file.stat().st_mtime + 10
+        os.utime(blocklist_file, (new_mtime, new_mtime))
+        monotonic.return_value += 10
+
+        local_blocklist("https://example.com")
+
+        check_url.assert_not_called()
+
+    @pytest.fixture
+    def check_url(self):
+        checkmate = CheckmateClient("http://checkmate.example.com", "api_key")
+        return create_autospec(checkmate.check_url)
+
+    @pytest.fixture
+    def blocklist_file(self, tmp_path):
+        path = tmp_path / "blocklist.txt"
+        path.write_text(
+            "example.com malicious\n"
+            "allowed.example.com allowed\n"
+            "ignored.example.com publisher-blocked\n"
+        )
+        return path
+
+    @pytest.fixture
+    def local_blocklist(self, check_url, blocklist_file):
+        return LocalBlocklist(
+            check_url,
+            path=blocklist_file,
+            checkmate_host="http://checkmate.example.com/",
+            ignore_reasons="publisher-blocked,high-io",
+        )
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.checkmate._blocklist.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
@@ -0,0 +1,146 @@
+from unittest.mock import call, create_autospec
+
+import pytest
+from checkmatelib import CheckmateClient, CheckmateException
+from checkmatelib.client import BlockResponse
+
+from viahtml.checkmate import VerdictCache
+
+
+class TestVerdictCache:
+    @pytest.mark.parametrize("verdict", (None, "block_response"))
+    def test_it_returns_what_checkmate_says(self, cache, check_url, verdict, request):
+        if verdict:
+            verdict = request.getfixturevalue(verdict)
+        check_url.return_value = verdict
+
+        result = cache("https://example.com", allow_all=True, blocked_for="lms")
+
+        check_url.assert_called_once_with(
+            url="https://example.com", allow_all=True, blocked_for="lms"
+        )
+        assert result == verdict
+
+    @pytest.mark.parametrize("verdict", (None, "block_response"))
+    def test_it_remembers_verdicts(self, cache, check_url, verdict, request):
+        if verdict:
+            verdict = request.getfixturevalue(verdict)
+        check_url.return_value = verdict
+        cache("https://example.com")
+
+        result = cache("https://example.com")
+
+        check_url.assert_called_once()
+        assert result == verdict
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_it_counts_hits_and_misses(self, cache, patch):
+        metrics = patch("viahtml.checkmate._cache.metrics")
+
+        cache("https://example.com")
+        cache("https://example.com")
+
+        assert metrics.increment.call_args_list == [
+            call("checkmate_cache.misses"),
+            call("checkmate_cache.hits"),
+        ]
+
+    @pytest.mark.parametrize(
+        "url",
+        (
+            "https://example.com/path",
+            "HTTPS://EXAMPLE.COM/path",
+            "https://example.com/path#fragment",
+        ),
+    )
+    def test_it_normalizes_urls(self, cache, check_url, url):
+        cache("https://example.com/path")
+
+        cache(url)
+
+        check_url.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        (
+            {"url": "https://example.com/PATH"},
+            {"url": "https://example.com/path?query"},
+            {"url": "https://example.com/path", "allow_all": True},
+            {"url": "https://example.com/path", "blocked_for": "lms"},
+        ),
+    )
+    def test_it_does_not_share_verdicts_between_different_checks(
+        self, cache, check_url, kwargs
+    ):
+        cache("https://example.com/path")
+
+        cache(**kwargs)
+
+        assert check_url.call_count == 2
+
+    def test_it_accepts_lists_of_blocked_for(self, cache, check_url):
+        cache("https://example.com", blocked_for=["lms"])
+        cache("https://example.com", blocked_for=["lms"])
+
+        check_url.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "verdict,expires_after", ((None, 60), ("block_response", 300))
+    )
+    def test_allowed_and_blocked_verdicts_have_different_ttls(
+        self, cache, check_url, monotonic, verdict, expires_after, request
+    ):  # pylint: disable=too-many-arguments
+        if verdict:
+            check_url.return_value = request.getfixturevalue(verdict)
+        cache("https://example.com")
+
+        monotonic.return_value += expires_after - 1
+        cache("https://example.com")
+        assert check_url.call_count == 1
+
+        monotonic.return_value += 1
+        cache("https://example.com")
+        assert check_url.call_count == 2
+
+    def test_it_evicts_old_verdicts(self, check_url):
+        cache = VerdictCache(check_url, max_size=1, allowed_ttl=60, blocked_ttl=60)
+        cache("https://example.com/1")
+        cache("https://example.com/2")
+
+        cache("https://example.com/1")
+
+        assert check_url.call_count == 3
+
+    def test_it_does_not_cache_errors(self, cache, check_url):
+        check_url.side_effect = CheckmateException
+
+        for _ in range(2):
+            with pytest.raises(CheckmateException):
+                cache("https://example.com")
+
+        assert check_url.call_count == 2
+
+    def test_normalize_url_leaves_unparseable_urls_alone(self):
+        assert VerdictCache.normalize_url("https://[example.com") == (
+            "https://[example.com"
+        )
+
+    @pytest.fixture
+    def block_response(self):
+        return create_autospec(BlockResponse, instance=True, spec_set=True)
+
+    @pytest.fixture
+    def check_url(self):
+        checkmate = CheckmateClient("http://checkmate.example.com", "api_key")
+        return create_autospec(checkmate.check_url, return_value=None)
+
+    @pytest.fixture
+    def cache(self, check_url):
+        return VerdictCache(check_url, max_size=100, allowed_ttl=60, blocked_ttl=300)
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.cache.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
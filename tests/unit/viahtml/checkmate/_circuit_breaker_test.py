@@ -0,0 +1,190 @@
+from unittest.mock import create_autospec
+
+import gevent
+import pytest
+from checkmatelib import BadURL, CheckmateClient, CheckmateException
+from checkmatelib.exceptions import CheckmateServiceError
+from gevent import GreenletExit
+
+from viahtml.checkmate import CircuitBreaker, CircuitOpen
+
+
+class TestCircuitBreaker:
+    def test_it_returns_what_checkmate_says(self, breaker, check_url):
+        result = breaker("https://example.com", allow_all=True, blocked_for="lms")
+
+        check_url.assert_called_once_with(
+            url="https://example.com", allow_all=True, blocked_for="lms"
+        )
+        assert result == check_url.return_value
+        assert breaker.status == {"state": "closed", "failures": 0}
+
+    def test_it_fails_checks_which_run_over_budget(self, breaker, check_url):
+        check_url.side_effect = lambda **_kwargs: gevent.sleep(1)
+
+        with pytest.raises(CheckmateServiceError):
+            breaker("https://example.com")
+
+        assert breaker.status == {"state": "closed", "failures": 1}
+
+    def test_it_opens_after_enough_failures(self, breaker, check_url, metrics):
+        check_url.side_effect = CheckmateServiceError
+
+        for _ in range(3):
+            with pytest.raises(CheckmateServiceError):
+                breaker("https://example.com")
+
+        assert breaker.state == CircuitBreaker.OPEN
+        metrics.increment.assert_any_call("checkmate.circuit.opened")
+
+    def test_failures_must_be_in_a_row(self, breaker, check_url):
+        check_url.side_effect = [CheckmateServiceError, CheckmateServiceError, None]
+
+        for _ in range(2):
+            with pytest.raises(CheckmateServiceError):
+                breaker("https://example.com")
+        breaker("https://example.com")
+
+        assert breaker.status == {"state": "closed", "failures": 0}
+
+    def test_bad_urls_are_not_failures(self, breaker, check_url):
+        check_url.side_effect = BadURL
+
+        for _ in range(3):
+            with pytest.raises(BadURL):
+                breaker("https://example.com")
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_bad_urls_do_not_clear_the_failures(self, breaker, check_url):
+        check_url.side_effect = [CheckmateServiceError, CheckmateServiceError, BadURL]
+
+        for exception in (CheckmateServiceError, CheckmateServiceError, BadURL):
+            with pytest.raises(exception):
+                breaker("https://example.com")
+
+        assert breaker.status == {"state": "closed", "failures": 2}
+
+    def test_when_open_it_fails_without_calling_checkmate(
+        self, open_breaker, check_url, metrics
+    ):
+        check_url.reset_mock()
+
+        with pytest.raises(CircuitOpen):
+            open_breaker("https://example.com")
+
+        check_url.assert_not_called()
+        metrics.increment.assert_called_with("checkmate.circuit.rejected")
+
+    def test_circuit_open_is_a_checkmate_exception(self):
+        assert issubclass(CircuitOpen, CheckmateException)
+
+    def test_after_the_reset_timeout_a_success_closes_it(
+        self, open_breaker, check_url, monotonic
+    ):
+        check_url.side_effect = None
+        monotonic.return_value += 10
+
+        result = open_breaker("https://example.com")
+
+        assert result == check_url.return_value
+        assert open_breaker.status == {"state": "closed", "failures": 0}
+
+    def test_after_the_reset_timeout_a_failure_opens_it_again(
+        self, open_breaker, monotonic
+    ):
+        monotonic.return_value += 10
+
+        with pytest.raises(CheckmateServiceError):
+            open_breaker("https://example.com")
+
+        assert open_breaker.state == CircuitBreaker.OPEN
+        monotonic.return_value += 9
+        with pytest.raises(CircuitOpen):
+            open_breaker("https://example.com")
+
+    def test_only_one_check_tries_a_half_open_circuit(
+        self, open_breaker, check_url, monotonic
+    ):
+        monotonic.return_value += 10
+
+        def check_url_during_trial(**_kwargs):
+            assert open_breaker.state == CircuitBreaker.HALF_OPEN
+            with pytest.raises(CircuitOpen):
+                open_breaker("https://example.com")
+
+        check_url.side_effect = check_url_during_trial
+
+        open_breaker("https://example.com")
+
+        assert open_breaker.state == CircuitBreaker.CLOSED
+
+    def test_a_bad_url_during_the_trial_does_not_close_it(
+        self, open_breaker, check_url, monotonic
+    ):
+        monotonic.return_value += 10
+        check_url.side_effect = BadURL
+
+        with pytest.raises(BadURL):
+            open_breaker("https://example.com")
+
+        assert open_breaker.status == {"state": "open", "failures": 3}
+        # The next check is the trial instead
+        check_url.side_effect = CheckmateServiceError
+        with pytest.raises(CheckmateServiceError):
+            open_breaker("https://example.com")
+        assert check_url.call_count == 5
+        assert open_breaker.state == CircuitBreaker.OPEN
+
+    @pytest.mark.parametrize("exception", (ValueError, GreenletExit))
+    def test_it_does_not_get_stuck_half_open(
+        self, open_breaker, check_url, monotonic, exception
+    ):
+        monotonic.return_value += 10
+        check_url.side_effect = exception
+
+        with pytest.raises(exception):
+            open_breaker("https://example.com")
+
+        assert open_breaker.state == CircuitBreaker.OPEN
+        monotonic.return_value += 9
+        with pytest.raises(CircuitOpen):
+            open_breaker("https://example.com")
+
+    def test_other_errors_do_not_open_a_closed_circuit(self, breaker, check_url):
+        check_url.side_effect = ValueError
+
+        with pytest.raises(ValueError):
+            breaker("https://example.com")
+
+        assert breaker.status == {"state": "closed", "failures": 0}
+
+    @pytest.fixture
+    def check_url(self):
+        checkmate = CheckmateClient("http://checkmate.example.com", "api_key")
+        return create_autospec(checkmate.check_url)
+
+    @pytest.fixture
+    def breaker(self, check_url):
+        return CircuitBreaker(
+            check_url, timeout=0.01, failure_threshold=3, reset_timeout=10
+        )
+
+    @pytest.fixture
+    def open_breaker(self, breaker, check_url):
+        check_url.side_effect = CheckmateServiceError
+        for _ in range(3):
+            with pytest.raises(CheckmateServiceError):
+                breaker("https://example.com")
+
+        return breaker
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.checkmate._circuit_breaker.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
+
+    @pytest.fixture(autouse=True)
+    def metrics(self, patch):
+        return patch("viahtml.checkmate._circuit_breaker.metrics")
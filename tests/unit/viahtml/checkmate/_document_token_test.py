@@ -0,0 +1,107 @@
+import pytest
+
+from viahtml.checkmate import DocumentTokens
+
+
+class TestDocumentTokens:
+    def test_make_cookie(self, tokens):
+        cookie = tokens.make_cookie("https://example.com/page")
+
+        name, _, attributes = cookie.partition("=")
+        assert name.startswith(DocumentTokens.COOKIE_PREFIX)
+        assert attributes.endswith("; Max-Age=60; Path=/; HttpOnly; SameSite=Lax")
+
+    def test_it_verifies_its_own_tokens(self, tokens):
+        cookie_header = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+
+        assert tokens.is_verified("https://example.com/page", cookie_header)
+
+    def test_it_verifies_tokens_for_equivalent_urls(self, tokens):
+        cookie_header = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+
+        assert tokens.is_verified("HTTPS://EXAMPLE.COM/page#foo", cookie_header)
+
+    def test_it_verifies_tokens_among_other_cookies(self, tokens):
+        cookie = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+
+        assert tokens.is_verified("https://example.com/page", f"a=1; {cookie}; b=2")
+
+    def test_tokens_are_specific_to_a_url(self, tokens):
+        cookie_header = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+
+        assert not tokens.is_verified("https://example.com/other", cookie_header)
+
+    def test_tokens_are_specific_to_a_secret(self, tokens):
+        other_tokens = DocumentTokens("other_secret", ttl=60)
+        cookie_header = as_cookie_header(
+            other_tokens.make_cookie("https://example.com/page")
+        )
+
+        assert not tokens.is_verified("https://example.com/page", cookie_header)
+
+    def test_tokens_expire(self, tokens, time):
+        cookie_header = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+
+        time.return_value += 60
+
+        assert not tokens.is_verified("https://example.com/page", cookie_header)
+
+    def test_tokens_cannot_be_extended(self, tokens):
+        cookie_header = as_cookie_header(tokens.make_cookie("https://example.com/page"))
+        name, _, token = cookie_header.partition("=")
+        expires_at, _, signature = token.partition(".")
+
+        cookie_header = f"{name}={int(expires_at) + 1000}.{signature}"
+
+        assert not tokens.is_verified("https://example.com/page", cookie_header)
+
+    @pytest.mark.parametrize(
+        "url,cookie_header",
+        (
+            (None, "a=b"),
+            ("https://example.com/page", None),
+            ("https://example.com/page", ""),
+            ("https://example.com/page", "a=b"),
+            ("https://example.com/page", '"invalid"cookie="'),
+            ("https://example.com/page", "illegal<name=value"),
+        ),
+    )
+    def test_it_does_not_verify_requests_without_tokens(
+        self, tokens, url, cookie_header
+    ):
+        assert not tokens.is_verified(url, cookie_header)
+
+    def test_it_does_not_verify_malformed_tokens(self, tokens):
+        name, _, _ = tokens.make_cookie("https://example.com/page").partition("=")
+
+        assert not tokens.is_verified("https://example.com/page", f"{name}=nonsense")
+
+    @pytest.mark.parametrize(
+        "cookie_header,expected",
+        (
+            ("a=1; b=2", "a=1; b=2"),
+            ("via.verified.abc=1.2", ""),
+            ("a=1; via.verified.abc=1.2; b=2", "a=1; b=2"),
+            ("via.verified.abc=1.2; a=1", "a=1"),
+            ("a=1; via.verified.abc=1.2", "a=1"),
+            ("a=1; via.verified.abc=1.2; via.verified.def=3.4", "a=1"),
+            ("not.via.verified.abc=1.2", "not.via.verified.abc=1.2"),
+        ),
+    )
+    def test_strip(self, cookie_header, expected):
+        assert DocumentTokens.strip(cookie_header) == expected
+
+    @pytest.fixture
+    def tokens(self):
+        return DocumentTokens("secret", ttl=60)
+
+    @pytest.fixture(autouse=True)
+    def time(self, patch):
+        time = patch("viahtml.checkmate._document_token.time")
+        time.return_value = 1000
+        return time
+
+
+def as_cookie_header(set_cookie):
+    """Get the `Cookie` header a browser would send for a `Set-Cookie`."""
+    return set_cookie.split(";")[0]
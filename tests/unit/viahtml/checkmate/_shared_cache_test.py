@@ -0,0 +1,146 @@
+import json
+from unittest.mock import call, create_autospec
+
+import pytest
+from checkmatelib import CheckmateClient, CheckmateException
+from checkmatelib.client import BlockResponse
+from h_matchers import Any
+
+from viahtml.checkmate import SharedVerdictCache
+
+
+class TestSharedVerdictCache:
+    def test_it_returns_what_checkmate_says(self, cache, check_url):
+        result = cache("https://example.com", allow_all=True, blocked_for="lms")
+
+        check_url.assert_called_once_with(
+            url="https://example.com", allow_all=True, blocked_for="lms"
+        )
+        assert result is None
+
+    def test_it_shares_allowed_verdicts(self, cache, check_url, uwsgi):
+        cache("https://example.com")
+
+        # A different instance, as if in a different worker
+        result = SharedVerdictCache(
+            check_url, cache_name="checkmate", allowed_ttl=60, blocked_ttl=300
+        )("https://example.com")
+
+        check_url.assert_called_once()
+        assert result is None
+        uwsgi.cache_update.assert_called_once_with(Any.string(), Any(), 60, "checkmate")
+
+    def test_it_counts_hits_and_misses(self, cache, patch):
+        metrics = patch("viahtml.checkmate._shared_cache.metrics")
+
+        cache("https://example.com")
+        cache("https://example.com")
+
+        assert metrics.increment.call_args_list == [
+            call("checkmate_shared_cache.misses"),
+            call("checkmate_shared_cache.hits"),
+        ]
+
+    def test_it_shares_blocked_verdicts(self, cache, check_url, uwsgi):
+        check_url.return_value = BlockResponse(
+            {
+                "data": [{"id": "malicious"}, {"id": "other"}],
+                "links": {"html": "http://checkmate.example.com/block"},
+            }
+        )
+        cache("https://example.com")
+
+        result = cache("https://example.com")
+
+        check_url.assert_called_once()
+        assert result.presentation_url == "http://checkmate.example.com/block"
+        assert result.reason_codes == ["malicious", "other"]
+        uwsgi.cache_update.assert_called_once_with(
+            Any.string(), Any(), 300, "checkmate"
+        )
+
+    def test_it_ignores_expired_verdicts(self, cache, check_url, time):
+        cache("https://example.com")
+
+        time.return_value += 60
+        cache("https://example.com")
+
+        assert check_url.call_count == 2
+
+    def test_it_ignores_unreadable_verdicts(self, cache, check_url, uwsgi):
+        uwsgi.cache_get.side_effect = None
+        uwsgi.cache_get.return_value = b"not json"
+
+        cache("https://example.com")
+
+        check_url.assert_called_once()
+
+    def test_it_uses_short_keys(self, cache, uwsgi):
+        cache("https://example.com/" + "a" * 5000)
+
+        key = uwsgi.cache_update.call_args[0][0]
+        assert len(key) == 64
+
+    def test_it_stores_the_expiry_time(self, cache, uwsgi, time):
+        cache("https://example.com")
+
+        value = uwsgi.cache_update.call_args[0][1]
+        assert json.loads(value) == {
+            "expires_at": time.return_value + 60,
+            "block": None,
+        }
+
+    def test_it_does_not_store_verdicts_with_no_ttl(self, check_url, uwsgi):
+        cache = SharedVerdictCache(
+            check_url, cache_name="checkmate", allowed_ttl=0, blocked_ttl=0
+        )
+
+        cache("https://example.com")
+
+        uwsgi.cache_update.assert_not_called()
+
+    def test_it_does_not_cache_errors(self, cache, check_url, uwsgi):
+        check_url.side_effect = CheckmateException
+
+        with pytest.raises(CheckmateException):
+            cache("https://example.com")
+
+        uwsgi.cache_update.assert_not_called()
+
+    def test_is_supported(self):
+        assert SharedVerdictCache.is_supported()
+
+    def test_is_supported_outside_uwsgi(self, monkeypatch):
+        monkeypatch.setattr("viahtml.checkmate._shared_cache.uwsgi", None)
+
+        assert not SharedVerdictCache.is_supported()
+
+    @pytest.fixture
+    def check_url(self):
+        checkmate = CheckmateClient("http://checkmate.example.com", "api_key")
+        return create_autospec(checkmate.check_url, return_value=None)
+
+    @pytest.fixture
+    def cache(self, check_url):
+        return SharedVerdictCache(
+            check_url, cache_name="checkmate", allowed_ttl=60, blocked_ttl=300
+        )
+
+    @pytest.fixture(autouse=True)
+    def uwsgi(self, patch):
+        uwsgi = patch("viahtml.checkmate._shared_cache.uwsgi", autospec=False)
+
+        # Behave like a real uWSGI cache, minus expiry
+        items = {}
+        uwsgi.cache_get.side_effect = lambda key, cache_name: items.get(key)
+        uwsgi.cache_update.side_effect = (
+            lambda key, value, expires, cache_name: items.update({key: value})
+        )
+
+        return uwsgi
+
+    @pytest.fixture(autouse=True)
+    def time(self, patch):
+        time = patch("viahtml.checkmate._shared_cache.time")
+        time.return_value = 1000
+        return time
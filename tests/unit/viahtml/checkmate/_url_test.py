@@ -0,0 +1,32 @@
+import pytest
+from checkmatelib import BadURL
+
+from viahtml.checkmate import check_public_url
+
+
+class TestCheckPublicURL:
+    @pytest.mark.parametrize(
+        "url",
+        (
+            "https://example.com/page",
+            "http://8.8.8.8/",
+            # Allowed for local testing, like `CheckmateClient` does
+            "http://localhost:8197/page",
+        ),
+    )
+    def test_it_allows_public_urls(self, url):
+        check_public_url(url)
+
+    @pytest.mark.parametrize(
+        "url",
+        (
+            "http://10.0.0.1/",
+            "http://192.168.1.1/admin",
+            "http://[::1]/",
+            "http://internal/",
+            "http://169.254.169.254/latest/meta-data",
+        ),
+    )
+    def test_it_rejects_private_urls(self, url):
+        with pytest.raises(BadURL):
+            check_public_url(url)
@@ -0,0 +1,200 @@
+import zlib
+from unittest.mock import create_autospec, sentinel
+
+import brotli
+import pytest
+from h_matchers import Any
+
+from viahtml.compression import Compression
+
+BODY = [b"<html><head>", b"", b"<title>Hello</title></head>" * 100, b"</html>"]
+
+
+class TestCompression:
+    @pytest.mark.parametrize(
+        "accept_encoding,encoding",
+        (
+            ("gzip, deflate, br", "br"),
+            ("gzip", "gzip"),
+            ("GZIP;q=0.5", "gzip"),
+            ("br;q=0, gzip", "gzip"),
+            ("br;q=nonsense, gzip", "gzip"),
+            ("gzip;foo=bar", "gzip"),
+            ("*", "br"),
+            ("*, br;q=0", "gzip"),
+        ),
+    )
+    def test_it_picks_an_encoding(
+        self, compression, start_response, environ, accept_encoding, encoding
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        environ["HTTP_ACCEPT_ENCODING"] = accept_encoding
+
+        compressing_start_response, _ = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        start_response.assert_called_once_with(
+            "200 OK",
+            [
+                ("Content-Type", "text/html"),
+                ("Content-Encoding", encoding),
+                ("Vary", "Accept-Encoding"),
+            ],
+        )
+
+    @pytest.mark.parametrize(
+        "accept_encoding", (None, "", "identity", "deflate", "gzip;q=0, br;q=0.0")
+    )
+    def test_it_does_not_compress_without_an_accepted_encoding(
+        self, compression, start_response, environ, accept_encoding
+    ):
+        environ.pop("HTTP_ACCEPT_ENCODING")
+        if accept_encoding is not None:
+            environ["HTTP_ACCEPT_ENCODING"] = accept_encoding
+
+        self.assert_not_compressed(compression, start_response, environ)
+
+    @pytest.mark.parametrize(
+        "gzip_level,brotli_quality,encoding", ((6, 0, "gzip"), (0, 4, "br"))
+    )
+    def test_it_only_uses_enabled_encodings(
+        self, start_response, environ, gzip_level, brotli_quality, encoding
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        compression = Compression(gzip_level=gzip_level, brotli_quality=brotli_quality)
+
+        compressing_start_response, _ = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        start_response.assert_called_once_with(
+            "200 OK", Any.list.containing([("Content-Encoding", encoding)])
+        )
+
+    def test_it_does_not_compress_responses_to_head_requests(
+        self, compression, start_response, environ
+    ):
+        environ["REQUEST_METHOD"] = "HEAD"
+
+        self.assert_not_compressed(compression, start_response, environ)
+
+    @pytest.mark.parametrize(
+        "status,headers",
+        (
+            ("200 OK", [("Content-Type", "image/png")]),
+            ("200 OK", []),
+            ("200 OK", [("Content-Type", "text/html"), ("Content-Length", "1023")]),
+            ("200 OK", [("Content-Type", "text/html"), ("Content-Encoding", "gzip")]),
+            ("304 Not Modified", [("Content-Type", "text/html")]),
+            ("206 Partial Content", [("Content-Type", "text/html")]),
+        ),
+    )
+    def test_it_does_not_compress_some_responses(
+        self, compression, start_response, environ, status, headers
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response(status, headers)
+
+        start_response.assert_called_once_with(status, headers)
+        assert compress(sentinel.body) == sentinel.body
+
+    def test_it_removes_the_content_length(self, compression, start_response, environ):
+        compressing_start_response, _ = compression(environ, start_response)
+        compressing_start_response(
+            "200 OK",
+            [
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Content-Length", "1024"),
+            ],
+        )
+
+        start_response.assert_called_once_with(
+            "200 OK",
+            [
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Content-Encoding", "br"),
+                ("Vary", "Accept-Encoding"),
+            ],
+        )
+
+    def test_it_passes_on_exc_info(self, compression, start_response, environ):
+        compressing_start_response, _ = compression(environ, start_response)
+        compressing_start_response("500 Error", [], sentinel.exc_info)
+
+        start_response.assert_called_once_with("500 Error", [], sentinel.exc_info)
+
+    @pytest.mark.parametrize(
+        "accept_encoding,decompress",
+        (
+            ("br", brotli.decompress),
+            ("gzip", lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS)),
+        ),
+    )
+    def test_it_compresses_the_body(
+        self, compression, start_response, environ, accept_encoding, decompress
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        environ["HTTP_ACCEPT_ENCODING"] = accept_encoding
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        chunks = list(compress(BODY))
+
+        assert decompress(b"".join(chunks)) == b"".join(BODY)
+        assert len(b"".join(chunks)) < len(b"".join(BODY))
+
+    def test_it_sends_each_chunk_on_as_it_goes(
+        self, compression, start_response, environ
+    ):
+        environ["HTTP_ACCEPT_ENCODING"] = "gzip"
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        first_chunk = next(iter(compress(BODY)))
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert decompressor.decompress(first_chunk) == BODY[0]
+
+    def test_it_closes_the_body(self, compression, start_response, environ):
+        body = create_autospec(_Body, instance=True, spec_set=True)
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        compress(body).close()
+
+        body.close.assert_called_once_with()
+
+    def test_it_closes_bodies_without_close(self, compression, start_response, environ):
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        compress(BODY).close()
+
+    def assert_not_compressed(self, compression, start_response, environ):
+        compressing_start_response, compress = compression(environ, start_response)
+        compressing_start_response("200 OK", [("Content-Type", "text/html")])
+
+        start_response.assert_called_once_with(
+            "200 OK", [("Content-Type", "text/html")]
+        )
+        assert compress(sentinel.body) == sentinel.body
+
+    @pytest.fixture
+    def compression(self):
+        return Compression()
+
+    @pytest.fixture
+    def start_response(self):
+        return create_autospec(
+            lambda status, headers, exc_info=None: None
+        )  # pragma: no cover
+
+    @pytest.fixture
+    def environ(self):
+        return {"REQUEST_METHOD": "GET", "HTTP_ACCEPT_ENCODING": "gzip, deflate, br"}
+
+
+class _Body:
+    """The interface of a WSGI response body we care about."""
+
+    def __iter__(self):  # pragma: no cover
+        return iter([])
+
+    def close(self):  # pragma: no cover
+        pass
@@ -1,6 +1,7 @@
 from http import HTTPStatus
 
 import pytest
+from h_matchers import Any
 
 from viahtml.context import Context
 
@@ -74,6 +75,26 @@ class TestContext:
 
         assert url == proxied_url
 
+    @pytest.mark.parametrize(
+        "referrer,proxied_referrer",
+        (
+            (None, None),
+            ("http://via/", None),
+            ("http://via/?via.config=1", None),
+            ("http://example.com/http://example.com", None),
+            ("http://via/proxy/http://example.com", "http://example.com"),
+            (
+                "http://via/proxy/mp_/http://example.com?via.config=1",
+                "http://example.com",
+            ),
+        ),
+    )
+    def test_proxied_referrer(self, context, environ, referrer, proxied_referrer):
+        if referrer:
+            environ["HTTP_REFERER"] = referrer
+
+        assert context.proxied_referrer == proxied_referrer
+
     def test_make_response(self, context, start_response):
         context.headers = [("X-Boo", "Boo")]
 
@@ -217,3 +238,107 @@ class TestContext:
     @pytest.fixture
     def wsgi(self, patch):
         return patch("viahtml.context.wsgi")
+
+
+class TestContextTimings:
+    def test_timed(self, context, perf_counter):
+        perf_counter.side_effect = [1.0, 1.25, 2.0, 2.5]
+
+        with context.timed("upstream"):
+            pass
+        with pytest.raises(ValueError):
+            with context.timed("upstream"):
+                raise ValueError()
+
+        assert context.timings == {"upstream": 0.75}
+
+    def test_add_timing(self, context):
+        context.add_timing("upstream", 0.25)
+        context.add_timing("rewrite", 0.125)
+        context.add_timing("rewrite", 0.125)
+
+        assert context.timings == {"upstream": 0.25, "rewrite": 0.25}
+
+    def test_server_timing(self, context):
+        context.add_timing("upstream", 0.25)
+        context.add_timing("views", 0.00012)
+
+        assert context.server_timing == "upstream;dur=250.0, views;dur=0.1"
+
+    @pytest.fixture
+    def context(self, start_response):
+        return Context(debug=True, http_environ={}, start_response=start_response)
+
+    @pytest.fixture
+    def perf_counter(self, patch):
+        return patch("viahtml.context.perf_counter")
+
+
+class TestContextProperties:
+    def test_properties_are_only_calculated_once(self, context, wsgi):
+        assert context.path is context.path
+
+        wsgi.get_path_info.assert_called_once()
+
+    def test_properties_are_calculated_for_each_context(
+        self, context, environ, start_response
+    ):
+        other_context = Context(
+            debug=True,
+            http_environ=dict(environ, PATH_INFO="/other"),
+            start_response=start_response,
+        )
+
+        assert (context.path, other_context.path) == ("/", "/other")
+
+    def test_properties_are_read_only(self, context):
+        with pytest.raises(AttributeError):
+            context.path = "/other"
+
+    @pytest.fixture
+    def environ(self):
+        return {"PATH_INFO": "/"}
+
+    @pytest.fixture
+    def context(self, environ, start_response):
+        return Context(debug=True, http_environ=environ, start_response=start_response)
+
+    @pytest.fixture
+    def wsgi(self, patch):
+        return patch("viahtml.context.wsgi")
+
+
+class TestGetConfig:
+    def test_get_config(self, environ):
+        environ["QUERY_STRING"] = "via.proxy_frames=0&via.client.openSidebar=1"
+
+        via_config, client_config = Context.get_config(environ)
+
+        assert via_config == {"proxy_frames": "0"}
+        assert client_config == Any.dict.containing({"openSidebar": "1"})
+
+    def test_get_config_only_parses_the_config_once(self, environ, Configuration):
+        first = Context.get_config(environ)
+        second = Context.get_config(environ)
+
+        Configuration.extract_from_wsgi_environment.assert_called_once_with(environ)
+        assert (
+            first == second == Configuration.extract_from_wsgi_environment.return_value
+        )
+
+    def test_get_config_parses_the_config_again_if_the_query_changes(
+        self, environ, Configuration
+    ):
+        Context.get_config(environ)
+        environ["QUERY_STRING"] = "via.proxy_frames=0"
+        Context.get_config(environ)
+
+        assert Configuration.extract_from_wsgi_environment.call_count == 2
+
+    @pytest.fixture
+    def Configuration(self, patch):
+        return patch("viahtml.context.Configuration")
+
+    @pytest.fixture
+    def environ(self):
+        return {"QUERY_STRING": ""}
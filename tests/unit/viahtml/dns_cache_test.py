@@ -0,0 +1,106 @@
+import socket
+
+import pytest
+
+from viahtml.dns_cache import DNSCache
+
+
+class TestDNSCache:
+    def test_it_looks_up_hosts(self, dns_cache, getaddrinfo, metrics):
+        addresses = dns_cache.resolve("example.com", 443)
+
+        getaddrinfo.assert_called_once_with(
+            "example.com", 443, socket.AF_INET, socket.SOCK_STREAM
+        )
+        assert addresses == ["192.0.2.1", "192.0.2.2"]
+        metrics.increment.assert_called_once_with("dns_cache.misses")
+
+    def test_it_remembers_hosts(self, dns_cache, getaddrinfo, metrics):
+        dns_cache.resolve("example.com", 443)
+
+        addresses = dns_cache.resolve("example.com", 443)
+
+        getaddrinfo.assert_called_once()
+        assert addresses == ["192.0.2.1", "192.0.2.2"]
+        metrics.increment.assert_called_with("dns_cache.hits")
+
+    def test_it_looks_up_hosts_again_after_the_ttl(
+        self, dns_cache, getaddrinfo, monotonic
+    ):
+        dns_cache.resolve("example.com", 443)
+        monotonic.return_value += 31
+
+        dns_cache.resolve("example.com", 443)
+
+        assert getaddrinfo.call_count == 2
+
+    def test_it_remembers_hosts_which_cannot_be_found(
+        self, dns_cache, getaddrinfo, metrics
+    ):
+        getaddrinfo.side_effect = socket.gaierror(socket.EAI_NONAME, "Not found")
+
+        for _ in range(2):
+            with pytest.raises(socket.gaierror, match="Not found"):
+                dns_cache.resolve("example.com", 443)
+
+        getaddrinfo.assert_called_once()
+        metrics.increment.assert_any_call("dns_cache.failures")
+
+    def test_it_looks_up_missing_hosts_again_after_the_negative_ttl(
+        self, dns_cache, getaddrinfo, monotonic
+    ):
+        getaddrinfo.side_effect = socket.gaierror(socket.EAI_NONAME, "Not found")
+        with pytest.raises(socket.gaierror):
+            dns_cache.resolve("example.com", 443)
+        monotonic.return_value += 6
+        getaddrinfo.side_effect = None
+
+        assert dns_cache.resolve("example.com", 443) == ["192.0.2.1", "192.0.2.2"]
+
+    def test_it_can_forget_hosts(self, dns_cache, getaddrinfo):
+        dns_cache.resolve("example.com", 443)
+
+        dns_cache.forget("example.com", 443)
+        dns_cache.resolve("example.com", 443)
+
+        assert getaddrinfo.call_count == 2
+
+    def test_it_only_remembers_so_many_hosts(self, getaddrinfo):
+        dns_cache = DNSCache(max_size=1, ttl=30, negative_ttl=5)
+
+        dns_cache.resolve("example.com", 443)
+        dns_cache.resolve("example.org", 443)
+        dns_cache.resolve("example.com", 443)
+
+        assert getaddrinfo.call_count == 3
+
+    @pytest.fixture
+    def dns_cache(self):
+        return DNSCache(max_size=10, ttl=30, negative_ttl=5)
+
+    @pytest.fixture(autouse=True)
+    def getaddrinfo(self, patch):
+        getaddrinfo = patch("viahtml.dns_cache.socket.getaddrinfo")
+        getaddrinfo.return_value = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 443)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.2", 443)),
+            # The same address for another protocol
+            (socket.AF_INET, socket.SOCK_STREAM, 132, "", ("192.0.2.1", 443)),
+        ]
+        return getaddrinfo
+
+    @pytest.fixture(autouse=True)
+    def allowed_gai_family(self, patch):
+        return patch(
+            "viahtml.dns_cache.allowed_gai_family", return_value=socket.AF_INET
+        )
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.cache.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
+
+    @pytest.fixture(autouse=True)
+    def metrics(self, patch):
+        return patch("viahtml.dns_cache.metrics")
@@ -32,6 +32,53 @@ class TestHeaders:
             "HTTP_X_COMPLAINTS_TO": "https://web.hypothes.is/report-abuse/",
         }
 
+    def test_modify_inbound_applies_rules(self):
+        headers = Headers(
+            inbound_rules=[
+                "block X-Forwarded-Host",
+                "rename X-Real-Ip X-Original-Ip",
+                "inject X-Via html, with spaces",
+                "inject X-Abuse-Policy https://example.com/abuse-policy",
+            ]
+        )
+        http_env = {
+            "HTTP_OTHER_HEADER": "ok",
+            "HTTP_X_FORWARDED_HOST": "example.com",
+            "HTTP_X_REAL_IP": "127.0.0.1",
+            "HTTP_CF_RAY": "abc",
+        }
+
+        http_env = headers.modify_inbound(http_env)
+
+        assert http_env == {
+            "HTTP_OTHER_HEADER": "ok",
+            "HTTP_X_ORIGINAL_IP": "127.0.0.1",
+            "HTTP_X_VIA": "html, with spaces",
+            "HTTP_X_ABUSE_POLICY": "https://example.com/abuse-policy",
+            "HTTP_X_COMPLAINTS_TO": "https://web.hypothes.is/report-abuse/",
+        }
+
+    def test_modify_inbound_only_renames_headers_which_are_there(self):
+        headers = Headers(inbound_rules=["rename X-Real-Ip X-Original-Ip"])
+
+        http_env = headers.modify_inbound({})
+
+        assert "HTTP_X_ORIGINAL_IP" not in http_env
+
+    @pytest.mark.parametrize(
+        "rule",
+        (
+            "block",
+            "block X-One X-Two",
+            "rename X-One",
+            "inject X-One",
+            "remove X-One",
+        ),
+    )
+    def test_it_rejects_bad_inbound_rules(self, rule):
+        with pytest.raises(ValueError):
+            Headers(inbound_rules=[rule])
+
     @pytest.mark.parametrize(
         "header_name", Headers.BLOCKED_OUTBOUND | {"X-Archive-Anything-At-All"}
     )
@@ -50,6 +97,37 @@ class TestHeaders:
         assert blocked_header not in modified_headers
         assert expected_header in modified_headers
 
+    def test_modify_outbound_adds_extra_headers(self, headers):
+        modified_headers = headers.modify_outbound(
+            [("Content-Type", "text/html"), ("X-Archive-Orig-Server", "nginx")],
+            [("X-Via-Debug", "1"), ("Link", "blocked")],
+        )
+
+        assert modified_headers == [
+            ("Content-Type", "text/html"),
+            ("X-Via-Debug", "1"),
+            *Headers.ADDED_OUTBOUND,
+        ]
+
+    def test_modify_outbound_gives_the_same_answer_for_known_headers(self, headers):
+        original_headers = [("Link", "blocked"), ("Other-Header", "ok")]
+
+        assert headers.modify_outbound(original_headers) == headers.modify_outbound(
+            original_headers
+        )
+
+    def test_modify_outbound_does_not_remember_too_many_headers(
+        self, headers, monkeypatch
+    ):
+        monkeypatch.setattr(Headers, "MAX_KNOWN_OUTBOUND", 1)
+
+        modified_headers = headers.modify_outbound(
+            [("Header-1", "ok"), ("Link", "blocked"), ("Link", "blocked")]
+        )
+
+        assert modified_headers == [("Header-1", "ok"), *Headers.ADDED_OUTBOUND]
+        assert len(headers._keep_outbound) == 1  # pylint:disable=protected-access
+
     def test_cache_control_header_is_set_to_no_store(self, headers):
         modified_headers = headers.modify_outbound(tuple())
 
@@ -1,24 +1,94 @@
+import random
 from unittest.mock import create_autospec, patch, sentinel
 
+import gevent
 import pytest
 from h_matchers import Any
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
 from pywb.apps.wbrequestresponse import WbResponse
 from warcio.statusandheaders import StatusAndHeaders
 
+from viahtml import static_manifest
 from viahtml.context import Context
 from viahtml.hooks import Hooks
 from viahtml.hooks.hooks import MEDIA_EMBED_PREFIXES
 
 
-class TestHooks:
+class TestHooks:  # pylint:disable=too-many-public-methods
+    def test_context_is_None_before_it_is_set(self):
+        assert Hooks({}).context is None
+
+    def test_set_context(self, hooks, context):
+        assert hooks.context == context
+
+    def test_concurrent_requests_each_see_their_own_context(self, hooks):
+        def handle_request(request_number):
+            context = create_autospec(Context, instance=True, spec_set=True)
+            context.make_absolute.side_effect = (
+                lambda url, **_: f"{url}#{request_number}"
+            )
+            hooks.set_context(context)
+
+            hrefs = []
+            for _ in range(5):
+                # Let other requests run, as they would while we wait on IO
+                gevent.sleep(random.random() / 1000)
+                attrs, _ = hooks.modify_tag_attrs("a", [("href", "http://example.com")])
+                hrefs.append(attrs[0][1])
+
+            return hrefs
+
+        requests = [gevent.spawn(handle_request, number) for number in range(200)]
+        for number, request in enumerate(requests):
+            assert request.get() == [f"http://example.com#{number}"] * 5
+
+    def test_timed_times_the_current_request(self, hooks, context):
+        assert hooks.timed("upstream") == context.timed.return_value
+        context.timed.assert_called_once_with("upstream")
+
+    def test_timed_does_nothing_without_a_request(self):
+        with Hooks({}).timed("upstream"):
+            pass
+
+    def test_headers(self, hooks):
+        assert hooks.headers is Hooks.headers
+
+    def test_headers_with_inbound_rules(self):
+        hooks = Hooks({"inbound_header_rules": ["block X-Forwarded-Host"]})
+
+        http_env = hooks.headers.modify_inbound({"HTTP_X_FORWARDED_HOST": "a"})
+
+        assert "HTTP_X_FORWARDED_HOST" not in http_env
+        assert hooks.headers is not Hooks.headers
+
     def test_template_vars(self, hooks):
         assert hooks.template_vars == {
             "client_params": Any.function(),
             "external_link_mode": Any.function(),
             "h_embed_url": sentinel.h_embed_url,
             "ignore_prefixes": hooks.ignore_prefixes,
+            "ignore_prefixes_json": htmlsafe_json_dumps(hooks.ignore_prefixes),
+            "static_file": Any.instance_of(static_manifest.StaticManifest),
         }
 
+    def test_ignore_prefixes_json_in_template_vars_is_safe_in_scripts(self, hooks):
+        hooks.config["ignore_prefixes"] = ["https://example.com/</script>"]
+
+        ignore_prefixes_json = hooks.template_vars["ignore_prefixes_json"]
+
+        assert "</script>" not in ignore_prefixes_json
+        # So templates don't escape it again
+        assert isinstance(ignore_prefixes_json, Markup)
+
+    def test_static_file_in_template_vars(self, hooks, StaticManifest):
+        hooks.config["static_manifest"] = sentinel.static_manifest
+
+        static_file = hooks.template_vars["static_file"]
+
+        StaticManifest.load.assert_called_once_with(sentinel.static_manifest)
+        assert static_file == StaticManifest.load.return_value
+
     def test_client_params_in_template_vars(self, hooks):
         with patch.object(hooks, "get_config") as get_config:
             get_config.return_value = ["via", "client"]
@@ -50,13 +120,20 @@ class TestHooks:
     def test_ignore_prefixes(self, hooks, ignore_prefixes):
         assert hooks.ignore_prefixes == ignore_prefixes + MEDIA_EMBED_PREFIXES
 
-    def test_get_config(self, Configuration, hooks):
-        config = hooks.get_config(sentinel.http_env)
+    def test_head_flush_size(self, hooks):
+        hooks.config["head_flush_size"] = 2048
 
-        Configuration.extract_from_wsgi_environment.assert_called_once_with(
-            sentinel.http_env
-        )
-        assert config == Configuration.extract_from_wsgi_environment.return_value
+        assert hooks.head_flush_size == 2048
+
+    def test_head_flush_size_defaults_to_off(self, hooks):
+        assert not hooks.head_flush_size
+
+    def test_get_config(self, hooks):
+        with patch.object(Context, "get_config") as get_config:
+            config = hooks.get_config(sentinel.http_env)
+
+        get_config.assert_called_once_with(sentinel.http_env)
+        assert config == get_config.return_value
 
     def test_get_upstream_url(self, hooks, Configuration):
         config = hooks.get_upstream_url(sentinel.doc_url)
@@ -126,6 +203,26 @@ class TestHooks:
         location = response.status_headers.get_header("Location")
         assert location == "foo"
 
+    @pytest.mark.parametrize(
+        "content_type,head_flush_size,buffering",
+        (
+            ("text/html; charset=utf-8", 2048, "no"),
+            ("text/html; charset=utf-8", 0, None),
+            ("image/png", 2048, None),
+            (None, 2048, None),
+        ),
+    )
+    def test_modify_render_response_stops_nginx_buffering_pages(
+        self, hooks, wb_response, content_type, head_flush_size, buffering
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        hooks.config["head_flush_size"] = head_flush_size
+        if content_type:
+            wb_response.status_headers.add_header("Content-Type", content_type)
+
+        response = hooks.modify_render_response(wb_response)
+
+        assert response.status_headers.get_header("X-Accel-Buffering") == buffering
+
     @pytest.mark.parametrize(
         "tag,attrs,expected_new_attrs,expected_stop",
         (
@@ -222,6 +319,37 @@ class TestHooks:
         _, stop = hooks.modify_tag_attrs("img", [])
         assert stop == expected_stop
 
+    @pytest.mark.parametrize("tag", ("div", "a", "img"))
+    def test_modify_tag_attrs_returns_unchanged_attrs_as_they_are(self, hooks, tag):
+        attrs = [("class", "foo"), ("id", "bar")]
+
+        new_attrs, _ = hooks.modify_tag_attrs(tag, attrs)
+
+        assert new_attrs is attrs
+
+    def test_modify_tag_attrs_rewrites_referrerpolicy_on_any_tag(self, hooks):
+        new_attrs, stop = hooks.modify_tag_attrs(
+            "script", [("src", "foo.js"), ("referrerpolicy", "no-referrer")]
+        )
+
+        assert new_attrs == [
+            ("src", "foo.js"),
+            ("referrerpolicy", "no-referrer-when-downgrade"),
+        ]
+        assert not stop
+
+    def test_modify_tag_attrs_reads_the_config_once_per_request(self, hooks, context):
+        hooks.modify_tag_attrs("img", [])
+        context.via_config = {"proxy_images": "0"}
+
+        _, stop = hooks.modify_tag_attrs("img", [])
+        assert not stop
+
+        # A new request gets its own config
+        hooks.set_context(context)
+        _, stop = hooks.modify_tag_attrs("img", [])
+        assert stop
+
     @pytest.fixture
     def wb_response(self):
         return WbResponse(status_headers=StatusAndHeaders("200 OK", headers=[]))
@@ -259,3 +387,10 @@ class TestHooks:
     def Configuration(self):
         with patch("viahtml.hooks.hooks.Configuration", autospec=True) as Configuration:
             yield Configuration
+
+    @pytest.fixture
+    def StaticManifest(self):
+        with patch(
+            "viahtml.hooks.hooks.StaticManifest", autospec=True
+        ) as StaticManifest:
+            yield StaticManifest
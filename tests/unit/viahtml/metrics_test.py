@@ -0,0 +1,51 @@
+from unittest.mock import call
+
+import pytest
+
+from viahtml import metrics
+
+
+class TestIncrement:
+    def test_it_increments_the_uwsgi_metric(self, uwsgi):
+        metrics.increment("some.metric", 2)
+
+        uwsgi.metric_inc.assert_called_once_with("some.metric", 2)
+
+    def test_it_does_nothing_outside_uwsgi(self, monkeypatch):
+        monkeypatch.setattr("viahtml.metrics.uwsgi", None)
+
+        metrics.increment("some.metric")
+
+    @pytest.fixture
+    def uwsgi(self, patch):
+        return patch("viahtml.metrics.uwsgi", autospec=False)
+
+
+class TestObserve:
+    @pytest.mark.parametrize(
+        "seconds,bucket",
+        (
+            (0, "le_1"),
+            (0.001, "le_1"),
+            (0.0011, "le_2"),
+            (0.05, "le_50"),
+            (20, "le_20000"),
+            (20.001, "le_inf"),
+        ),
+    )
+    def test_it_counts_the_duration_in_a_bucket(self, uwsgi, seconds, bucket):
+        metrics.observe("timing.upstream", seconds)
+
+        assert uwsgi.metric_inc.call_args_list == [
+            call(f"timing.upstream.{bucket}"),
+            call("timing.upstream.sum_us", int(seconds * 1_000_000)),
+        ]
+
+    def test_it_does_nothing_outside_uwsgi(self, monkeypatch):
+        monkeypatch.setattr("viahtml.metrics.uwsgi", None)
+
+        metrics.observe("timing.upstream", 1)
+
+    @pytest.fixture
+    def uwsgi(self, patch):
+        return patch("viahtml.metrics.uwsgi", autospec=False)
@@ -1,12 +1,32 @@
 # pylint:disable=protected-access
 
-from unittest.mock import create_autospec, sentinel
+from contextlib import nullcontext
+from io import BytesIO
+from unittest.mock import call, create_autospec, sentinel
 
 import pytest
+from pywb.apps import rewriterapp
+from pywb.rewrite import content_rewriter
+from pywb.rewrite.templateview import BaseInsertView, HeadInsertView, JinjaEnv
 from pywb.rewrite.url_rewriter import UrlRewriter
+from pywb.warcserver.resource import responseloader
+from warcio import recordloader
 
+from viahtml.context import Context
 from viahtml.hooks import Hooks
-from viahtml.patch import _PatchedHTMLRewriter
+from viahtml.patch import (
+    _patch_buffered_readers,
+    _patch_stream_iter,
+    _PatchedHTMLRewriter,
+    _PatchedRewriterApp,
+)
+from viahtml.render_cache import RenderCache
+from viahtml.streaming import (
+    ArrivalReader,
+    EagerBufferedReader,
+    EagerChunkedDataReader,
+    stream_iter,
+)
 
 
 class TestRewriteLinkHref:
@@ -32,6 +52,28 @@ class TestRewriteLinkHref:
         assert returned_value == expected_value
 
 
+class TestRewrite:
+    def test_it_times_rewriting(self, patched_html_rewriter):
+        patched_html_rewriter.out = None
+
+        rewritten = patched_html_rewriter.rewrite("Hello ")
+        rewritten += patched_html_rewriter.final_read()
+
+        assert rewritten == "Hello "
+        assert patched_html_rewriter.hooks.timed.call_args_list == [
+            call("rewrite"),
+            call("rewrite"),
+        ]
+
+    def test_it_counts_the_characters_rewritten(self, patched_html_rewriter, patch):
+        metrics = patch("viahtml.patch.metrics")
+        patched_html_rewriter.out = None
+
+        patched_html_rewriter.rewrite("Hello ")
+
+        metrics.increment.assert_called_once_with("rewrite.characters", 6)
+
+
 class TestRewriteTagAttrs:
     def test_rewrite_tag_attrs_calls_modify_tag_attrs(self, patched_html_rewriter):
         patched_html_rewriter._rewrite_tag_attrs("script", sentinel.tag_attrs)
@@ -116,3 +158,214 @@ def patched_html_rewriter():
 
     patched_html_rewriter.out = create_autospec(Out, instance=True, spec_set=True)
     return patched_html_rewriter
+
+
+class TestPatchedRewriterApp:
+    def test_patch_adds_the_template_vars(self, rewriter, hooks):
+        _PatchedRewriterApp.patch(rewriter, hooks)
+
+        assert rewriter.jinja_env.jinja_env.globals["h_embed_url"] == "http://h/embed"
+
+    def test_patch_stops_templates_reloading(self, rewriter, hooks):
+        _PatchedRewriterApp.patch(rewriter, hooks)
+
+        assert not rewriter.jinja_env.jinja_env.auto_reload
+
+    @pytest.mark.parametrize("name", ("head_insert.html", "banner.html"))
+    def test_patch_precompiles_the_templates_for_every_page(
+        self, rewriter, hooks, name
+    ):
+        _PatchedRewriterApp.patch(rewriter, hooks)
+
+        template = rewriter.jinja_env.jinja_env.get_template(name)
+        assert isinstance(template.globals, dict)
+        assert template.globals["h_embed_url"] == "http://h/embed"
+
+    @pytest.mark.parametrize("banner", (False, True))
+    def test_patch_times_the_templates(self, rewriter, hooks, banner):
+        view = rewriter.head_insert_view
+        if banner:
+            view = view.banner_view
+        render_to_string = view.render_to_string = create_autospec(
+            lambda env, **kwargs: None
+        )  # pragma: no cover
+        _PatchedRewriterApp.patch(rewriter, hooks)
+        context = create_autospec(Context, instance=True, spec_set=True)
+        context.timed.return_value = nullcontext()
+        hooks.set_context(context)
+
+        html = view.render_to_string(sentinel.env, cdx=sentinel.cdx)
+
+        render_to_string.assert_called_once_with(sentinel.env, cdx=sentinel.cdx)
+        assert html == render_to_string.return_value
+        context.timed.assert_called_once_with("template")
+
+    def test_patch_works_without_a_banner(self, rewriter, hooks):
+        rewriter.head_insert_view.banner_view = None
+
+        _PatchedRewriterApp.patch(rewriter, hooks)
+
+    @pytest.fixture
+    def rewriter(self):
+        class Rewriter:
+            def __init__(self):
+                self.jinja_env = JinjaEnv()
+                self.head_insert_view = HeadInsertView(
+                    self.jinja_env,
+                    "head_insert.html",
+                    BaseInsertView(self.jinja_env, "banner.html"),
+                )
+
+        return Rewriter()
+
+    @pytest.fixture
+    def hooks(self):
+        return Hooks({"ignore_prefixes": [], "h_embed_url": "http://h/embed"})
+
+
+class TestRenderContent:
+    def test_it_renders_and_modifies_the_response(self, app, hooks, render_content):
+        response = app.render_content(
+            sentinel.wb_url, sentinel.kwargs, sentinel.environ
+        )
+
+        render_content.assert_called_once_with(
+            app, sentinel.wb_url, sentinel.kwargs, sentinel.environ
+        )
+        hooks.modify_render_response.assert_called_once_with(
+            render_content.return_value
+        )
+        assert response == hooks.modify_render_response.return_value
+
+    def test_it_renders_through_the_render_cache(self, app, hooks, render_content):
+        app.render_cache = create_autospec(RenderCache, instance=True, spec_set=True)
+
+        response = app.render_content(
+            sentinel.wb_url, sentinel.kwargs, sentinel.environ
+        )
+
+        render, environ = app.render_cache.call_args[0]
+        assert environ == sentinel.environ
+        assert response == app.render_cache.return_value
+        render_content.assert_not_called()
+        # The cache renders the page by calling the function it was given
+        assert render(sentinel.environ) == hooks.modify_render_response.return_value
+        render_content.assert_called_once_with(
+            app, sentinel.wb_url, sentinel.kwargs, sentinel.environ
+        )
+
+    @pytest.fixture
+    def app(self, hooks):
+        app = object.__new__(_PatchedRewriterApp)
+        app.hooks = hooks
+        app.render_cache = None
+        return app
+
+    @pytest.fixture
+    def render_content(self, patch):
+        return patch("viahtml.patch.RewriterApp.render_content")
+
+
+class TestDoReq:
+    def test_it_times_fetching_the_page(self, app, hooks, do_req):
+        response = app._do_req(
+            sentinel.inputreq, sentinel.wb_url, sentinel.kwargs, sentinel.skip_record
+        )
+
+        do_req.assert_called_once_with(
+            app,
+            sentinel.inputreq,
+            sentinel.wb_url,
+            sentinel.kwargs,
+            sentinel.skip_record,
+        )
+        hooks.timed.assert_called_once_with("upstream")
+        assert response == do_req.return_value
+
+    def test_it_reads_the_page_as_it_arrives(self, app, do_req):
+        raw = do_req.return_value.raw
+
+        response = app._do_req(
+            sentinel.inputreq, sentinel.wb_url, sentinel.kwargs, sentinel.skip_record
+        )
+
+        assert isinstance(response.raw, ArrivalReader)
+        assert response.raw._response == raw
+
+    def test_it_reads_the_page_normally_without_a_head_flush_size(
+        self, app, hooks, do_req
+    ):
+        hooks.head_flush_size = 0
+        raw = do_req.return_value.raw
+
+        response = app._do_req(
+            sentinel.inputreq, sentinel.wb_url, sentinel.kwargs, sentinel.skip_record
+        )
+
+        assert response.raw == raw
+
+    @pytest.fixture
+    def app(self, hooks):
+        hooks.timed.return_value = nullcontext()
+        app = object.__new__(_PatchedRewriterApp)
+        app.hooks = hooks
+        return app
+
+    @pytest.fixture
+    def do_req(self, patch):
+        return patch("viahtml.patch.RewriterApp._do_req")
+
+
+class TestPatchStreamIter:
+    def test_it(self, monkeypatch, hooks):
+        monkeypatch.setattr(content_rewriter, "StreamIter", sentinel.StreamIter)
+        monkeypatch.setattr(responseloader, "StreamIter", sentinel.StreamIter)
+
+        _patch_stream_iter(hooks)
+
+        assert content_rewriter.StreamIter is stream_iter
+        chunks = responseloader.StreamIter(BytesIO(b"x" * 20000))
+        assert len(next(chunks)) == 2048
+
+    def test_it_reads_normally_without_a_head_flush_size(self, monkeypatch, hooks):
+        monkeypatch.setattr(responseloader, "StreamIter", sentinel.StreamIter)
+        hooks.head_flush_size = 0
+
+        _patch_stream_iter(hooks)
+
+        chunks = responseloader.StreamIter(BytesIO(b"x" * 20000))
+        assert len(next(chunks)) == 16384
+
+
+class TestPatchBufferedReaders:
+    def test_it(self, hooks):
+        _patch_buffered_readers(hooks)
+
+        assert EagerBufferedReader.eager_size == 2048
+        assert rewriterapp.BufferedReader == EagerBufferedReader
+        assert content_rewriter.BufferedReader == EagerBufferedReader
+        assert recordloader.BufferedReader == EagerBufferedReader
+        assert recordloader.ChunkedDataReader == EagerChunkedDataReader
+
+    def test_it_does_nothing_without_a_head_flush_size(self, hooks):
+        hooks.head_flush_size = 0
+
+        _patch_buffered_readers(hooks)
+
+        assert rewriterapp.BufferedReader == sentinel.BufferedReader
+
+    @pytest.fixture(autouse=True)
+    def readers(self, monkeypatch):
+        monkeypatch.setattr(EagerBufferedReader, "eager_size", 0)
+        for module in (rewriterapp, content_rewriter, recordloader):
+            monkeypatch.setattr(module, "BufferedReader", sentinel.BufferedReader)
+        monkeypatch.setattr(
+            recordloader, "ChunkedDataReader", sentinel.ChunkedDataReader
+        )
+
+
+@pytest.fixture
+def hooks():
+    hooks = create_autospec(Hooks, instance=True, spec_set=True)
+    hooks.head_flush_size = 2048
+    return hooks
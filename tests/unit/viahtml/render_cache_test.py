@@ -0,0 +1,446 @@
+from functools import partial
+from unittest.mock import create_autospec
+
+import gevent
+import pytest
+from gevent.event import Event
+from pywb.apps.wbrequestresponse import WbResponse
+from warcio.statusandheaders import StatusAndHeaders
+
+from viahtml.render_cache import RenderCache
+
+
+class TestRenderCache:
+    def test_it_renders_pages_it_does_not_have(self, cache, render, environ):
+        response = cache(render, environ)
+
+        render.assert_called_once_with(environ)
+        assert read(response) == b"<html>page 1</html>"
+
+    def test_it_serves_pages_it_has(self, cache, render, environ, metrics):
+        read(cache(render, environ))
+
+        response = cache(render, dict(environ))
+
+        render.assert_called_once()
+        assert response.status_headers.statusline == "200 OK"
+        assert response.status_headers.headers == [
+            ("Content-Type", "text/html; charset=utf-8"),
+            ("X-Archive-Orig-ETag", '"v1"'),
+        ]
+        assert read(response) == b"<html>page 1</html>"
+        metrics.increment.assert_called_with("render_cache.hits")
+
+    def test_it_does_not_keep_headers_added_to_a_response(self, cache, render, environ):
+        response = cache(render, environ)
+        # Like we do for our own headers in `Application`
+        response.status_headers.headers.append(("Set-Cookie", "private"))
+        read(response)
+
+        response = cache(render, dict(environ))
+
+        assert response.status_headers.get_header("Set-Cookie") is None
+
+    def test_it_only_stores_pages_which_are_read_to_the_end(
+        self, cache, render, environ
+    ):
+        response = cache(render, environ)
+        next(iter(response.body))
+        response.body.close()
+
+        cache(render, dict(environ))
+
+        assert render.call_count == 2
+
+    def test_it_does_not_store_large_pages(self, render, environ):
+        cache = RenderCache(max_size=80, fresh_ttl=60, stale_ttl=600)
+
+        read(cache(render, environ))
+        read(cache(render, dict(environ)))
+
+        assert render.call_count == 2
+
+    def test_it_revalidates_stale_pages(
+        self, cache, render, environ, monotonic, metrics
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        read(cache(render, environ))
+        monotonic.return_value += 61
+        sent_etags = []
+
+        def render_not_modified(environ):
+            sent_etags.append(environ["HTTP_IF_NONE_MATCH"])
+            return make_response("304 Not Modified", body=[])
+
+        render.side_effect = render_not_modified
+
+        response = cache(render, environ)
+
+        assert sent_etags == ['"v1"']
+        assert "HTTP_IF_NONE_MATCH" not in environ
+        assert read(response) == b"<html>page 1</html>"
+        metrics.increment.assert_called_with("render_cache.revalidated")
+
+        # It's fresh again
+        cache(render, environ)
+        assert render.call_count == 2
+
+    def test_it_revalidates_with_bodies_which_cannot_be_closed(
+        self, cache, render, environ, monotonic
+    ):
+        read(cache(render, environ))
+        monotonic.return_value += 61
+        render.side_effect = lambda environ: WbResponse(
+            StatusAndHeaders("304 Not Modified", []), []
+        )
+
+        assert read(cache(render, environ)) == b"<html>page 1</html>"
+
+    def test_it_replaces_stale_pages_which_have_changed(
+        self, cache, render, environ, monotonic
+    ):
+        read(cache(render, environ))
+        monotonic.return_value += 61
+        render.side_effect = lambda environ: make_response(body=[b"page 2"])
+
+        assert read(cache(render, environ)) == b"page 2"
+        assert read(cache(render, environ)) == b"page 2"
+        assert render.call_count == 2
+
+    def test_it_drops_stale_pages_without_an_etag(
+        self, cache, render, environ, monotonic
+    ):
+        render.side_effect = lambda environ: make_response(etag=None)
+        read(cache(render, environ))
+        monotonic.return_value += 61
+
+        read(cache(render, environ))
+
+        assert "HTTP_IF_NONE_MATCH" not in render.call_args[0][0]
+        assert render.call_count == 2
+
+    def test_it_drops_pages_after_the_ttl(self, cache, render, environ, monotonic):
+        read(cache(render, environ))
+        monotonic.return_value += 601
+
+        read(cache(render, environ))
+
+        assert "HTTP_IF_NONE_MATCH" not in render.call_args[0][0]
+
+    @pytest.mark.parametrize(
+        "response",
+        (
+            {"status": "404 Not Found"},
+            {"content_type": "application/pdf"},
+            {"headers": [("Set-Cookie", "session=1")]},
+            {"headers": [("X-Archive-Orig-Cache-Control", "private, max-age=60")]},
+            {"headers": [("X-Archive-Orig-Cache-Control", "no-store")]},
+            {"headers": [("X-Archive-Orig-Cache-Control", "No-Cache")]},
+        ),
+    )
+    def test_it_does_not_store_uncacheable_responses(
+        self, cache, render, environ, response
+    ):
+        render.side_effect = lambda environ: make_response(**response)
+
+        read(cache(render, environ))
+        read(cache(render, environ))
+
+        assert render.call_count == 2
+
+    @pytest.mark.parametrize(
+        "header",
+        (
+            "HTTP_AUTHORIZATION",
+            "HTTP_COOKIE",
+            "HTTP_IF_NONE_MATCH",
+            "HTTP_X_REQUESTED_WITH",
+        ),
+    )
+    def test_it_does_not_cache_some_requests(self, cache, render, environ, header):
+        environ[header] = "value"
+
+        read(cache(render, environ))
+        read(cache(render, environ))
+
+        assert render.call_count == 2
+
+    def test_it_does_not_cache_non_get_requests(self, cache, render, environ):
+        environ["REQUEST_METHOD"] = "POST"
+
+        read(cache(render, environ))
+        read(cache(render, environ))
+
+        assert render.call_count == 2
+
+
+class TestRenderCacheSingleFlight:
+    def test_concurrent_requests_share_one_fetch(self, cache, render, environ):
+        render.side_effect = lambda environ: make_response(body=slow_body())
+
+        requests = [
+            gevent.spawn(lambda: read(cache(render, dict(environ)))) for _ in range(20)
+        ]
+        responses = [request.get() for request in requests]
+
+        render.assert_called_once()
+        assert responses == [b"<html>page</html>"] * 20
+
+    def test_waiting_requests_fetch_pages_which_cannot_be_cached(
+        self, cache, render, environ
+    ):
+        render.side_effect = lambda environ: make_response(
+            status="404 Not Found", body=slow_body()
+        )
+
+        requests = [gevent.spawn(lambda: read(cache(render, dict(environ))))]
+        gevent.sleep(0)
+        requests.append(gevent.spawn(lambda: read(cache(render, dict(environ)))))
+        for request in requests:
+            request.get()
+
+        assert render.call_count == 2
+
+    def test_waiting_requests_read_along_with_the_fetch(
+        self, cache, render, environ, metrics
+    ):
+        first = cache(render, dict(environ))
+        first_chunks = iter(first.body)
+        assert next(first_chunks) == b"<html>"
+
+        # The first request doesn't hold this one up, or the other way round
+        assert read(cache(render, dict(environ))) == b"<html>page 1</html>"
+        assert b"".join(first_chunks) == b"page 1</html>"
+
+        render.assert_called_once()
+        metrics.increment.assert_called_with("render_cache.hits")
+        read(cache(render, dict(environ)))
+        render.assert_called_once()
+
+    def test_waiting_requests_do_not_wait_for_large_pages(
+        self, render, environ, monkeypatch
+    ):
+        monkeypatch.setattr(RenderCache, "WAIT_TIMEOUT", 60)
+        cache = RenderCache(max_size=80, fresh_ttl=60, stale_ttl=600)
+        render.side_effect = lambda environ: make_response(
+            body=[b"<html>", b"x" * 20, b"</html>"]
+        )
+        # A slow reader which has read past the biggest page we would keep
+        slow = iter(cache(render, dict(environ)).body)
+        next(slow)
+        next(slow)
+
+        # This fetches the page itself straight away, rather than waiting
+        assert read(cache(render, dict(environ))) == b"<html>" + b"x" * 20 + b"</html>"
+
+        assert render.call_count == 2
+        assert next(slow) == b"</html>"
+
+    def test_requests_reading_along_get_all_of_large_pages(self, render, environ):
+        cache = RenderCache(max_size=80, fresh_ttl=60, stale_ttl=600)
+        render.side_effect = lambda environ: make_response(
+            body=[b"<html>", b"x" * 20, b"</html>"]
+        )
+        first = iter(cache(render, dict(environ)).body)
+        second = iter(cache(render, dict(environ)).body)
+
+        assert b"".join(first) == b"<html>" + b"x" * 20 + b"</html>"
+        assert b"".join(second) == b"<html>" + b"x" * 20 + b"</html>"
+        render.assert_called_once()
+
+    def test_requests_reading_along_finish_pages_closed_by_others(
+        self, cache, render, environ
+    ):
+        first = cache(render, dict(environ))
+        second = cache(render, dict(environ))
+        next(iter(first.body))
+        first.body.close()
+
+        assert read(second) == b"<html>page 1</html>"
+
+        read(cache(render, dict(environ)))
+        render.assert_called_once()
+
+    def test_requests_reading_along_fail_when_the_fetch_fails(
+        self, cache, render, environ
+    ):
+        def failing_body():
+            yield b"<html>"
+            raise ValueError()
+
+        render.side_effect = lambda environ: make_response(body=failing_body())
+        first = cache(render, dict(environ))
+        second = cache(render, dict(environ))
+
+        with pytest.raises(ValueError):
+            read(first)
+        with pytest.raises(IOError):
+            read(second)
+
+        # Nothing was stored
+        render.side_effect = lambda environ: make_response()
+        read(cache(render, dict(environ)))
+        assert render.call_count == 2
+
+    def test_requests_cannot_read_along_once_the_fetch_is_closed(
+        self, cache, render, environ
+    ):
+        response = cache(render, dict(environ))
+        # pylint:disable=protected-access
+        (fetching,) = cache._fetching.values()
+
+        response.body.close()
+
+        assert fetching.share() is None
+
+    def test_waiting_requests_give_up_after_a_while(
+        self, cache, render, environ, monkeypatch
+    ):
+        monkeypatch.setattr(RenderCache, "WAIT_TIMEOUT", 0.01)
+        stalled = Event()
+        render.side_effect = partial(render_stalling_once, render, stalled)
+        first = gevent.spawn(cache, render, dict(environ))
+        gevent.sleep(0)
+
+        assert read(cache(render, dict(environ))) == b"<html>page 1</html>"
+
+        assert render.call_count == 2
+        stalled.set()
+        read(first.get())
+
+    def test_fetches_which_were_given_up_on_finish_quietly(
+        self, cache, render, environ, monkeypatch
+    ):
+        monkeypatch.setattr(RenderCache, "WAIT_TIMEOUT", 0.01)
+        stalled = Event()
+        render.side_effect = partial(render_stalling_once, render, stalled)
+        first = gevent.spawn(cache, render, dict(environ))
+        gevent.sleep(0)
+        second = cache(render, dict(environ))
+        next(iter(second.body))
+
+        stalled.set()
+        read(first.get())
+
+        # Others can still read along with the second fetch
+        assert cache._fetching  # pylint:disable=protected-access
+
+    @pytest.mark.parametrize("closed", (True, False))
+    def test_requests_stop_waiting_when_the_fetch_finishes(
+        self, cache, render, environ, closed
+    ):
+        response = cache(render, dict(environ))
+        if closed:
+            response.body.close()
+        else:
+            read(response)
+
+        # Nothing is left waiting for the timeout
+        assert not cache._fetching  # pylint:disable=protected-access
+
+    def test_requests_stop_waiting_when_the_fetch_fails(self, cache, render, environ):
+        render.side_effect = ValueError
+
+        with pytest.raises(ValueError):
+            cache(render, dict(environ))
+
+        assert not cache._fetching  # pylint:disable=protected-access
+
+
+class TestCacheKey:
+    @pytest.mark.parametrize(
+        "changes",
+        (
+            {"PATH_INFO": "/proxy/https://example.com/other"},
+            {"QUERY_STRING": "b=2&a=1&via.client.openSidebar=1"},
+            {"QUERY_STRING": "a=1&b=2&via.client.openSidebar=0"},
+            {"HTTP_HOST": "other.via"},
+            {"HTTP_USER_AGENT": "Mobile"},
+            {"HTTP_ACCEPT_LANGUAGE": "fr"},
+        ),
+    )
+    def test_it_varies_by(self, environ, changes):
+        assert RenderCache.cache_key(environ) != RenderCache.cache_key(
+            dict(environ, **changes)
+        )
+
+    def test_it_ignores_the_order_of_via_params(self, environ):
+        environ["QUERY_STRING"] = "a=1&via.client.openSidebar=1&via.proxy_frames=0"
+        reordered = dict(
+            environ, QUERY_STRING="via.proxy_frames=0&a=1&via.client.openSidebar=1"
+        )
+
+        assert RenderCache.cache_key(environ) == RenderCache.cache_key(reordered)
+
+
+def make_response(
+    status="200 OK",
+    content_type="text/html; charset=utf-8",
+    etag='"v1"',
+    headers=None,
+    body=None,
+):
+    all_headers = [("Content-Type", content_type)]
+    if etag:
+        all_headers.append(("X-Archive-Orig-ETag", etag))
+    all_headers.extend(headers or [])
+
+    if body is None:
+        body = [b"<html>", b"page 1", b"</html>"]
+
+    return WbResponse(StatusAndHeaders(status, all_headers), (chunk for chunk in body))
+
+
+def render_stalling_once(render, stalled, _environ):
+    if render.call_count == 1:
+        stalled.wait()
+
+    return make_response()
+
+
+def slow_body():
+    for chunk in (b"<html>", b"page", b"</html>"):
+        gevent.sleep(0.001)
+        yield chunk
+
+
+def read(response):
+    return b"".join(response.body)
+
+
+@pytest.fixture
+def cache():
+    return RenderCache(max_size=1024, fresh_ttl=60, stale_ttl=600)
+
+
+@pytest.fixture
+def render():
+    return create_autospec(
+        lambda environ: None, side_effect=lambda environ: make_response()
+    )
+
+
+@pytest.fixture
+def environ():
+    return {
+        "REQUEST_METHOD": "GET",
+        "wsgi.url_scheme": "https",
+        "HTTP_HOST": "via",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": "/proxy/https://example.com/",
+        "QUERY_STRING": "a=1&b=2&via.client.openSidebar=1",
+        "HTTP_USER_AGENT": "Browser",
+    }
+
+
+@pytest.fixture(autouse=True)
+def monotonic(patch):
+    monotonic = patch("viahtml.render_cache.monotonic")
+    monotonic.return_value = 1000
+    # The cache uses the same clock
+    patch("viahtml.cache.monotonic", autospec=False, new=monotonic)
+    return monotonic
+
+
+@pytest.fixture(autouse=True)
+def metrics(patch):
+    return patch("viahtml.render_cache.metrics")
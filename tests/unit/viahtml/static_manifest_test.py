@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from viahtml.static_manifest import StaticManifest
+
+
+class TestStaticManifest:
+    def test_it_finds_hashed_copies(self, manifest):
+        assert manifest("wombat.js") == "wombat.1a2b3c4d5e6f.js"
+
+    def test_it_returns_names_without_hashed_copies_as_they_are(self, manifest):
+        assert manifest("other.js") == "other.js"
+
+    def test_load(self, tmp_path):
+        path = tmp_path / "manifest.json"
+        path.write_text(json.dumps({"wombat.js": "wombat.1a2b3c4d5e6f.js"}))
+
+        manifest = StaticManifest.load(str(path))
+
+        assert manifest("wombat.js") == "wombat.1a2b3c4d5e6f.js"
+
+    def test_load_without_a_manifest(self, tmp_path, caplog):
+        manifest = StaticManifest.load(str(tmp_path / "missing.json"))
+
+        assert manifest("wombat.js") == "wombat.js"
+        assert "Cannot find the static manifest" in caplog.text
+
+    def test_load_without_a_path(self):
+        manifest = StaticManifest.load(None)
+
+        assert manifest("wombat.js") == "wombat.js"
+
+    @pytest.fixture
+    def manifest(self):
+        return StaticManifest({"wombat.js": "wombat.1a2b3c4d5e6f.js"})
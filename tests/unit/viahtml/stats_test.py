@@ -5,7 +5,8 @@ import pytest
 from h_matchers import Any
 from requests import RequestException
 
-from viahtml.stats import UWSGINewRelicStatsGenerator
+from viahtml.metrics import HISTOGRAM_BUCKETS
+from viahtml.stats import UWSGINewRelicStatsGenerator, UWSGIOpenMetricsGenerator
 
 STATS_ENDPOINT = "http://example.com"
 
@@ -69,6 +70,15 @@ class TestUWSGINewRelicStatsGenerator:
                     "sum_of_squares": 10000,
                 },
             ),
+            ("Custom/Checkmate/Circuit/Opened", 3),
+            ("Custom/Checkmate/Circuit/Rejected", 140),
+            ("Custom/Checkmate/Failures", 21),
+            ("Custom/RenderCache/Hits", 150),
+            ("Custom/RenderCache/Misses", 12),
+            ("Custom/RenderCache/Revalidated", 4),
+            ("Custom/DNSCache/Hits", 300),
+            ("Custom/DNSCache/Misses", 25),
+            ("Custom/DNSCache/Failures", 2),
             ("Custom/Worker/Count/Cheap", 6),
             ("Custom/Worker/Count/Idle", 1),
             ("Custom/Worker/Count/Accepting", 5),
@@ -130,21 +140,224 @@ class TestUWSGINewRelicStatsGenerator:
         for metric_name, value in expected:
             assert (metric_name, value) in results
 
+    def test_it_skips_metrics_which_are_not_configured(self, stats, json_response):
+        del json_response["metrics"]
+
+        results = list(stats())
+
+        assert not [name for name, _ in results if name.startswith("Custom/Checkmate")]
+        assert not [name for name, _ in results if name.startswith("Custom/Latency")]
+
+    def test_it_reports_percentiles_from_histograms(self, stats, json_response):
+        # 100 requests: 50 from 20 to 50ms, 45 from 50 to 100ms and 5 from 100
+        # to 200ms
+        set_histogram(
+            json_response,
+            "latency.document",
+            {50: 50, 100: 45, 200: 5},
+            sum_us=6_000_000,
+        )
+        set_histogram(json_response, "latency.subresource", {})
+
+        results = dict(stats())
+
+        assert results["Custom/Latency/Document/Count"] == 100
+        assert results["Custom/Latency/Document/Average[ms]"] == 60
+        assert results["Custom/Latency/Document/P50[ms]"] == 50
+        assert results["Custom/Latency/Document/P95[ms]"] == 100
+        assert results["Custom/Latency/Document/P99[ms]"] == 180
+        assert not results["Custom/Latency/Subresource/Count"]
+        assert "Custom/Latency/Subresource/P50[ms]" not in results
+
+    def test_percentiles_can_be_past_the_last_bucket(self, stats, json_response):
+        set_histogram(json_response, "latency.document", {"inf": 1})
+
+        results = dict(stats())
+
+        assert results["Custom/Latency/Document/P50[ms]"] == 20000
+
+    def test_it_reports_on_the_histograms_since_the_last_call(
+        self, stats, json_response
+    ):
+        set_histogram(json_response, "latency.document", {1: 10}, sum_us=5000)
+        list(stats())
+        set_histogram(json_response, "latency.document", {1: 10, 10: 2}, sum_us=15000)
+
+        results = dict(stats())
+
+        assert results["Custom/Latency/Document/Count"] == 2
+        assert results["Custom/Latency/Document/Average[ms]"] == 5
+        assert results["Custom/Latency/Document/P50[ms]"] == 7.5
+
+    def test_it_reports_everything_after_uwsgi_restarts(self, stats, json_response):
+        set_histogram(json_response, "latency.document", {1: 10})
+        list(stats())
+        set_histogram(json_response, "latency.document", {1: 4})
+
+        results = dict(stats())
+
+        assert results["Custom/Latency/Document/Count"] == 4
+
     @pytest.fixture
     def stats(self):
         return UWSGINewRelicStatsGenerator(stats_endpoint=STATS_ENDPOINT)
 
-    @pytest.fixture
-    def json_response(self):
-        return json.loads(
-            (
-                importlib_resources.files("tests.unit.viahtml") / "stats_test.json"
-            ).read_bytes()
+
+class TestUWSGIOpenMetricsGenerator:
+    def test_it_calls_the_end_point(self, openmetrics, requests):
+        openmetrics()
+
+        requests.get.assert_called_once_with(url=STATS_ENDPOINT, timeout=1)
+
+    def test_it_only_says_uwsgi_is_down_when_the_request_fails(
+        self, openmetrics, requests
+    ):
+        requests.get.side_effect = RequestException
+
+        assert openmetrics() == (
+            "# TYPE viahtml_uwsgi_up gauge\n"
+            "# HELP viahtml_uwsgi_up Whether uWSGI answered\n"
+            "viahtml_uwsgi_up 0\n"
+            "# EOF\n"
         )
 
-    @pytest.fixture(autouse=True)
-    def requests(self, patch, json_response):
-        requests = patch("viahtml.stats.requests")
-        requests.get.return_value.json.return_value = json_response
+    def test_it_returns_uwsgi_stats(self, openmetrics):
+        lines = openmetrics().splitlines()
+
+        for line in (
+            "viahtml_uwsgi_up 1",
+            "# TYPE viahtml_uwsgi_load gauge",
+            "viahtml_uwsgi_load 16",
+            "# TYPE viahtml_uwsgi_listen_queue_errors counter",
+            "viahtml_uwsgi_listen_queue_errors_total 13",
+            'viahtml_uwsgi_socket_queue{socket="0.0.0.0:3032"} 17',
+        ):
+            assert line in lines
+
+    def test_it_labels_worker_stats_with_the_worker(self, openmetrics):
+        lines = openmetrics().splitlines()
+
+        for line in (
+            'viahtml_uwsgi_worker_requests_total{worker="1"} 12',
+            'viahtml_uwsgi_worker_requests_total{worker="4"} 2',
+            'viahtml_uwsgi_worker_average_response_time_seconds{worker="4"} 0.1767',
+            'viahtml_uwsgi_worker_resident_memory_bytes{worker="1"} 3195',
+            'viahtml_uwsgi_worker_accepting{worker="7"} 0',
+        ):
+            assert line in lines
+
+    def test_it_totals_worker_stats(self, openmetrics):
+        lines = openmetrics().splitlines()
+
+        for line in (
+            "viahtml_uwsgi_requests_total 14",
+            "viahtml_uwsgi_exceptions_total 7",
+            'viahtml_uwsgi_workers{status="cheap"} 6',
+            'viahtml_uwsgi_workers{status="idle"} 1',
+        ):
+            assert line in lines
+
+    def test_it_returns_our_own_metrics(self, openmetrics, json_response):
+        json_response["metrics"]["rewrite.characters"] = {"type": 0, "value": 7}
+
+        lines = openmetrics().splitlines()
+
+        for line in (
+            "# TYPE viahtml_checkmate_circuit_opened counter",
+            "viahtml_checkmate_circuit_opened_total 3",
+            "viahtml_rewrite_characters_total 7",
+        ):
+            assert line in lines
+        # uWSGI's own metrics are in the rest of the stats already
+        assert not [line for line in lines if "core_busy_workers" in line]
+
+    def test_it_returns_histograms(self, openmetrics, json_response):
+        set_histogram(
+            json_response, "latency.document", {1: 1, 50: 2, "inf": 1}, sum_us=1500
+        )
+        set_histogram(json_response, "latency.status", {})
+
+        lines = openmetrics().splitlines()
+
+        start = lines.index("# TYPE viahtml_latency_seconds histogram")
+        assert lines[start + 1 : start + 20] == [
+            "# HELP viahtml_latency_seconds Time taken to respond to requests by "
+            "route class",
+            'viahtml_latency_seconds_bucket{route="document",le="0.001"} 1',
+            'viahtml_latency_seconds_bucket{route="document",le="0.002"} 1',
+            'viahtml_latency_seconds_bucket{route="document",le="0.005"} 1',
+            'viahtml_latency_seconds_bucket{route="document",le="0.01"} 1',
+            'viahtml_latency_seconds_bucket{route="document",le="0.02"} 1',
+            'viahtml_latency_seconds_bucket{route="document",le="0.05"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="0.1"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="0.2"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="0.5"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="1.0"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="2.0"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="5.0"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="10.0"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="20.0"} 3',
+            'viahtml_latency_seconds_bucket{route="document",le="+Inf"} 4',
+            'viahtml_latency_seconds_count{route="document"} 4',
+            'viahtml_latency_seconds_sum{route="document"} 0.0015',
+            'viahtml_latency_seconds_bucket{route="status",le="0.001"} 0',
+        ]
+
+    @pytest.mark.parametrize(
+        "metrics",
+        (
+            # Not one of ours
+            {"other.thing.sum_us": {"type": 0, "value": 1}},
+            # Missing some of its buckets
+            {"latency.document.sum_us": {"type": 0, "value": 1}},
+        ),
+    )
+    def test_it_skips_histograms_it_cannot_return(
+        self, openmetrics, json_response, metrics
+    ):
+        json_response["metrics"] = metrics
+
+        result = openmetrics()
+
+        assert "sum" not in result
+
+    def test_it_escapes_label_values(self, openmetrics, json_response):
+        json_response["sockets"][0]["name"] = 'a\\b"c\nd'
+
+        lines = openmetrics().splitlines()
+
+        assert 'viahtml_uwsgi_socket_queue{socket="a\\\\b\\"c\\nd"} 17' in lines
+
+    def test_it_ends_with_eof(self, openmetrics):
+        assert openmetrics().endswith("\n# EOF\n")
+
+    @pytest.fixture
+    def openmetrics(self):
+        return UWSGIOpenMetricsGenerator(stats_endpoint=STATS_ENDPOINT)
+
+
+@pytest.fixture
+def json_response():
+    return json.loads(
+        (
+            importlib_resources.files("tests.unit.viahtml") / "stats_test.json"
+        ).read_bytes()
+    )
+
+
+@pytest.fixture(autouse=True)
+def requests(patch, json_response):
+    requests = patch("viahtml.stats.requests")
+    requests.get.return_value.json.return_value = json_response
+
+    return requests
+
+
+def set_histogram(json_response, name, counts, sum_us=0):
+    """Set the counters of a `viahtml.metrics` histogram in a stats response."""
+    metrics = json_response["metrics"]
+
+    for bound in HISTOGRAM_BUCKETS + ("inf",):
+        metrics[f"{name}.le_{bound}"] = {"type": 0, "value": counts.get(bound, 0)}
 
-        return requests
+    metrics[f"{name}.sum_us"] = {"type": 0, "value": sum_us}
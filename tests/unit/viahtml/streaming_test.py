@@ -0,0 +1,123 @@
+from io import BytesIO
+from unittest.mock import create_autospec
+
+import pytest
+from urllib3.response import HTTPResponse
+
+from viahtml.streaming import (
+    MAX_CHUNK_SIZE,
+    ArrivalReader,
+    EagerBufferedReader,
+    EagerChunkedDataReader,
+    stream_iter,
+)
+
+
+class TestStreamIter:
+    def test_it_yields_the_headers_then_the_stream(self):
+        chunks = stream_iter(
+            BytesIO(b"body"), header1=b"header1", header2=b"header2", size=2
+        )
+
+        assert list(chunks) == [b"header1", b"header2", b"bo", b"dy"]
+
+    def test_it_reads_bigger_chunks_while_reads_are_fast(self):
+        chunks = stream_iter(BytesIO(b"x" * 1000), size=10)
+
+        assert [len(chunk) for chunk in chunks] == [10, 20, 40, 80, 160, 320, 370]
+
+    def test_it_stops_growing_at_the_max_chunk_size(self):
+        chunks = stream_iter(BytesIO(b"x" * MAX_CHUNK_SIZE * 3), size=MAX_CHUNK_SIZE)
+
+        assert [len(chunk) for chunk in chunks] == [MAX_CHUNK_SIZE] * 3
+
+    def test_it_reads_small_chunks_again_after_a_slow_read(self, monotonic):
+        # The third read takes a while
+        monotonic.side_effect = [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1]
+
+        chunks = stream_iter(BytesIO(b"x" * 100), size=10)
+
+        assert [len(chunk) for chunk in chunks] == [10, 20, 40, 10, 20]
+
+    def test_it_can_start_with_a_smaller_read(self):
+        chunks = stream_iter(BytesIO(b"x" * 100), size=10, first_size=5)
+
+        assert [len(chunk) for chunk in chunks] == [5, 10, 20, 40, 25]
+
+    def test_it_closes_the_stream(self):
+        stream = create_autospec(BytesIO, instance=True, spec_set=True)
+        stream.read.return_value = b""
+
+        list(stream_iter(stream))
+
+        stream.close.assert_called_once_with()
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.streaming.monotonic")
+        monotonic.return_value = 0
+        return monotonic
+
+
+class TestArrivalReader:
+    def test_it_returns_chunks_as_they_arrive(self, reader):
+        assert reader.read(10) == b"first"
+        assert reader.read(3) == b"sec"
+        assert reader.read(10) == b"ond"
+        assert not reader.read(10)
+
+    def test_it_can_read_everything(self, reader):
+        reader.read(3)
+
+        assert reader.read() == b"stsecond"
+
+    def test_it_passes_other_calls_to_the_response(self, reader, response):
+        reader.release_conn()
+
+        response.release_conn.assert_called_once_with()
+
+    @pytest.fixture
+    def response(self):
+        response = create_autospec(HTTPResponse, instance=True, spec_set=True)
+        response.stream.return_value = iter([b"first", b"second"])
+        return response
+
+    @pytest.fixture
+    def reader(self, response):
+        return ArrivalReader(response)
+
+
+class TestEagerBufferedReader:
+    def test_it_returns_what_it_has_for_the_first_bytes(self, stream):
+        reader = EagerBufferedReader(stream, block_size=4)
+
+        assert reader.read(3) == b"fir"
+        assert reader.read(10) == b"s"
+        # The next read is past the eager size, so waits to fill up
+        assert reader.read(10) == b"tsecond"
+
+    def test_it_reads_normally_without_an_eager_size(self, stream, monkeypatch):
+        monkeypatch.setattr(EagerBufferedReader, "eager_size", 0)
+        reader = EagerBufferedReader(stream, block_size=4)
+
+        assert reader.read(10) == b"firstsecon"
+
+    def test_it_can_read_everything(self, stream):
+        reader = EagerBufferedReader(stream, block_size=4)
+
+        assert reader.read() == b"firstsecond"
+
+    def test_it_can_read_chunked_data(self, monkeypatch):
+        monkeypatch.setattr(EagerBufferedReader, "eager_size", 4)
+        reader = EagerChunkedDataReader(
+            BytesIO(b"5\r\nfirst\r\n6\r\nsecond\r\n0\r\n\r\n")
+        )
+
+        assert reader.read(10) == b"first"
+        assert reader.read(10) == b"second"
+        assert not reader.read(10)
+
+    @pytest.fixture
+    def stream(self, monkeypatch):
+        monkeypatch.setattr(EagerBufferedReader, "eager_size", 4)
+        return BytesIO(b"firstsecond")
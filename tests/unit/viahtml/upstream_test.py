@@ -0,0 +1,190 @@
+import socket
+from unittest.mock import call, create_autospec, sentinel
+
+import pytest
+from h_matchers import Any
+from pywb.warcserver.http import DefaultAdapters
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import NewConnectionError
+
+from viahtml.dns_cache import DNSCache
+from viahtml.upstream import UpstreamPool
+
+# pylint:disable=protected-access
+
+
+class TestUpstreamPool:
+    @pytest.mark.parametrize("scheme,port", (("http", 80), ("https", 443)))
+    def test_it_makes_pools_with_our_settings(self, upstream_pool, scheme, port):
+        pool = upstream_pool.poolmanager.connection_from_host(
+            "example.com", port, scheme
+        )
+
+        assert pool.idle_timeout == 30
+        assert pool.pool.maxsize == 4
+        assert not pool.block
+
+    def test_it_reuses_connections(self, pool):
+        conn = pool._get_conn()
+        pool._put_conn(conn)
+
+        assert pool._get_conn() is conn
+
+    def test_it_accepts_dropped_connections_back(self, pool):
+        pool._get_conn()
+        # urllib3 does this when a connection fails
+        pool._put_conn(None)
+
+        assert pool._get_conn() is not None
+
+    def test_it_closes_connections_which_have_been_idle_too_long(self, pool, monotonic):
+        conn = create_autospec(HTTPConnection, instance=True)
+        # Take a slot from the pool, as the connection would have done
+        pool._get_conn()
+        pool._put_conn(conn)
+        monotonic.return_value += 31
+
+        assert pool._get_conn() is conn
+        conn.close.assert_called_once_with()
+
+    def test_it_keeps_connections_which_have_not_been_idle_too_long(
+        self, pool, monotonic
+    ):
+        conn = create_autospec(HTTPConnection, instance=True)
+        pool._get_conn()
+        pool._put_conn(conn)
+        monotonic.return_value += 29
+
+        pool._get_conn()
+
+        conn.close.assert_not_called()
+
+    def test_install(self, upstream_pool, monkeypatch):
+        monkeypatch.setattr(DefaultAdapters, "live_adapter", None)
+
+        upstream_pool.install()
+
+        assert DefaultAdapters.live_adapter is upstream_pool
+
+    def test_stats(self, upstream_pool, pool):
+        conns = [pool._get_conn() for _ in range(3)]
+        pool._put_conn(conns[0])
+        pool.num_requests = 5
+
+        assert upstream_pool.stats == {
+            "hosts": 1,
+            "connections_made": 3,
+            "requests": 5,
+            "idle_connections": 1,
+        }
+
+    @pytest.fixture
+    def upstream_pool(self):
+        return UpstreamPool(max_hosts=10, max_connections_per_host=4, idle_timeout=30)
+
+    @pytest.fixture
+    def pool(self, upstream_pool):
+        return upstream_pool.poolmanager.connection_from_host("example.com", 80, "http")
+
+    @pytest.fixture(autouse=True)
+    def monotonic(self, patch):
+        monotonic = patch("viahtml.upstream.monotonic")
+        monotonic.return_value = 1000
+        return monotonic
+
+
+class TestUpstreamConnections:
+    @pytest.mark.parametrize("scheme,port", (("http", 80), ("https", 443)))
+    def test_it_connects_to_the_cached_address(
+        self, upstream_pool, dns_cache, create_connection, scheme, port
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        conn = self.make_conn(upstream_pool, scheme, port)
+
+        sock = conn._new_conn()
+
+        dns_cache.resolve.assert_called_once_with("example.com", port)
+        create_connection.assert_called_once_with(
+            ("192.0.2.1", port), Any(), socket_options=Any()
+        )
+        assert sock == create_connection.return_value
+        # Everything else still uses the host name
+        assert (conn.host, conn._dns_host) == ("example.com", "example.com")
+
+    def test_it_tries_each_address(self, upstream_pool, dns_cache, create_connection):
+        create_connection.side_effect = [OSError("Refused"), sentinel.sock]
+
+        sock = self.make_conn(upstream_pool)._new_conn()
+
+        assert sock == sentinel.sock
+        assert create_connection.call_args_list == [
+            call(("192.0.2.1", 80), Any(), socket_options=Any()),
+            call(("192.0.2.2", 80), Any(), socket_options=Any()),
+        ]
+        dns_cache.forget.assert_not_called()
+
+    def test_it_forgets_hosts_it_cannot_connect_to(
+        self, upstream_pool, dns_cache, create_connection
+    ):
+        create_connection.side_effect = OSError("Refused")
+
+        with pytest.raises(NewConnectionError):
+            self.make_conn(upstream_pool)._new_conn()
+
+        dns_cache.forget.assert_called_once_with("example.com", 80)
+
+    def test_it_raises_if_the_host_has_no_addresses(
+        self, upstream_pool, dns_cache, create_connection
+    ):
+        dns_cache.resolve.return_value = []
+
+        with pytest.raises(NewConnectionError, match="empty list"):
+            self.make_conn(upstream_pool)._new_conn()
+
+        create_connection.assert_not_called()
+        dns_cache.forget.assert_called_once_with("example.com", 80)
+
+    def test_it_raises_if_the_host_cannot_be_found(
+        self, upstream_pool, dns_cache, create_connection
+    ):
+        dns_cache.resolve.side_effect = socket.gaierror("Not found")
+
+        with pytest.raises(NewConnectionError, match="Not found"):
+            self.make_conn(upstream_pool)._new_conn()
+
+        create_connection.assert_not_called()
+
+    def test_it_works_without_a_dns_cache(self, create_connection):
+        upstream_pool = UpstreamPool(
+            max_hosts=10, max_connections_per_host=4, idle_timeout=30
+        )
+
+        self.make_conn(upstream_pool)._new_conn()
+
+        create_connection.assert_called_once_with(
+            ("example.com", 80), Any(), socket_options=Any()
+        )
+
+    def make_conn(self, upstream_pool, scheme="http", port=80):
+        pool = upstream_pool.poolmanager.connection_from_host(
+            "example.com", port, scheme
+        )
+        return pool._new_conn()
+
+    @pytest.fixture
+    def dns_cache(self):
+        dns_cache = create_autospec(DNSCache, instance=True, spec_set=True)
+        dns_cache.resolve.return_value = ["192.0.2.1", "192.0.2.2"]
+        return dns_cache
+
+    @pytest.fixture
+    def upstream_pool(self, dns_cache):
+        return UpstreamPool(
+            max_hosts=10,
+            max_connections_per_host=4,
+            idle_timeout=30,
+            dns_cache=dns_cache,
+        )
+
+    @pytest.fixture
+    def create_connection(self, patch):
+        return patch("urllib3.connection.connection.create_connection")
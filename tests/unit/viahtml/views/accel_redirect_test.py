@@ -0,0 +1,165 @@
+import shlex
+from collections import defaultdict
+from pathlib import Path
+from unittest.mock import create_autospec, sentinel
+
+import pytest
+from h_matchers import Any
+
+from viahtml.hooks._headers import Headers
+from viahtml.views.accel_redirect import AccelRedirectView
+
+
+class TestAccelRedirectView:
+    @pytest.mark.parametrize(
+        "path,sec_fetch_dest",
+        (
+            ("/proxy/im_/https://example.com/image.png", None),
+            ("/proxy/oe_/https://example.com/doc.pdf", None),
+            ("/proxy/https://example.com/font.woff2", "font"),
+            ("/proxy/mp_/https://example.com/video.mp4", "video"),
+        ),
+    )
+    def test_it_offloads_binary_subresources(
+        self, view, context, headers, path, sec_fetch_dest
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        context.path = path
+        headers["Sec-Fetch-Dest"] = sec_fetch_dest
+
+        response = view(context)
+
+        context.make_response.assert_called_once_with(
+            200,
+            headers={
+                "X-Accel-Redirect": "/_upstream/",
+                "X-Via-Upstream-Url": "https://example.com/proxied",
+                "X-Via-Upstream-Prefix": path[: path.index("https:")],
+                "X-Via-Upstream-Origin": "https://example.com",
+                "X-Via-Upstream-Referer": "https://example.com/page",
+            },
+        )
+        assert response == context.make_response.return_value
+
+    def test_it_sends_an_empty_referer_without_a_proxied_referrer(self, view, context):
+        context.proxied_referrer = None
+
+        view(context)
+
+        context.make_response.assert_called_once_with(
+            200, headers=Any.dict.containing({"X-Via-Upstream-Referer": ""})
+        )
+
+    @pytest.mark.parametrize(
+        "path,sec_fetch_dest",
+        (
+            # Pages and other things which are rewritten
+            ("/proxy/https://example.com/", "document"),
+            ("/proxy/mp_/https://example.com/", "iframe"),
+            ("/proxy/js_/https://example.com/script.js", "script"),
+            ("/proxy/cs_/https://example.com/style.css", None),
+            # Not a proxied URL
+            ("/_status", "image"),
+        ),
+    )
+    def test_it_ignores_other_requests(
+        self, view, context, headers, path, sec_fetch_dest
+    ):  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        context.path = path
+        headers["Sec-Fetch-Dest"] = sec_fetch_dest
+
+        assert view(context) is None
+
+    @pytest.mark.parametrize(
+        "url",
+        (None, "ftp://example.com/image.png", "https://example.com/é.png"),
+    )
+    def test_it_ignores_urls_nginx_cannot_fetch(self, view, context, url):
+        context.proxied_url = url
+
+        assert view(context) is None
+
+    @pytest.mark.parametrize("method", ("POST", "PUT", "DELETE"))
+    def test_it_ignores_other_methods(self, view, context, method):
+        context.http_environ["REQUEST_METHOD"] = method
+
+        assert view(context) is None
+
+    def test_it_waits_for_deferred_checks(self, view, context):
+        deferred = create_autospec(lambda: None, return_value=None)
+        context.deferred.append(deferred)
+
+        view(context)
+
+        deferred.assert_called_once_with()
+        assert not context.deferred
+        context.make_response.assert_called_once()
+
+    def test_it_returns_responses_from_deferred_checks(self, view, context):
+        context.deferred.append(lambda: sentinel.blocked)
+
+        response = view(context)
+
+        assert response == sentinel.blocked
+        context.make_response.assert_not_called()
+
+    @pytest.fixture
+    def view(self):
+        return AccelRedirectView()
+
+    @pytest.fixture
+    def headers(self):
+        return {}
+
+    @pytest.fixture
+    def context(self, context, headers):
+        context.http_environ = {"REQUEST_METHOD": "GET"}
+        context.path = "/proxy/im_/https://example.com/proxied"
+        context.proxied_url = "https://example.com/proxied"
+        context.proxied_referrer = "https://example.com/page"
+        context.deferred = []
+        context.get_header.side_effect = headers.get
+        return context
+
+
+class TestNginxConfig:
+    """Check nginx does to the headers what `Headers` does in the app."""
+
+    def test_it_removes_the_headers_we_block_from_requests(self, directives):
+        blanked = {args[0] for args in directives["proxy_set_header"] if not args[1]}
+
+        # We also drop the browser's cookies and keep the connection alive
+        assert blanked == Headers.BLOCKED_INBOUND | {"Cookie", "Connection"}
+
+    def test_it_adds_our_headers_to_requests(self, directives):
+        assert set(Headers.ADDED_INBOUND) <= {
+            tuple(args) for args in directives["proxy_set_header"]
+        }
+
+    def test_it_removes_the_headers_we_block_from_responses(self, directives):
+        hidden = {args[0] for args in directives["proxy_hide_header"]}
+
+        # The app's `Headers` don't drop cookies, as `pywb` rewrites them
+        assert hidden == Headers.BLOCKED_OUTBOUND | {"Set-Cookie"}
+
+    def test_it_adds_our_headers_to_responses(self, directives):
+        added = [tuple(args[:2]) for args in directives["add_header"]]
+
+        assert added == list(Headers.ADDED_OUTBOUND) + [("X-Via", "accel")]
+        assert all(args[2:] == ["always"] for args in directives["add_header"])
+
+    @pytest.fixture
+    def directives(self):
+        config = (
+            Path(__file__).parents[4] / "conf/nginx/viahtml/accel_redirect.conf"
+        ).read_text(encoding="utf-8")
+
+        directives = defaultdict(list)
+        for line in config.splitlines():
+            line = line.strip()
+            if not line.endswith(";"):
+                continue
+
+            name, *args = shlex.split(line[:-1])
+            directives[name].append(args)
+
+        return directives
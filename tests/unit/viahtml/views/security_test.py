@@ -2,11 +2,13 @@ from functools import partial
 from http import HTTPStatus
 from unittest.mock import create_autospec, sentinel
 
+import gevent
 import pytest
 from checkmatelib import BadURL, CheckmateClient, CheckmateException
 from checkmatelib.client import BlockResponse
 from h_matchers import Any
 
+from viahtml.checkmate import CircuitOpen, DocumentTokens
 from viahtml.views.security import SecurityView
 
 
@@ -228,6 +230,36 @@ def test_if_checkmate_crashes_it_allows_the_request(
     assert response is None
 
 
+@pytest.mark.parametrize("exception", [CheckmateException, CircuitOpen])
+def test_if_configured_to_fail_closed_and_checkmate_crashes_it_denies_the_request(
+    check_url, context, exception, request_headers, view_kwargs
+):  # pylint:disable=too-many-arguments
+    check_url.side_effect = exception
+    request_headers["Sec-Fetch-Site"] = "same-origin"
+    view_kwargs["fail_closed"] = True
+
+    response = SecurityView(**view_kwargs)(context)
+
+    context.make_response.assert_called_once_with(
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        lines=[Any.string.containing("503 Service Unavailable")],
+        headers={"Content-Type": "text/html; charset=utf-8", "Retry-After": "30"},
+    )
+    assert response == context.make_response.return_value
+
+
+def test_it_doesnt_log_every_request_when_the_circuit_is_open(
+    check_url, context, request_headers, view_kwargs, caplog
+):  # pylint:disable=too-many-arguments
+    check_url.side_effect = CircuitOpen
+    request_headers["Sec-Fetch-Site"] = "same-origin"
+
+    response = SecurityView(**view_kwargs)(context)
+
+    assert response is None
+    assert not caplog.records
+
+
 def test_if_checkmate_raises_BadURL_we_present_it(
     check_url, context, request_headers, view_kwargs
 ):
@@ -246,6 +278,274 @@ def test_if_checkmate_raises_BadURL_we_present_it(
     assert response == context.make_response.return_value
 
 
+class TestSpeculativeChecks:
+    def test_it_defers_the_check(self, check_url, context, view_kwargs):
+        response = SecurityView(**view_kwargs)(context)
+
+        assert response is None
+        assert len(context.deferred) == 1
+        # Nothing has had a chance to run the check yet
+        check_url.assert_not_called()
+
+    def test_the_check_runs_in_the_background(self, check_url, context, view_kwargs):
+        SecurityView(**view_kwargs)(context)
+
+        gevent.sleep(0)
+
+        check_url.assert_called_once()
+
+    def test_it_allows_allowed_urls(self, check_url, context, view_kwargs):
+        SecurityView(**view_kwargs)(context)
+
+        response = context.deferred[0]()
+
+        check_url.assert_called_once()
+        assert response is None
+
+    @pytest.mark.usefixtures("with_checkmate_blocking_all_urls")
+    def test_it_blocks_blocked_urls(
+        self, assert_blocked_by_checkmate, context, view_kwargs
+    ):
+        SecurityView(**view_kwargs)(context)
+
+        response = context.deferred[0]()
+
+        assert_blocked_by_checkmate(response)
+
+    def test_it_presents_bad_urls(self, check_url, context, view_kwargs):
+        check_url.side_effect = BadURL
+        SecurityView(**view_kwargs)(context)
+
+        context.deferred[0]()
+
+        assert context.make_response.call_args[0][0] == HTTPStatus.BAD_REQUEST
+
+    @pytest.mark.parametrize(
+        "url", ["http://10.0.0.1/admin", "http://169.254.169.254/latest/meta-data"]
+    )
+    def test_it_refuses_private_urls_before_they_are_fetched(
+        self, check_url, context, view_kwargs, url
+    ):  # pylint:disable=too-many-arguments
+        context.proxied_url = url
+
+        response = SecurityView(**view_kwargs)(context)
+
+        context.make_response.assert_called_once_with(
+            HTTPStatus.BAD_REQUEST, lines=Any(), headers=Any()
+        )
+        assert response == context.make_response.return_value
+        assert not context.deferred
+        gevent.sleep(0)
+        check_url.assert_not_called()
+
+    def test_it_does_nothing_without_a_url(self, context, view_kwargs):
+        context.proxied_url = None
+
+        response = SecurityView(**view_kwargs)(context)
+
+        assert response is None
+        assert not context.deferred
+
+    @pytest.fixture
+    def request_headers(self, request_headers):
+        request_headers["Sec-Fetch-Site"] = "same-origin"
+        return request_headers
+
+    @pytest.fixture
+    def view_kwargs(self, view_kwargs):
+        view_kwargs["speculative"] = True
+        return view_kwargs
+
+
+class TestDocumentTokens:
+    @pytest.mark.parametrize("sec_fetch_dest", ["image", "script", "style", "font"])
+    def test_it_admits_subresources_of_verified_documents_without_checkmate(
+        self,
+        check_url,
+        context,
+        document_tokens,
+        request_headers,
+        sec_fetch_dest,
+        view_kwargs,
+    ):  # pylint:disable=too-many-arguments
+        request_headers["Sec-Fetch-Dest"] = sec_fetch_dest
+
+        response = SecurityView(**view_kwargs)(context)
+
+        document_tokens.is_verified.assert_called_once_with(
+            context.proxied_referrer, request_headers["Cookie"]
+        )
+        check_url.assert_not_called()
+        assert response is None
+        assert get_header(context, "X-Via-Checkmate-Skipped") == ["Document token"]
+
+    def test_it_only_says_why_it_skipped_checkmate_in_debug_mode(
+        self, context, view_kwargs
+    ):
+        context.debug = False
+
+        SecurityView(**view_kwargs)(context)
+
+        assert not get_header(context, "X-Via-Checkmate-Skipped")
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "http://10.0.0.1/image.png",
+            "http://169.254.169.254/latest/meta-data",
+            "http://internal/image.png",
+        ],
+    )
+    def test_it_refuses_private_subresources_of_verified_documents(
+        self, check_url, context, view_kwargs, url
+    ):  # pylint:disable=too-many-arguments
+        context.proxied_url = url
+        context.proxied_referrer = url.rsplit("/", 1)[0] + "/page"
+
+        response = SecurityView(**view_kwargs)(context)
+
+        check_url.assert_not_called()
+        context.make_response.assert_called_once_with(
+            HTTPStatus.BAD_REQUEST, lines=Any(), headers=Any()
+        )
+        assert response == context.make_response.return_value
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "https://other.example.com/image.png",
+            "http://example.com/image.png",
+            "https://example.com:8443/image.png",
+        ],
+    )
+    def test_it_checks_cross_origin_subresources_of_verified_documents(
+        self, check_url, context, document_tokens, view_kwargs, url
+    ):  # pylint:disable=too-many-arguments
+        context.proxied_url = url
+
+        SecurityView(**view_kwargs)(context)
+
+        document_tokens.is_verified.assert_not_called()
+        check_url.assert_called_once()
+
+    @pytest.mark.parametrize("referrer", [None, "http://[invalid/page"])
+    def test_it_checks_subresources_without_a_usable_referrer(
+        self, check_url, context, view_kwargs, referrer
+    ):
+        context.proxied_referrer = referrer
+
+        SecurityView(**view_kwargs)(context)
+
+        check_url.assert_called_once()
+
+    @pytest.mark.parametrize("sec_fetch_dest", [None, "document", "iframe", "empty"])
+    def test_it_checks_other_requests(
+        self, check_url, context, request_headers, sec_fetch_dest, view_kwargs
+    ):  # pylint:disable=too-many-arguments
+        request_headers["Sec-Fetch-Dest"] = sec_fetch_dest
+
+        SecurityView(**view_kwargs)(context)
+
+        check_url.assert_called_once()
+
+    def test_it_checks_subresources_of_unverified_documents(
+        self, check_url, context, document_tokens, view_kwargs
+    ):
+        document_tokens.is_verified.return_value = False
+
+        SecurityView(**view_kwargs)(context)
+
+        check_url.assert_called_once()
+
+    def test_it_checks_unauthorized_subresources(
+        self, check_url, context, request_headers, view_kwargs
+    ):
+        del request_headers["Sec-Fetch-Site"]
+
+        SecurityView(**view_kwargs)(context)
+
+        check_url.assert_not_called()
+        assert context.make_response.call_args[0][0] == HTTPStatus.UNAUTHORIZED
+
+    @pytest.mark.parametrize("sec_fetch_dest", ["document", "iframe"])
+    def test_it_gives_allowed_documents_a_token(
+        self, context, document_tokens, request_headers, sec_fetch_dest, view_kwargs
+    ):  # pylint:disable=too-many-arguments
+        request_headers["Sec-Fetch-Dest"] = sec_fetch_dest
+
+        SecurityView(**view_kwargs)(context)
+
+        document_tokens.make_cookie.assert_called_once_with(context.proxied_url)
+        assert get_header(context, "Set-Cookie") == [
+            document_tokens.make_cookie.return_value
+        ]
+
+    @pytest.mark.usefixtures("with_checkmate_blocking_all_urls")
+    def test_it_does_not_give_blocked_documents_a_token(
+        self, context, document_tokens, request_headers, view_kwargs
+    ):
+        request_headers["Sec-Fetch-Dest"] = "document"
+
+        SecurityView(**view_kwargs)(context)
+
+        document_tokens.make_cookie.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "cookie,expected",
+        [
+            ("a=1; via.verified.abc=1.2", {"HTTP_COOKIE": "a=1"}),
+            ("via.verified.abc=1.2", {}),
+        ],
+    )
+    def test_it_does_not_pass_tokens_on(
+        self, context, request_headers, view_kwargs, cookie, expected
+    ):  # pylint:disable=too-many-arguments
+        request_headers["Cookie"] = cookie
+
+        SecurityView(**view_kwargs)(context)
+
+        assert context.http_environ == expected
+
+    def test_it_does_nothing_with_tokens_when_disabled(
+        self, check_url, context, document_tokens, request_headers, view_kwargs
+    ):  # pylint:disable=too-many-arguments
+        view_kwargs["document_tokens"] = None
+        request_headers["Sec-Fetch-Dest"] = "document"
+
+        SecurityView(**view_kwargs)(context)
+        request_headers["Sec-Fetch-Dest"] = "image"
+        SecurityView(**view_kwargs)(context)
+
+        assert check_url.call_count == 2
+        document_tokens.is_verified.assert_not_called()
+        document_tokens.make_cookie.assert_not_called()
+        assert context.http_environ == {"HTTP_COOKIE": request_headers["Cookie"]}
+
+    @pytest.fixture
+    def context(self, context, request_headers):
+        context.proxied_referrer = "https://example.com/page"
+        context.http_environ = {"HTTP_COOKIE": request_headers["Cookie"]}
+        return context
+
+    @pytest.fixture
+    def request_headers(self, request_headers):
+        request_headers["Sec-Fetch-Site"] = "same-origin"
+        request_headers["Sec-Fetch-Dest"] = "image"
+        request_headers["Cookie"] = "a=1"
+        return request_headers
+
+    @pytest.fixture
+    def view_kwargs(self, view_kwargs, document_tokens):
+        view_kwargs["document_tokens"] = document_tokens
+        return view_kwargs
+
+    @pytest.fixture
+    def document_tokens(self):
+        document_tokens = create_autospec(DocumentTokens, instance=True, spec_set=True)
+        document_tokens.is_verified.return_value = True
+        return document_tokens
+
+
 @pytest.fixture
 def assert_blocked_by_checkmate(check_url, context):
     """Return a function that asserts that a response is a Checkmate block."""
@@ -292,6 +592,7 @@ def context(context, request_headers):
     context.headers = []
     context.get_header.side_effect = request_headers.get
     context.query_params = {}
+    context.deferred = []
     return context
 
 
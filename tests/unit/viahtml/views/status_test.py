@@ -3,7 +3,10 @@ from unittest.mock import create_autospec
 
 import pytest
 from checkmatelib import CheckmateClient, CheckmateException
+from h_matchers import Any
 
+from viahtml.checkmate import CircuitBreaker
+from viahtml.upstream import UpstreamPool
 from viahtml.views.status import StatusView
 
 
@@ -161,6 +164,31 @@ class TestStatusView:
             },
         )
 
+    def test_it_reports_the_circuit_breaker_state(self, context, checkmate):
+        circuit_breaker = create_autospec(CircuitBreaker, instance=True)
+        circuit_breaker.status = {"state": "open", "failures": 5}
+
+        StatusView(checkmate, circuit_breaker)(context)
+
+        # An open circuit doesn't mean we're down
+        context.make_json_response.assert_called_once_with(
+            {"status": "okay", "checkmate_circuit": {"state": "open", "failures": 5}},
+            http_status=200,
+            headers=Any(),
+        )
+
+    def test_it_reports_upstream_pool_stats(self, context, checkmate):
+        upstream_pool = create_autospec(UpstreamPool, instance=True)
+        upstream_pool.stats = {"hosts": 2, "idle_connections": 3}
+
+        StatusView(checkmate, upstream_pool=upstream_pool)(context)
+
+        context.make_json_response.assert_called_once_with(
+            {"status": "okay", "upstream_pool": {"hosts": 2, "idle_connections": 3}},
+            http_status=200,
+            headers=Any(),
+        )
+
     @pytest.fixture
     def checkmate(self):
         return create_autospec(CheckmateClient, instance=True, spec_set=True)
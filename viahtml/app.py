@@ -2,7 +2,9 @@
 
 import logging
 import os
+import re
 from functools import partial
+from time import perf_counter
 
 # isort: off
 # This import has to come before the CheckmateClient import or the functional
@@ -14,14 +16,37 @@ from pywb.apps.frontendapp import FrontEndApp
 
 import importlib_resources
 from checkmatelib import CheckmateClient
+from werkzeug.wsgi import ClosingIterator
 
+from viahtml import metrics
+from viahtml.checkmate import (
+    CircuitBreaker,
+    DocumentTokens,
+    LocalBlocklist,
+    SharedVerdictCache,
+    VerdictCache,
+)
+from viahtml.compression import Compression
 from viahtml.context import Context
+from viahtml.dns_cache import DNSCache
 from viahtml.hooks import Hooks
 from viahtml.patch import apply_post_app_hooks, apply_pre_app_hooks
+from viahtml.render_cache import RenderCache
+from viahtml.upstream import UpstreamPool
+from viahtml.views.accel_redirect import AccelRedirectView
 from viahtml.views.routing import RoutingView
 from viahtml.views.security import SecurityView
 from viahtml.views.status import StatusView
 
+_PROXY_PATH = re.compile(r"^/proxy/(?:([a-z]{2}_)/)?")
+
+_DOCUMENT_MODIFIERS = {None, "mp_", "if_", "fr_"}
+"""`pywb` URL modifiers for pages, rather than subresources like `js_`."""
+
+
+def _discard(_data):
+    """Do nothing with data written to a response we have replaced."""
+
 
 def asbool(value):
     """Return True if value is any of "t", "true", "y", etc (case-insensitive)."""
@@ -43,32 +68,102 @@ class Application:
         checkmate = CheckmateClient(
             config["checkmate_host"], config["checkmate_api_key"]
         )
-        check_url = partial(
-            checkmate.check_url, ignore_reasons=config["checkmate_ignore_reasons"]
+        check_url = self._counted(
+            partial(
+                checkmate.check_url, ignore_reasons=config["checkmate_ignore_reasons"]
+            )
         )
+        circuit_breaker = None
+        if config["checkmate_circuit_failures"]:
+            circuit_breaker = CircuitBreaker(
+                check_url,
+                timeout=config["checkmate_timeout"],
+                failure_threshold=config["checkmate_circuit_failures"],
+                reset_timeout=config["checkmate_circuit_reset"],
+            )
+
+        check_url = self._with_blocklist(
+            self._cached(circuit_breaker or check_url, config), config
+        )
+
+        document_tokens = None
+        if config["subresource_token_secret"]:
+            document_tokens = DocumentTokens(
+                config["subresource_token_secret"],
+                ttl=config["subresource_token_ttl"],
+            )
 
-        self.views = (
-            StatusView(checkmate),
+        dns_cache = None
+        if config["dns_cache_size"]:
+            dns_cache = DNSCache(
+                max_size=config["dns_cache_size"],
+                ttl=config["dns_cache_ttl"],
+                negative_ttl=config["dns_cache_negative_ttl"],
+            )
+
+        upstream_pool = UpstreamPool(
+            max_hosts=config["upstream_pool_hosts"],
+            max_connections_per_host=config["upstream_pool_connections"],
+            idle_timeout=config["upstream_pool_idle_timeout"],
+            dns_cache=dns_cache,
+        )
+
+        views = [
+            StatusView(checkmate, circuit_breaker, upstream_pool),
             SecurityView(
                 config["checkmate_allow_all"],
                 config["allowed_referrers"],
                 not config["disable_authentication"],
                 check_url,
+                document_tokens=document_tokens,
+                fail_closed=config["checkmate_fail_closed"],
+                speculative=config["checkmate_speculative"],
             ),
-            RoutingView(config["routing_host"]),
-        )
+        ]
+        if config["accel_redirect"]:
+            if config["inbound_header_rules"]:
+                # nginx fetches the offloaded requests itself, with the
+                # headers in `accel_redirect.conf` rather than our rules
+                raise EnvironmentError(
+                    "VIA_INBOUND_HEADER_RULES can't be used with "
+                    "VIA_ACCEL_REDIRECT, as nginx wouldn't apply them"
+                )
+
+            # This has to come after the `SecurityView`
+            views.append(AccelRedirectView())
+        views.append(RoutingView(config["routing_host"]))
+        self.views = tuple(views)
 
         # Setup hook points and apply those which must be done pre-application
         apply_pre_app_hooks(self.hooks)
+        upstream_pool.install()
 
         self.app = FrontEndApp()
 
+        render_cache = None
+        if config["render_cache_size"]:
+            render_cache = RenderCache(
+                # The size is configured in megabytes
+                max_size=config["render_cache_size"] * 1024 * 1024,
+                fresh_ttl=config["render_cache_fresh_ttl"],
+                stale_ttl=config["render_cache_ttl"],
+            )
+
         # Setup hook points after the app is loaded
-        apply_post_app_hooks(self.app.rewriterapp, self.hooks)
+        apply_post_app_hooks(self.app.rewriterapp, self.hooks, render_cache)
+
+        self.compression = None
+        if config["compression_gzip_level"] or config["compression_brotli_quality"]:
+            self.compression = Compression(
+                gzip_level=config["compression_gzip_level"],
+                brotli_quality=config["compression_brotli_quality"],
+                min_size=config["compression_min_size"],
+            )
 
     def __call__(self, environ, start_response):
         """Handle WSGI requests."""
 
+        start = perf_counter()
         context = Context(
             debug=self._config["debug"],
             http_environ=environ,
@@ -76,23 +171,138 @@ class Application:
         )
         self.hooks.set_context(context)
 
-        for view in self.views:
-            response = view(context)
-            if response is not None:
-                return response
+        with context.timed("views"):
+            for view in self.views:
+                response = view(context)
+                if response is not None:
+                    metrics.observe(f"latency.{view.ROUTE}", perf_counter() - start)
+                    return response
 
         # Looks like it's a normal request to proxy...
+        replacement = []
+
+        # Responses we make ourselves below aren't compressed, as they use
+        # the context's `start_response()`
+        start_response, compress = self._compression(environ, start_response)
+
         def proxy_start_response(status, headers):
-            # If any of our views added headers as they went, add them now
-            if context.headers:
-                headers.extend(context.headers)
+            # Any of our views may have left a decision until now
+            with context.timed("deferred"):
+                for deferred in context.deferred:
+                    response = deferred()
+                    if response is not None:
+                        # This has already called `start_response()` for us.
+                        # Nothing is written to the proxied response's writer,
+                        # so give back one which drops anything it's given.
+                        replacement.append(response)
+                        return _discard
 
-            headers = self.hooks.headers.modify_outbound(headers)
+            if context.debug:
+                context.headers.append(("Server-Timing", context.server_timing))
+
+            # If any of our views added headers as they went, add them now
+            headers = self.hooks.headers.modify_outbound(headers, context.headers)
 
             return start_response(status, headers)
 
         environ = self.hooks.headers.modify_inbound(environ)
-        return self.app(environ, proxy_start_response)
+        # `pywb` calls `start_response()` before it returns the body, rather
+        # than when the body is first iterated, which is what lets us check
+        # for a replacement straight away below
+        response = self.app(environ, proxy_start_response)
+
+        if replacement:
+            # Stop reading the proxied response, freeing up the connection
+            if hasattr(response, "close"):
+                response.close()
+
+            metrics.observe("latency.blocked", perf_counter() - start)
+            return replacement[0]
+
+        # Some parts (like rewriting) only finish once the body has been sent
+        return ClosingIterator(
+            compress(response), partial(self._report_timings, context, start)
+        )
+
+    @classmethod
+    def _report_timings(cls, context, start):
+        metrics.observe(f"latency.{cls._route(context)}", perf_counter() - start)
+
+        for name, seconds in context.timings.items():
+            metrics.observe(f"timing.{name}", seconds)
+
+    @staticmethod
+    def _route(context):
+        """Get the route class of a proxied request for reporting latency."""
+        destination = context.get_header("Sec-Fetch-Dest")
+        if destination:
+            if destination in SecurityView.DOCUMENT_DESTINATIONS:
+                return "document"
+
+            return "subresource"
+
+        # Without the header, we can tell from the modifier `pywb` puts in the
+        # path, like `/proxy/js_/...` for scripts
+        match = _PROXY_PATH.match(context.path)
+        if match and match.group(1) in _DOCUMENT_MODIFIERS:
+            return "document"
+
+        return "subresource"
+
+    def _compression(self, environ, start_response):
+        if not self.compression:
+            return start_response, lambda response: response
+
+        return self.compression(environ, start_response)
+
+    @staticmethod
+    def _counted(check_url):
+        """Count the checks which get past our caches to Checkmate."""
+
+        def counted_check_url(*args, **kwargs):
+            metrics.increment("checkmate.calls")
+            return check_url(*args, **kwargs)
+
+        return counted_check_url
+
+    @staticmethod
+    def _with_blocklist(check_url, config):
+        """Answer what we can from the local blocklist, if there is one."""
+        if not config["blocklist_path"]:
+            return check_url
+
+        return LocalBlocklist(
+            check_url,
+            path=config["blocklist_path"],
+            checkmate_host=config["checkmate_host"],
+            ignore_reasons=config["checkmate_ignore_reasons"],
+        )
+
+    @staticmethod
+    def _cached(check_url, config):
+        """Wrap a Checkmate `check_url` function with the configured caches."""
+        if config["checkmate_shared_cache"]:
+            if SharedVerdictCache.is_supported():
+                check_url = SharedVerdictCache(
+                    check_url,
+                    cache_name=config["checkmate_shared_cache"],
+                    allowed_ttl=config["checkmate_cache_allowed_ttl"],
+                    blocked_ttl=config["checkmate_cache_blocked_ttl"],
+                )
+            else:
+                logging.warning(
+                    "Not using the shared Checkmate cache as we aren't running in uWSGI"
+                )
+
+        if not config["checkmate_cache_size"]:
+            return check_url
+
+        return VerdictCache(
+            check_url,
+            max_size=config["checkmate_cache_size"],
+            allowed_ttl=config["checkmate_cache_allowed_ttl"],
+            blocked_ttl=config["checkmate_cache_blocked_ttl"],
+        )
 
     @classmethod
     def _set_config_file(cls):
@@ -119,10 +329,67 @@ class Application:
             "disable_authentication": asbool(
                 os.environ.get("VIA_DISABLE_AUTHENTICATION", False)
             ),
+            "subresource_token_secret": os.environ.get("VIA_SUBRESOURCE_TOKEN_SECRET"),
+            "subresource_token_ttl": int(
+                os.environ.get("VIA_SUBRESOURCE_TOKEN_TTL", 300)
+            ),
+            "blocklist_path": os.environ.get("VIA_BLOCKLIST_PATH"),
+            "accel_redirect": asbool(os.environ.get("VIA_ACCEL_REDIRECT")),
+            "inbound_header_rules": cls._split_multiline(
+                os.environ.get("VIA_INBOUND_HEADER_RULES", "")
+            ),
+            "head_flush_size": int(os.environ.get("VIA_HEAD_FLUSH_SIZE", 2048)),
+            "compression_gzip_level": int(
+                os.environ.get("VIA_COMPRESSION_GZIP_LEVEL", 6)
+            ),
+            "compression_brotli_quality": int(
+                os.environ.get("VIA_COMPRESSION_BROTLI_QUALITY", 4)
+            ),
+            "compression_min_size": int(
+                os.environ.get("VIA_COMPRESSION_MIN_SIZE", 1024)
+            ),
+            # Relative to this package, where we run from
+            "static_manifest": os.environ.get(
+                "VIA_STATIC_MANIFEST", "../static/manifest.json"
+            ),
+            "render_cache_size": int(os.environ.get("VIA_RENDER_CACHE_SIZE", 0)),
+            "render_cache_fresh_ttl": int(
+                os.environ.get("VIA_RENDER_CACHE_FRESH_TTL", 60)
+            ),
+            "render_cache_ttl": int(os.environ.get("VIA_RENDER_CACHE_TTL", 600)),
+            "upstream_pool_hosts": int(os.environ.get("VIA_UPSTREAM_POOL_HOSTS", 100)),
+            "upstream_pool_connections": int(
+                os.environ.get("VIA_UPSTREAM_POOL_CONNECTIONS", 10)
+            ),
+            "upstream_pool_idle_timeout": int(
+                os.environ.get("VIA_UPSTREAM_POOL_IDLE_TIMEOUT", 30)
+            ),
+            "dns_cache_size": int(os.environ.get("VIA_DNS_CACHE_SIZE", 1000)),
+            "dns_cache_ttl": int(os.environ.get("VIA_DNS_CACHE_TTL", 30)),
+            "dns_cache_negative_ttl": int(
+                os.environ.get("VIA_DNS_CACHE_NEGATIVE_TTL", 5)
+            ),
             "checkmate_host": os.environ["CHECKMATE_URL"],
             "checkmate_ignore_reasons": os.environ.get("CHECKMATE_IGNORE_REASONS"),
             "checkmate_api_key": os.environ["CHECKMATE_API_KEY"],
             "checkmate_allow_all": asbool(os.environ.get("CHECKMATE_ALLOW_ALL")),
+            "checkmate_timeout": float(os.environ.get("CHECKMATE_TIMEOUT", 0.5)),
+            "checkmate_circuit_failures": int(
+                os.environ.get("CHECKMATE_CIRCUIT_FAILURES", 5)
+            ),
+            "checkmate_circuit_reset": int(
+                os.environ.get("CHECKMATE_CIRCUIT_RESET", 30)
+            ),
+            "checkmate_fail_closed": asbool(os.environ.get("CHECKMATE_FAIL_CLOSED")),
+            "checkmate_speculative": asbool(os.environ.get("CHECKMATE_SPECULATIVE")),
+            "checkmate_shared_cache": os.environ.get("CHECKMATE_SHARED_CACHE"),
+            "checkmate_cache_size": int(os.environ.get("CHECKMATE_CACHE_SIZE", 2048)),
+            "checkmate_cache_allowed_ttl": int(
+                os.environ.get("CHECKMATE_CACHE_ALLOWED_TTL", 60)
+            ),
+            "checkmate_cache_blocked_ttl": int(
+                os.environ.get("CHECKMATE_CACHE_BLOCKED_TTL", 300)
+            ),
         }
 
     @classmethod
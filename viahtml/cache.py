@@ -0,0 +1,80 @@
+"""A small in-process cache for values which are expensive to get."""
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCache:
+    """A size bounded, least recently used cache with per-item expiry.
+
+    This is not shared between processes and does no locking. That's fine
+    under `gevent` as nothing in here yields to other greenlets.
+    """
+
+    def __init__(self, max_size, size_of=None):
+        """Create a new empty cache.
+
+        :param max_size: The maximum total size of the items to keep
+        :param size_of: A function returning the size of a value. By default
+            every item has a size of 1, so `max_size` is a count of items.
+        """
+        self.max_size = max_size
+        self.size = 0
+        """The current total size of the items in the cache."""
+
+        self.hits = 0
+        self.misses = 0
+
+        self._size_of = size_of
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Get an item from the cache if present and not expired.
+
+        :param key: The key to look up
+        :param default: Value to return when the item isn't found
+        """
+        item = self._items.get(key)
+
+        if item is not None:
+            value, expires_at, _size = item
+            if expires_at > monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+
+            self._remove(key)
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl):
+        """Add an item to the cache, evicting the oldest items if required.
+
+        Items with no time to live, or which are bigger than the cache
+        itself, are not stored.
+
+        :param key: The key to store the value under
+        :param value: The value to store
+        :param ttl: How long to keep the value for in seconds
+        """
+        if key in self._items:
+            self._remove(key)
+
+        size = self._size_of(value) if self._size_of else 1
+        if ttl <= 0 or size > self.max_size:
+            return
+
+        self._items[key] = (value, monotonic() + ttl, size)
+        self.size += size
+
+        while self.size > self.max_size:
+            _key, (_value, _expires_at, evicted_size) = self._items.popitem(last=False)
+            self.size -= evicted_size
+
+    def _remove(self, key):
+        _value, _expires_at, size = self._items.pop(key)
+        self.size -= size
@@ -0,0 +1,8 @@
+"""Wrappers around Checkmate to make checking URLs cheaper."""
+
+from viahtml.checkmate._blocklist import Blocklist, LocalBlocklist
+from viahtml.checkmate._cache import VerdictCache
+from viahtml.checkmate._circuit_breaker import CircuitBreaker, CircuitOpen
+from viahtml.checkmate._document_token import DocumentTokens
+from viahtml.checkmate._shared_cache import SharedVerdictCache
+from viahtml.checkmate._url import check_public_url
@@ -0,0 +1,212 @@
+"""A local list of domains and URLs we know what to do with."""
+
+import logging
+import os
+from time import monotonic
+from urllib.parse import urlencode, urlsplit
+
+from checkmatelib.client import BlockResponse
+
+LOG = logging.getLogger(__name__)
+
+_NOT_LOADED = object()
+
+
+class Blocklist:
+    """A compiled list of rules about domains and URLs.
+
+    The file has one rule per line, made of a domain (optionally followed by
+    a path prefix) and a reason:
+
+        # Comments and blank lines are ignored
+        example.com publisher-blocked
+        example.net/some/path malicious
+        docs.example.net allowed
+
+    A rule for a domain applies to all of its subdomains, and the most
+    specific matching rule wins. The reason `allowed` means the URL is
+    definitely fine, anything else is a Checkmate reason code to block with.
+
+    The rules are kept in a trie of reversed domain labels, so a lookup is a
+    few dict lookups no matter how many rules there are.
+    """
+
+    ALLOWED = "allowed"
+    """The reason used for rules which allow a URL."""
+
+    _RULES = object()
+    """The trie key the rules for a domain are stored under."""
+
+    def __init__(self):
+        """Create a new empty blocklist."""
+        self._trie = {}
+        self.size = 0
+        """The number of rules in the list."""
+
+    def add(self, domain, path_prefix, reason):
+        """Add a rule.
+
+        :param domain: The domain the rule applies to, including subdomains
+        :param path_prefix: The path the rule applies to, or "" for all
+        :param reason: `ALLOWED` or a reason to block
+        """
+        node = self._trie
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+
+        rules = node.setdefault(self._RULES, [])
+        rules.append((path_prefix, reason))
+        # Check the most specific paths first
+        rules.sort(key=lambda rule: len(rule[0]), reverse=True)
+
+        self.size += 1
+
+    def match(self, url):
+        """Get the reason from the most specific rule matching a URL.
+
+        :return: `ALLOWED`, a reason to block or None if no rules match
+        """
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            return None
+
+        hostname = parts.hostname
+        if not hostname:
+            return None
+
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        reason = None
+        node = self._trie
+        for label in reversed(hostname.strip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+
+            for path_prefix, rule_reason in node.get(self._RULES, ()):
+                if path.startswith(path_prefix):
+                    # Keep going, as a subdomain may have a more specific rule
+                    reason = rule_reason
+                    break
+
+        return reason
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a blocklist from a file.
+
+        Lines which can't be understood are logged and skipped.
+        """
+        blocklist = cls()
+
+        with open(path, encoding="utf-8") as handle:
+            for line_number, line in enumerate(handle, start=1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+
+                try:
+                    pattern, reason = line.split()
+                except ValueError:
+                    LOG.warning("Ignoring bad blocklist line %d: %r", line_number, line)
+                    continue
+
+                domain, slash, path_prefix = pattern.partition("/")
+                blocklist.add(domain, slash + path_prefix, reason)
+
+        return blocklist
+
+
+class LocalBlocklist:
+    """Answer Checkmate checks from a local blocklist where we can.
+
+    URLs the blocklist allows or blocks are answered straight away, and only
+    the rest are passed on to Checkmate. The file is reloaded when it
+    changes, checking at most every `RELOAD_INTERVAL` seconds.
+
+    This has the same call signature as `CheckmateClient.check_url` and can be
+    used in its place.
+    """
+
+    RELOAD_INTERVAL = 10
+    """Seconds between checks for a changed blocklist file."""
+
+    def __init__(self, check_url, path, checkmate_host, ignore_reasons=None):
+        """Create a new local blocklist.
+
+        :param check_url: The function to call for URLs we don't know about
+        :param path: The path of the blocklist file
+        :param checkmate_host: The Checkmate host to show block pages from
+        :param ignore_reasons: Comma separated reasons to leave to Checkmate
+        """
+        self._check_url = check_url
+        self._path = path
+        self._block_url = f"{checkmate_host.rstrip('/')}/ui/block"
+        self._ignore_reasons = set((ignore_reasons or "").split(","))
+
+        self._blocklist = Blocklist()
+        self._mtime = _NOT_LOADED
+        self._checked_at = None
+
+    def __call__(self, url, allow_all=False, blocked_for=None):
+        """Check a URL, using the local blocklist if it has an answer.
+
+        :return: None if the URL is fine or a `BlockResponse` if there are
+           reasons to block the URL.
+        """
+        self._reload_if_changed()
+
+        reason = self._blocklist.match(url)
+
+        if reason == Blocklist.ALLOWED:
+            return None
+
+        if reason and reason not in self._ignore_reasons:
+            return self._block_response(url, reason, blocked_for)
+
+        return self._check_url(url=url, allow_all=allow_all, blocked_for=blocked_for)
+
+    def _block_response(self, url, reason, blocked_for):
+        query = {"url": url, "reason": reason}
+        if blocked_for:
+            query["blocked_for"] = blocked_for
+
+        return BlockResponse(
+            {
+                "data": [{"type": "reason", "id": reason}],
+                "links": {"html": f"{self._block_url}?{urlencode(query, doseq=True)}"},
+            }
+        )
+
+    def _reload_if_changed(self):
+        now = monotonic()
+        if self._checked_at is not None:
+            if now - self._checked_at < self.RELOAD_INTERVAL:
+                return
+        self._checked_at = now
+
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+
+        if mtime is None:
+            LOG.warning("Cannot find the blocklist at %s", self._path)
+            self._blocklist = Blocklist()
+            return
+
+        try:
+            self._blocklist = Blocklist.from_file(self._path)
+        except (OSError, UnicodeDecodeError):
+            # Keep the rules we had, and try again when the file changes
+            LOG.exception("Cannot read the blocklist at %s", self._path)
+            return
+
+        LOG.info("Loaded %d blocklist rules from %s", self._blocklist.size, self._path)
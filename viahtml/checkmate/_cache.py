@@ -0,0 +1,92 @@
+"""A per-worker cache of Checkmate verdicts."""
+
+from urllib.parse import urlsplit
+
+from viahtml import metrics
+from viahtml.cache import LRUCache
+
+_MISSING = object()
+
+
+class VerdictCache:
+    """Remember what Checkmate said about a URL for a while.
+
+    This has the same call signature as `CheckmateClient.check_url` and can be
+    used in its place. A busy page makes many requests for the same URLs in
+    quick succession, so this saves a Checkmate round trip for most of them.
+
+    Errors from Checkmate are not cached.
+    """
+
+    def __init__(self, check_url, max_size, allowed_ttl, blocked_ttl):
+        """Create a new cache.
+
+        :param check_url: The function to call to get verdicts we don't have
+        :param max_size: The maximum number of verdicts to remember
+        :param allowed_ttl: Seconds to remember that a URL is allowed for
+        :param blocked_ttl: Seconds to remember that a URL is blocked for
+        """
+        self._check_url = check_url
+        self._allowed_ttl = allowed_ttl
+        self._blocked_ttl = blocked_ttl
+        self._cache = LRUCache(max_size)
+
+    @property
+    def hits(self):
+        """Get the number of checks answered from the cache."""
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """Get the number of checks which had to be passed on."""
+        return self._cache.misses
+
+    def __call__(self, url, allow_all=False, blocked_for=None):
+        """Check a URL, using a cached verdict if we have one.
+
+        :return: None if the URL is fine or a `BlockResponse` if there are
+           reasons to block the URL.
+        """
+        key = self.cache_key(url, allow_all, blocked_for)
+
+        verdict = self._cache.get(key, _MISSING)
+        if verdict is not _MISSING:
+            metrics.increment("checkmate_cache.hits")
+            return verdict
+
+        metrics.increment("checkmate_cache.misses")
+
+        verdict = self._check_url(url=url, allow_all=allow_all, blocked_for=blocked_for)
+
+        self._cache.set(
+            key, verdict, ttl=self._blocked_ttl if verdict else self._allowed_ttl
+        )
+
+        return verdict
+
+    @classmethod
+    def cache_key(cls, url, allow_all, blocked_for):
+        """Get a key which is the same for all equivalent checks."""
+
+        # `blocked_for` comes from the parsed query string, so it's often a
+        # list of values
+        if isinstance(blocked_for, list):
+            blocked_for = tuple(blocked_for)
+
+        return cls.normalize_url(url), bool(allow_all), blocked_for
+
+    @staticmethod
+    def normalize_url(url):
+        """Normalize a URL so trivially different versions share a key.
+
+        This lower cases the scheme and host, and removes any fragment, none
+        of which make a difference to Checkmate.
+        """
+        try:
+            parts = urlsplit(url)
+        except ValueError:
+            return url
+
+        return parts._replace(
+            scheme=parts.scheme.lower(), netloc=parts.netloc.lower(), fragment=""
+        ).geturl()
@@ -0,0 +1,148 @@
+"""Stop waiting on Checkmate when it's struggling."""
+
+import logging
+from time import monotonic
+
+from checkmatelib import BadURL, CheckmateException
+from checkmatelib.exceptions import CheckmateServiceError
+from gevent import Timeout
+
+from viahtml import metrics
+
+LOG = logging.getLogger(__name__)
+
+
+class CircuitOpen(CheckmateServiceError):
+    """Checkmate wasn't called because it has been failing."""
+
+
+class CircuitBreaker:
+    """Fail Checkmate checks quickly when Checkmate is slow or down.
+
+    Every check gets a latency budget, which is usually much shorter than the
+    Checkmate client's own timeouts. Once enough checks in a row have failed
+    or run out of time the circuit "opens", and checks fail immediately with
+    `CircuitOpen` instead of tying up a greenlet.
+
+    After `reset_timeout` seconds the circuit is "half-open", and a single
+    check is let through as a trial. If it succeeds the circuit closes again,
+    otherwise it stays open for another `reset_timeout`.
+
+    This has the same call signature as `CheckmateClient.check_url` and can be
+    used in its place. It's per-worker, and relies on `gevent` to interrupt
+    checks which run over budget.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, check_url, timeout, failure_threshold, reset_timeout):
+        """Create a new circuit breaker.
+
+        :param check_url: The function to call to check URLs
+        :param timeout: Seconds a check can take before it counts as failed
+        :param failure_threshold: Failures in a row which will open the circuit
+        :param reset_timeout: Seconds to wait before trying Checkmate again
+        """
+        self._check_url = check_url
+        self._timeout = timeout
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        """Whether the circuit is closed, open or half-open."""
+
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def status(self):
+        """Get a summary of the circuit's state, suitable for JSON."""
+        return {"state": self.state, "failures": self._failures}
+
+    def __call__(self, url, allow_all=False, blocked_for=None):
+        """Check a URL, unless Checkmate has been failing.
+
+        :raises CircuitOpen: If the circuit is open
+        :raises CheckmateServiceError: If the check runs over budget
+        :return: None if the URL is fine or a `BlockResponse` if there are
+           reasons to block the URL.
+        """
+        state = self.state
+        self._before_check()
+
+        trial = self.state == self.HALF_OPEN
+        try:
+            verdict = self._check(url, allow_all, blocked_for)
+
+        except BadURL:
+            # The client raises this itself without calling Checkmate, so it
+            # says nothing about whether Checkmate is working. If this was
+            # the trial, leave it to the next check.
+            if trial:
+                self.state = state
+            raise
+
+        except CheckmateException:
+            self._on_failure()
+            raise
+
+        except BaseException:
+            # Don't get stuck half-open if the trial died some other way, like
+            # its greenlet being killed
+            if trial:
+                self._open()
+            raise
+
+        self._on_success()
+        return verdict
+
+    def _check(self, url, allow_all, blocked_for):
+        with Timeout(
+            self._timeout,
+            CheckmateServiceError(f"Checkmate took longer than {self._timeout}s"),
+        ):
+            return self._check_url(
+                url=url, allow_all=allow_all, blocked_for=blocked_for
+            )
+
+    def _before_check(self):
+        if self.state == self.CLOSED:
+            return
+
+        # Only one check at a time gets to try a half-open circuit
+        if (
+            self.state == self.HALF_OPEN
+            or monotonic() - self._opened_at < self._reset_timeout
+        ):
+            metrics.increment("checkmate.circuit.rejected")
+            raise CircuitOpen("Not calling Checkmate as it has been failing")
+
+        self.state = self.HALF_OPEN
+
+    def _on_success(self):
+        self._failures = 0
+
+        if self.state != self.CLOSED:
+            LOG.info("Checkmate is working again, closing the circuit")
+            self.state = self.CLOSED
+
+    def _on_failure(self):
+        metrics.increment("checkmate.circuit.failures")
+        self._failures += 1
+
+        if self.state == self.CLOSED and self._failures >= self._failure_threshold:
+            LOG.warning(
+                "Checkmate failed %d times in a row, opening the circuit",
+                self._failures,
+            )
+            metrics.increment("checkmate.circuit.opened")
+            self._open()
+
+        elif self.state == self.HALF_OPEN:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = monotonic()
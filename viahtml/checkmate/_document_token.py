@@ -0,0 +1,103 @@
+"""Short-lived proof that a document has recently passed Checkmate."""
+
+import hmac
+import re
+from hashlib import sha256
+from http.cookies import SimpleCookie
+from time import time
+
+from viahtml.checkmate._cache import VerdictCache
+
+
+class DocumentTokens:
+    """Sign and check tokens saying a document was allowed by Checkmate.
+
+    When we let a document through we give the browser a cookie holding a
+    signed token for that document's URL. Same-origin subresource requests
+    carry the document's URL in their `Referer`, so if they also carry a
+    valid token for it, we know the page they belong to was checked recently
+    and can skip checking every image, script and stylesheet in it.
+
+    Each document gets its own cookie so that tokens can't be swapped between
+    pages. The cookies are short-lived and never passed on to the sites we
+    proxy.
+    """
+
+    COOKIE_PREFIX = "via.verified."
+    """The prefix for the names of the cookies we keep tokens in."""
+
+    _COOKIE_PATTERN = re.compile(
+        r"(?:^|(?<=;))\s*" + re.escape(COOKIE_PREFIX) + r"[^=;]*=[^;]*(?:;|$)"
+    )
+
+    def __init__(self, secret, ttl):
+        """Create a new token signer and checker.
+
+        :param secret: The secret to sign tokens with
+        :param ttl: How many seconds tokens are valid for
+        """
+        self._secret = secret.encode("utf-8")
+        self._ttl = ttl
+
+    def make_cookie(self, url):
+        """Get a `Set-Cookie` header value with a token for a document.
+
+        :param url: The proxied URL of the document which was allowed
+        """
+        expires_at = int(time()) + self._ttl
+        token = f"{expires_at}.{self._sign(url, expires_at)}"
+
+        return (
+            f"{self._cookie_name(url)}={token}; Max-Age={self._ttl}; Path=/; "
+            "HttpOnly; SameSite=Lax"
+        )
+
+    def is_verified(self, url, cookie_header):
+        """Get whether a request carries a valid token for a document.
+
+        :param url: The proxied URL of the document
+        :param cookie_header: The `Cookie` header of the request
+        """
+        if not url or not cookie_header:
+            return False
+
+        cookies = SimpleCookie()
+        try:
+            cookies.load(cookie_header)
+        except Exception:  # pylint: disable=broad-except
+            # `SimpleCookie` can raise all sorts of things on junk input
+            return False
+
+        morsel = cookies.get(self._cookie_name(url))
+        if morsel is None:
+            return False
+
+        expires_at, _, signature = morsel.value.partition(".")
+        try:
+            expires_at = int(expires_at)
+        except ValueError:
+            return False
+
+        if expires_at <= time():
+            return False
+
+        return hmac.compare_digest(signature, self._sign(url, expires_at))
+
+    @classmethod
+    def strip(cls, cookie_header):
+        """Remove our tokens from a `Cookie` header.
+
+        :param cookie_header: The `Cookie` header value
+        :return: The header without any of our tokens
+        """
+        return cls._COOKIE_PATTERN.sub("", cookie_header).strip().rstrip(";")
+
+    def _cookie_name(self, url):
+        url = VerdictCache.normalize_url(url)
+        return self.COOKIE_PREFIX + sha256(url.encode("utf-8")).hexdigest()[:16]
+
+    def _sign(self, url, expires_at):
+        url = VerdictCache.normalize_url(url)
+        message = f"{url}\n{expires_at}".encode("utf-8")
+
+        return hmac.new(self._secret, message, sha256).hexdigest()
@@ -0,0 +1,118 @@
+"""A cache of Checkmate verdicts shared between all workers on a node."""
+
+import json
+import logging
+from hashlib import sha256
+from time import time
+
+from checkmatelib.client import BlockResponse
+
+from viahtml import metrics
+from viahtml.checkmate._cache import VerdictCache
+
+try:
+    import uwsgi
+except ImportError:
+    # We aren't running inside uWSGI (for example in the tests)
+    uwsgi = None
+
+LOG = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SharedVerdictCache:
+    """Remember what Checkmate said about a URL in a uWSGI cache area.
+
+    Unlike `VerdictCache` this is visible to every worker, and survives
+    workers being recycled, so it has a much better hit rate. It's a bit more
+    expensive to read, so put a `VerdictCache` in front of it.
+
+    This requires a cache to be configured in uWSGI with a matching name:
+
+        cache2 = name=checkmate,items=10000,blocksize=1024,purge_lru=1
+    """
+
+    def __init__(self, check_url, cache_name, allowed_ttl, blocked_ttl):
+        """Create a new cache.
+
+        :param check_url: The function to call to get verdicts we don't have
+        :param cache_name: The name of the uWSGI cache to store verdicts in
+        :param allowed_ttl: Seconds to remember that a URL is allowed for
+        :param blocked_ttl: Seconds to remember that a URL is blocked for
+        """
+        self._check_url = check_url
+        self._cache_name = cache_name
+        self._allowed_ttl = allowed_ttl
+        self._blocked_ttl = blocked_ttl
+
+    @staticmethod
+    def is_supported():
+        """Get whether we are running in uWSGI, so this cache can work."""
+        return uwsgi is not None
+
+    def __call__(self, url, allow_all=False, blocked_for=None):
+        """Check a URL, using a verdict from any worker if there is one.
+
+        :return: None if the URL is fine or a `BlockResponse` if there are
+           reasons to block the URL.
+        """
+        key = self._key(url, allow_all, blocked_for)
+
+        verdict = self._get(key)
+        if verdict is not _MISSING:
+            metrics.increment("checkmate_shared_cache.hits")
+            return verdict
+
+        metrics.increment("checkmate_shared_cache.misses")
+
+        verdict = self._check_url(url=url, allow_all=allow_all, blocked_for=blocked_for)
+
+        self._set(key, verdict, ttl=self._blocked_ttl if verdict else self._allowed_ttl)
+
+        return verdict
+
+    @staticmethod
+    def _key(url, allow_all, blocked_for):
+        # uWSGI limits the length of keys, and URLs can be very long
+        key = repr(VerdictCache.cache_key(url, allow_all, blocked_for))
+        return sha256(key.encode("utf-8")).hexdigest()
+
+    def _get(self, key):
+        value = uwsgi.cache_get(key, self._cache_name)
+        if not value:
+            return _MISSING
+
+        try:
+            entry = json.loads(value)
+        except ValueError:
+            LOG.warning("Ignoring unreadable Checkmate verdict in shared cache")
+            return _MISSING
+
+        # uWSGI only sweeps expired items every few seconds, so check it
+        # ourselves too
+        if entry["expires_at"] <= time():
+            return _MISSING
+
+        if entry["block"] is None:
+            return None
+
+        return BlockResponse(entry["block"])
+
+    def _set(self, key, verdict, ttl):
+        if ttl <= 0:
+            return
+
+        block = None
+        if verdict:
+            # Enough of the response for `BlockResponse` to re-create it
+            block = {
+                "data": [{"id": reason} for reason in verdict.reason_codes],
+                "links": {"html": verdict.presentation_url},
+            }
+
+        value = json.dumps({"expires_at": time() + ttl, "block": block})
+
+        # This fails if the item is bigger than the cache's block size, in
+        # which case we just don't cache it
+        uwsgi.cache_update(key, value.encode("utf-8"), ttl, self._cache_name)
@@ -0,0 +1,41 @@
+"""Checks on URLs which don't need Checkmate."""
+
+from ipaddress import ip_address
+
+from checkmatelib import BadURL, CheckmateClient
+from checkmatelib.url.canonicalize import CanonicalURL
+from checkmatelib.url.domain import Domain
+
+
+def check_public_url(url):
+    """Check a URL is one we could fetch, without asking Checkmate.
+
+    This is the check `CheckmateClient` makes before it calls Checkmate: the
+    URL has to parse and its domain has to look public, apart from a few
+    local domains for testing. We make it ourselves wherever we don't call
+    Checkmate, so those requests can't be used to fetch internal addresses.
+
+    As well as that, IP addresses have to be global ones, which rules out
+    link-local addresses like cloud metadata services.
+
+    :param url: The URL to check
+    :raises BadURL: If the URL is unparseable or not publicly accessible
+    """
+    parts = CanonicalURL.canonical_split(url[: CheckmateClient.MAX_URL_LENGTH])
+    domain = Domain(parts[1])
+
+    if domain in CheckmateClient.ALLOWED_PRIVATE_DOMAINS:
+        return
+
+    if not domain.is_public or not _is_global(str(domain)):
+        raise BadURL(f"The domain '{domain}' does not look publicly accessible")
+
+
+def _is_global(host):
+    try:
+        address = ip_address(host.strip("[]"))
+    except ValueError:
+        # It's a name rather than an address
+        return True
+
+    return address.is_global
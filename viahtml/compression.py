@@ -0,0 +1,189 @@
+"""Compress responses on their way out to the browser."""
+
+import zlib
+
+import brotli
+
+
+class _GzipCompressor:
+    """A gzip compressor with the same methods as `brotli.Compressor`."""
+
+    def __init__(self, level):
+        # 16 + the max window size is how we ask `zlib` for gzip format
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _CompressedBody:
+    """A WSGI response body which compresses another as it goes."""
+
+    def __init__(self, body, compressor):
+        self._body = body
+        self._compressor = compressor
+
+    def __iter__(self):
+        for chunk in self._body:
+            if not chunk:
+                continue
+
+            # Flush each chunk, so the browser gets what the rewriter has
+            # done so far (like the head insert) rather than waiting for the
+            # compressor to fill up
+            yield self._compressor.compress(chunk) + self._compressor.flush()
+
+        yield self._compressor.finish()
+
+    def close(self):
+        if hasattr(self._body, "close"):
+            self._body.close()
+
+
+class Compression:
+    """Compress text responses for browsers which accept it.
+
+    nginx passes our responses on as they are, and rewritten pages can be
+    several megabytes. Brotli is preferred where the browser accepts it, as
+    it does better than gzip for the same CPU time.
+
+    Responses are compressed as they stream, so we can't know how big they
+    are up front. Those with a `Content-Length` below `min_size` are left
+    alone, but rewritten pages don't have one, and are always compressed.
+    """
+
+    COMPRESSIBLE_TYPES = {
+        "application/javascript",
+        "application/json",
+        "application/xhtml+xml",
+        "application/xml",
+        "image/svg+xml",
+        "text/css",
+        "text/html",
+        "text/javascript",
+        "text/plain",
+        "text/xml",
+    }
+    """Content types worth compressing. Others are mostly compressed already."""
+
+    _UNCOMPRESSED_STATUSES = ("204", "206", "304")
+
+    def __init__(self, gzip_level=6, brotli_quality=4, min_size=1024):
+        """Create a compression stage.
+
+        :param gzip_level: The gzip level from 1 to 9 (0 to disable gzip)
+        :param brotli_quality: The Brotli quality from 1 to 11 (0 to disable
+            Brotli)
+        :param min_size: The smallest response to compress, in bytes
+        """
+        self._gzip_level = gzip_level
+        self._brotli_quality = brotli_quality
+        self._min_size = min_size
+
+        # Most preferred first
+        self._encodings = []
+        if brotli_quality:
+            self._encodings.append("br")
+        if gzip_level:
+            self._encodings.append("gzip")
+
+    def __call__(self, environ, start_response):
+        """Compress the response to a request if we can.
+
+        :param environ: WSGI environ dict
+        :param start_response: WSGI start_response function
+        :return: A tuple of a start_response function to use instead, and a
+            function to pass the response body through
+        """
+        encoding = None
+        # There's no body to compress in responses to HEAD requests
+        if environ.get("REQUEST_METHOD") != "HEAD":
+            encoding = self._negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        compressing = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            if encoding and self._should_compress(status, headers):
+                headers = [
+                    (name, value)
+                    for name, value in headers
+                    if name.lower() != "content-length"
+                ]
+                headers.append(("Content-Encoding", encoding))
+                headers.append(("Vary", "Accept-Encoding"))
+                compressing.append(encoding)
+
+            if exc_info:
+                return start_response(status, headers, exc_info)
+
+            return start_response(status, headers)
+
+        def compress(body):
+            if not compressing:
+                return body
+
+            return _CompressedBody(body, self._compressor(compressing[0]))
+
+        return compressing_start_response, compress
+
+    def _negotiate(self, accept_encoding):
+        """Pick the encoding to use from an `Accept-Encoding` header."""
+        if not accept_encoding:
+            return None
+
+        weights = {}
+        for item in accept_encoding.split(","):
+            coding, *params = item.split(";")
+
+            weight = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip() == "q":
+                    try:
+                        weight = float(value)
+                    except ValueError:
+                        weight = 0.0
+
+            weights[coding.strip().lower()] = weight
+
+        for encoding in self._encodings:
+            if weights.get(encoding, weights.get("*", 0)) > 0:
+                return encoding
+
+        return None
+
+    def _should_compress(self, status, headers):
+        if status[:3] in self._UNCOMPRESSED_STATUSES:
+            return False
+
+        content_type = None
+        for name, value in headers:
+            name = name.lower()
+
+            if name == "content-encoding":
+                return False
+
+            if (
+                name == "content-length"
+                and value.isdigit()
+                and int(value) < self._min_size
+            ):
+                return False
+
+            if name == "content-type":
+                content_type = value.split(";", 1)[0].strip().lower()
+
+        return content_type in self.COMPRESSIBLE_TYPES
+
+    def _compressor(self, encoding):
+        if encoding == "br":
+            return brotli.Compressor(
+                mode=brotli.MODE_TEXT, quality=self._brotli_quality
+            )
+
+        return _GzipCompressor(self._gzip_level)
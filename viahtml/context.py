@@ -2,28 +2,81 @@
 
 import json
 import re
-from functools import lru_cache
+from contextlib import contextmanager
 from http import HTTPStatus
+from time import perf_counter
 from urllib.parse import parse_qs, urljoin
 
 from h_vialib import Configuration
 from werkzeug import wsgi
 
 
-class Context:
-    """A request context object."""
+class _Lazy:
+    """A read-only property which is computed once per instance.
+
+    The value is kept in a slot named after the property with a leading
+    underscore, which the class must declare in its `__slots__`.
+    """
+
+    def __init__(self, method):
+        self._method = method
+        self._slot = None
+        self.__doc__ = method.__doc__
+
+    def __set_name__(self, owner, name):
+        self._slot = f"_{name}"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
 
-    debug = False
-    """Whether debug mode is enabled."""
+        try:
+            return getattr(instance, self._slot)
+        except AttributeError:
+            value = self._method(instance)
+            setattr(instance, self._slot, value)
+            return value
 
-    headers = None
-    """A list of tuples of headers to add to the request."""
+    def __set__(self, instance, value):
+        # Read-only, like a `property` without a setter
+        raise AttributeError(f"can't set attribute '{self._slot[1:]}'")
 
-    http_environ = None
-    """The WSGI http environ if you need it."""
 
-    start_response = None
-    """The start response function if you need it."""
+class Context:
+    """A request context object.
+
+    One of these is made for every request, so it uses `__slots__` and
+    computes its properties lazily, once each.
+
+    :ivar debug: Whether debug mode is enabled
+    :ivar http_environ: The WSGI http environ if you need it
+    :ivar start_response: The start response function if you need it
+    :ivar headers: A list of tuples of headers to add to the response
+    :ivar deferred: A list of functions to call just before a proxied
+        response starts. Each is called with no arguments and can return a
+        response of its own (made with `make_response()`) to send instead of
+        the proxied one.
+    :ivar timings: A dict of the names of parts of handling the request, to
+        the seconds spent on each
+    """
+
+    __slots__ = (
+        "debug",
+        "http_environ",
+        "start_response",
+        "headers",
+        "deferred",
+        "timings",
+        # Storage for the `_Lazy` properties below
+        "_path",
+        "_url",
+        "_query_params",
+        "_host",
+        "_proxied_url",
+        "_proxied_url_with_config",
+        "_proxied_referrer",
+        "_via_config",
+    )
 
     def __init__(self, debug, http_environ, start_response):
         """Initialize a new context object.
@@ -36,35 +89,32 @@ class Context:
         self.start_response = start_response
 
         self.headers = []
+        self.deferred = []
+        self.timings = {}
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def path(self):
         """Get the path in the app (without query parameters)."""
         return wsgi.get_path_info(self.http_environ)
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def url(self):
         """Get the full request URL made to the app (with query params)."""
 
         return wsgi.get_current_url(self.http_environ)
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def query_params(self):
         """Get all the query params present on the request."""
         return parse_qs(self.http_environ["QUERY_STRING"], keep_blank_values=True)
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def host(self):
         """Get our own hostname."""
 
         return wsgi.get_host(self.http_environ)
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def proxied_url(self):
         """Get the proxied URL without any Via parameters."""
         url = self.proxied_url_with_config
@@ -75,14 +125,34 @@ class Context:
 
     _PROXY_PATTERN = re.compile(r"^proxy/(?:[a-z]{2}_/)?")
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def proxied_url_with_config(self):
         """Get the proxied URL including any Via parameters."""
 
+        return self._proxy_url(self.url)
+
+    @_Lazy
+    def proxied_referrer(self):
+        """Get the proxied URL of the page which referred us here.
+
+        This is only present if the referrer is also a page proxied by us.
+        """
+        referrer = self.get_header("Referer")
+        if not referrer:
+            return None
+
+        url = self._proxy_url(referrer)
+        if not url:
+            return url
+
+        return Configuration.strip_from_url(url)
+
+    def _proxy_url(self, url):
         app_root = wsgi.get_current_url(self.http_environ, root_only=True)
+        if not url.startswith(app_root):
+            return None
 
-        url = self.url[len(app_root) :]
+        url = url[len(app_root) :]
         url = self._PROXY_PATTERN.sub("", url)
 
         # This is a root with query params, not something we can proxy
@@ -91,13 +161,36 @@ class Context:
 
         return url if url else None
 
-    @property
-    @lru_cache(1)
+    @_Lazy
     def via_config(self):
         """Return the parsed configuration from `via.*` query params."""
-        via_config, _ = Configuration.extract_from_wsgi_environment(self.http_environ)
+        via_config, _ = self.get_config(self.http_environ)
         return via_config
 
+    CONFIG_KEY = "viahtml.config"
+    """The WSGI environ key the parsed config is kept under."""
+
+    @classmethod
+    def get_config(cls, http_environ):
+        """Get the Via and client config from a WSGI environ.
+
+        The config is parsed once and kept in the environ, so every part of
+        the request which needs it (including `pywb` templates, which only
+        get the environ) shares the same copy. Don't modify it.
+
+        :param http_environ: WSGI environ dict
+        :return: A tuple of Via, and client config
+        """
+        query_string = http_environ.get("QUERY_STRING")
+
+        # Check the query is the same, in case the environ has been changed
+        cached_query_string, config = http_environ.get(cls.CONFIG_KEY, (None, None))
+        if config is None or cached_query_string != query_string:
+            config = Configuration.extract_from_wsgi_environment(http_environ)
+            http_environ[cls.CONFIG_KEY] = (query_string, config)
+
+        return config
+
     def make_response(self, http_status=HTTPStatus.OK, headers=None, lines=None):
         """Create a WSGI response.
 
@@ -138,6 +231,34 @@ class Context:
 
         self.headers.append((name, value))
 
+    @contextmanager
+    def timed(self, name):
+        """Time a block of code, as part of handling the request.
+
+        :param name: The name of the part, like `upstream`. The time spent in
+            blocks with the same name is added up.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, perf_counter() - start)
+
+    def add_timing(self, name, seconds):
+        """Add to the time spent on a part of handling the request.
+
+        :param name: The name of the part
+        :param seconds: The time spent on it
+        """
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    @property
+    def server_timing(self):
+        """Get a `Server-Timing` header value for the timings so far."""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items()
+        )
+
     def get_header(self, name):
         """Get a specific header by name.
 
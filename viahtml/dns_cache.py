@@ -0,0 +1,88 @@
+"""A cache of the addresses of the sites we proxy."""
+
+import socket
+
+from urllib3.util.connection import allowed_gai_family
+
+from viahtml import metrics
+from viahtml.cache import LRUCache
+
+
+class DNSCache:
+    """Remember the addresses of hosts for a while.
+
+    Proxied pages load their subresources from the same handful of CDN hosts
+    over and over, and every new connection to one would otherwise have to
+    look it up again first.
+
+    `getaddrinfo()` doesn't tell us the TTLs of the records it finds, so
+    addresses are kept for a fixed time which should be shorter than the TTL
+    of most records. Failed lookups are remembered for a shorter time, so a
+    page full of links to a dead host doesn't look it up for every one.
+    """
+
+    def __init__(self, max_size, ttl, negative_ttl):
+        """Create a new empty cache.
+
+        :param max_size: The maximum number of hosts to remember
+        :param ttl: Seconds to remember the addresses of a host for
+        :param negative_ttl: Seconds to remember that a host can't be found for
+        """
+        self._cache = LRUCache(max_size)
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+
+    def resolve(self, host, port):
+        """Get the addresses for a host, most preferred first.
+
+        :param host: The host name to look up
+        :param port: The port we'll connect to
+        :return: A list of IP addresses as strings
+        :raise socket.gaierror: If the host can't be found
+        """
+        key = (host, port)
+
+        addresses = self._cache.get(key)
+        if addresses is None:
+            metrics.increment("dns_cache.misses")
+            addresses = self._lookup(host, port)
+            self._cache.set(
+                key,
+                addresses,
+                ttl=(
+                    self._negative_ttl
+                    if isinstance(addresses, socket.gaierror)
+                    else self._ttl
+                ),
+            )
+        else:
+            metrics.increment("dns_cache.hits")
+
+        if isinstance(addresses, socket.gaierror):
+            # A new error each time, so tracebacks don't pile up on this one
+            raise socket.gaierror(*addresses.args)
+
+        return addresses
+
+    def forget(self, host, port):
+        """Forget the addresses of a host, like when we can't connect to it."""
+        self._cache.set((host, port), None, ttl=0)
+
+    @staticmethod
+    def _lookup(host, port):
+        try:
+            # This is the same lookup `urllib3` would do, and uses `gevent`'s
+            # resolver once it has monkey patched `socket`
+            results = socket.getaddrinfo(
+                host, port, allowed_gai_family(), socket.SOCK_STREAM
+            )
+        except socket.gaierror as err:
+            metrics.increment("dns_cache.failures")
+            return err
+
+        addresses = []
+        for _family, _type, _proto, _canonname, sockaddr in results:
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+
+        return addresses
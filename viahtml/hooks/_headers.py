@@ -1,5 +1,7 @@
 """Specific configuration for headers."""
 
+from itertools import chain
+
 
 class Headers:
     """Methods for manipulating the headers we accept and emit."""
@@ -41,14 +43,97 @@ class Headers:
         "Vary",  # No point in having vary headers without caching
     } | BLOCKED
 
-    def __init__(self):
+    ADDED_INBOUND = (
+        ("X-Abuse-Policy", "https://web.hypothes.is/abuse-policy/"),
+        ("X-Complaints-To", "https://web.hypothes.is/report-abuse/"),
+    )
+    """Headers we add to every request."""
+
+    ADDED_OUTBOUND = (
+        # Disable caching in general to avoid cache poisoning
+        ("Cache-Control", "no-store"),
+        # Add our own Referrer-Policy telling browsers to send us Referer
+        # headers.
+        #
+        # We need the Referer header because we use it to authenticate
+        # requests (see authentication.py).
+        #
+        # This isn't strictly necessary because we block third-party
+        # Referrer-Policy headers in BLOCKED_OUTBOUND above and browsers
+        # default referrer policies *do* send the Referer header.
+        #
+        # But just for good measure (e.g. if some browser settings,
+        # extensions, or future browser versions change to *not* sending
+        # Referer by default) we inject a header to explicitly ask for Referer.
+        ("Referrer-Policy", "no-referrer-when-downgrade"),
+        # Tell Google and other search engines not to index third-party pages
+        # proxied by Via HTML and not to follow links on those pages.
+        ("X-Robots-Tag", "noindex, nofollow"),
+        ("X-Abuse-Policy", "https://web.hypothes.is/abuse-policy/"),
+        ("X-Complaints-To", "https://web.hypothes.is/report-abuse/"),
+    )
+    """Headers we add to every response."""
+
+    MAX_KNOWN_OUTBOUND = 1024
+    """The most outbound header names to remember the fate of."""
+
+    def __init__(self, inbound_rules=None):
+        """Create a header policy.
+
+        Rules for inbound headers are applied after our own, in this order,
+        whatever order they are given in:
+
+        * `block <Header-Name>` removes a header
+        * `rename <Header-Name> <New-Header-Name>` renames one
+        * `inject <Header-Name> <value>` adds one, replacing any already there
+
+        :param inbound_rules: A list of extra rules for inbound headers
+        :raise ValueError: If any of the rules can't be understood
+        """
+        blocked, renamed, added = self._parse_inbound_rules(inbound_rules or [])
+
+        # Everything here is worked out now, rather than for every request.
         # Headers in the HTTP environ are stored upper case with 'HTTP_' prefix
-        self._bad_inbound_environ = {
-            self.environ_name(header_name) for header_name in self.BLOCKED_INBOUND
-        }
+        self._bad_inbound_environ = tuple(
+            {self.environ_name(header_name) for header_name in blocked}
+        )
+        self._renamed_inbound_environ = tuple(
+            (self.environ_name(old_name), self.environ_name(new_name))
+            for old_name, new_name in renamed
+        )
+        self._added_inbound_environ = tuple(
+            (self.environ_name(header_name), value) for header_name, value in added
+        )
 
         # Convert to lower case for case-insensitive matching
-        self._bad_outbound_lower = {header.lower() for header in self.BLOCKED_OUTBOUND}
+        self._bad_outbound_lower = frozenset(
+            header.lower() for header in self.BLOCKED_OUTBOUND
+        )
+
+        # Header names to whether we keep them. Sites and `pywb` send the same
+        # few dozen over and over, so this saves lower casing and checking
+        # each one on every response.
+        self._keep_outbound = {}
+
+    @classmethod
+    def _parse_inbound_rules(cls, rules):
+        blocked = set(cls.BLOCKED_INBOUND)
+        renamed = []
+        added = list(cls.ADDED_INBOUND)
+
+        for rule in rules:
+            action, *args = rule.split(None, 2)
+
+            if action == "block" and len(args) == 1:
+                blocked.add(args[0])
+            elif action == "rename" and len(args) == 2:
+                renamed.append(tuple(args))
+            elif action == "inject" and len(args) == 2:
+                added.append(tuple(args))
+            else:
+                raise ValueError(f"Cannot understand inbound header rule: {rule!r}")
+
+        return blocked, renamed, added
 
     @classmethod
     def environ_name(cls, header_name):
@@ -62,64 +147,62 @@ class Headers:
     def modify_inbound(self, http_env):
         """Modify the headers received by the app.
 
-        This will discard headers we do not want the app to receive.
+        This will discard headers we do not want the app to receive, add our
+        own and apply any other rules we were given.
 
         :param http_env: WSGI environ dict
         :return: A modified dict
         """
-        bad_keys = set(http_env.keys()) & self._bad_inbound_environ
+        # There are dozens of keys in the environ but only a few to look for,
+        # so look for each of them
+        for bad_key in self._bad_inbound_environ:
+            http_env.pop(bad_key, None)
 
-        for bad_key in bad_keys:
-            http_env.pop(bad_key)
+        for old_key, new_key in self._renamed_inbound_environ:
+            if old_key in http_env:
+                http_env[new_key] = http_env.pop(old_key)
 
-        http_env["HTTP_X_ABUSE_POLICY"] = "https://web.hypothes.is/abuse-policy/"
-        http_env["HTTP_X_COMPLAINTS_TO"] = "https://web.hypothes.is/report-abuse/"
+        http_env.update(self._added_inbound_environ)
 
         return http_env
 
-    def modify_outbound(self, header_items):
+    def modify_outbound(self, header_items, extra_headers=()):
         """Modify the headers emitted by the app.
 
         This will remove headers we do not want to emit.
 
         :param header_items: Header key-value pairs
+        :param extra_headers: More header key-value pairs to add, like those
+            our views have added
         :return: Modified key-value pairs
         """
+        keep_outbound = self._keep_outbound
         headers = []
 
-        for header, value in header_items:
-            header_lower = header.lower()
+        for item in chain(header_items, extra_headers):
+            keep = keep_outbound.get(item[0])
+            if keep is None:
+                keep = self._keep_outbound_header(item[0])
 
-            if (
-                # Skip any of the many, many headers `pywb` emits
-                not header_lower.startswith("x-archive-")
-                # Or anything we've blocked explicitly
-                and header_lower not in self._bad_outbound_lower
-            ):
-                headers.append((header, value))
+            if keep:
+                headers.append(item)
 
-        # Disable caching in general to avoid cache poisoning
-        headers.append(("Cache-Control", "no-store"))
+        headers.extend(self.ADDED_OUTBOUND)
 
-        # Add our own Referrer-Policy telling browsers to send us Referer headers.
-        #
-        # We need the Referer header because we use it to authenticate requests
-        # (see authentication.py).
-        #
-        # This isn't strictly necessary because we block third-party
-        # Referrer-Policy headers in BLOCKED_OUTBOUND above and browsers
-        # default referrer policies *do* send the Referer header.
-        #
-        # But just for good measure (e.g. if some browser settings, extensions,
-        # or future browser versions change to *not* sending Referer by
-        # default) we inject a header to explicitly ask for Referer.
-        headers.append(("Referrer-Policy", "no-referrer-when-downgrade"))
+        return headers
 
-        # Tell Google and other search engines not to index third-party pages
-        # proxied by Via HTML and not to follow links on those pages.
-        headers.append(("X-Robots-Tag", "noindex, nofollow"))
+    def _keep_outbound_header(self, header):
+        header_lower = header.lower()
 
-        headers.append(("X-Abuse-Policy", "https://web.hypothes.is/abuse-policy/"))
-        headers.append(("X-Complaints-To", "https://web.hypothes.is/report-abuse/"))
+        keep = (
+            # Skip any of the many, many headers `pywb` emits
+            not header_lower.startswith("x-archive-")
+            # Or anything we've blocked explicitly
+            and header_lower not in self._bad_outbound_lower
+        )
 
-        return headers
+        # Don't let sites sending made up header names fill up our memory
+        if len(self._keep_outbound) < self.MAX_KNOWN_OUTBOUND:
+            self._keep_outbound[header] = keep
+
+        return keep
@@ -1,9 +1,14 @@
 """The majority of configuration options."""
 
+from contextlib import nullcontext
+from contextvars import ContextVar
+
 from h_vialib import Configuration
+from jinja2.utils import htmlsafe_json_dumps
 
 from viahtml.context import Context
 from viahtml.hooks._headers import Headers
+from viahtml.static_manifest import StaticManifest
 
 # Prefixes of media player embeds (iframes) that we want to avoid proxying or
 # blocking.
@@ -31,18 +36,50 @@ class Hooks:
     """A collection of configuration points for `pywb`."""
 
     headers = Headers()
+    """The header policy, unless the config has rules of its own."""
 
     def __init__(self, config):
         self.config = config
-        self.context = None
+
+        if config.get("inbound_header_rules"):
+            self.headers = Headers(inbound_rules=config["inbound_header_rules"])
+
+        # Many requests are handled at once, each in its own greenlet, and
+        # each greenlet gets its own value for this
+        self._context = ContextVar(f"viahtml_context_{id(self)}", default=None)
+        # What `modify_tag_attrs()` does depends on the request, so it's
+        # worked out once for each one
+        self._stop_tags_for_context = ContextVar(
+            f"viahtml_stop_tags_{id(self)}", default=None
+        )
+
+    @property
+    def context(self):
+        """Get the context of the request being handled right now."""
+
+        return self._context.get()
 
     def set_context(self, context: Context):
         """Set the current request context.
 
-        This must be called before the `modify_*` hooks are invoked.
+        This must be called before the `modify_*` hooks are invoked. It only
+        applies to the current greenlet, so concurrent requests don't see
+        each other's context.
+        """
+
+        self._context.set(context)
+        self._stop_tags_for_context.set(None)
+
+    def timed(self, name):
+        """Time a block of code as part of the current request, if there is one.
+
+        See `Context.timed()`.
         """
+        context = self.context
+        if context is None:
+            return nullcontext()
 
-        self.context = context
+        return context.timed(name)
 
     @property
     def template_vars(self):
@@ -50,6 +87,8 @@ class Hooks:
 
         This is called when the Jinja2 environment is configured, and thus
         the request context (`self.context`) is not expected to be available.
+        Anything which is the same for every request is worked out here, once,
+        rather than in the templates.
         """
 
         def external_link_mode(http_env):
@@ -57,11 +96,13 @@ class Hooks:
             return via_config.get("external_link_mode", "same-tab").lower()
 
         return {
-            # It would be much nicer to calculate this once somehow
             "client_params": lambda http_env: self.get_config(http_env)[1],
             "external_link_mode": external_link_mode,
             "ignore_prefixes": self.ignore_prefixes,
+            # What the `tojson` filter would give, so it's safe in a `<script>`
+            "ignore_prefixes_json": htmlsafe_json_dumps(self.ignore_prefixes),
             "h_embed_url": self.config["h_embed_url"],
+            "static_file": StaticManifest.load(self.config.get("static_manifest")),
         }
 
     @property
@@ -70,11 +111,24 @@ class Hooks:
 
         return self.config["ignore_prefixes"] + MEDIA_EMBED_PREFIXES
 
+    @property
+    def head_flush_size(self):
+        """Get how much of a page to read before sending the head insert.
+
+        The head insert loads our client, so the sooner the browser has it
+        the better. Zero leaves `pywb` to send pages as it normally would.
+        """
+
+        return self.config.get("head_flush_size", 0)
+
     @classmethod
     def get_config(cls, http_env):
-        """Return the h-client parameters from a WSGI environment."""
+        """Return the Via and h-client parameters from a WSGI environment.
+
+        This is parsed once per request, see `Context.get_config()`.
+        """
 
-        return Configuration.extract_from_wsgi_environment(http_env)
+        return Context.get_config(http_env)
 
     _REDIRECTS = ("301", "302", "303", "305", "307", "308")
 
@@ -107,11 +161,30 @@ class Hooks:
 
                 response.status_headers.replace_header("Location", location)
 
+        if self.head_flush_size and (
+            response.status_headers.get_header("Content-Type") or ""
+        ).startswith("text/html"):
+            # Have nginx pass on each chunk of the page as we send it, rather
+            # than buffering it
+            response.status_headers.add_header("X-Accel-Buffering", "no")
+
         return response
 
+    # Tags `modify_tag_attrs()` may stop `pywb` rewriting, or which have
+    # attributes of their own to rewrite
+    _SPECIAL_TAGS = frozenset(("a", "link", "iframe", "img"))
+
+    # Attributes we rewrite on any tag, and on `<a>` tags
+    _REWRITE_ATTRS = frozenset(("referrerpolicy",))
+    _A_REWRITE_ATTRS = frozenset(("referrerpolicy", "href"))
+
     def modify_tag_attrs(self, tag, attrs):
         """Modify tag attributes or let `pywb` default behavior take over.
 
+        This is called for every tag in every HTML document we proxy, so
+        it's written to do as little as possible for the vast majority of
+        tags we don't change. In that case the original `attrs` are returned.
+
         :param tag: Tag being rewritten
         :param attrs: List of tuples of key, value attributes
         :return: Tuple of (attrs, stop) where stop disables default `pywb`
@@ -121,57 +194,78 @@ class Hooks:
         assert self.context
 
         stop = False
+        rewrite_attrs = self._REWRITE_ATTRS
+
+        if tag in self._SPECIAL_TAGS:
+            stop = tag in self._stop_tags()
+
+            if tag == "a":
+                rewrite_attrs = self._A_REWRITE_ATTRS
+
+            # Prevent `pywb` rewriting canonical URLs, as the client + h use
+            # them for document equivalence. We want these to appear the same
+            # as they would if the client visited the URL directly.
+            elif tag == "link":
+                stop = ("rel", "canonical") in attrs
+
+            # Allow individual iframes to disable proxying via an attribute.
+            elif tag == "iframe" and not stop:
+                stop = ("data-viahtml-no-proxy", None) in attrs
+
+        for key, _ in attrs:
+            if key in rewrite_attrs:
+                break
+        else:
+            # Nothing to rewrite, which is by far the most common case
+            return attrs, stop
+
+        return [
+            (key, self._rewrite_attr(key, value) if key in rewrite_attrs else value)
+            for key, value in attrs
+        ], stop
 
-        # Replace any referrerpolicy attr values with "no-referrer-when-downgrade".
+    def _rewrite_attr(self, key, value):
+        # Replace any referrerpolicy attr values with
+        # "no-referrer-when-downgrade".
         #
         # This is to prevent sites from telling browsers not to send the
         # Referer header. We need the Referer header because we use it to
         # authenticate requests (see authentication.py).
-        rewrites = {"referrerpolicy": lambda value: "no-referrer-when-downgrade"}
+        if key == "referrerpolicy":
+            return "no-referrer-when-downgrade"
 
-        # Disable pywb's from rewriting the href URLs of <a> tags.
+        # Rewrite the href URLs of <a> tags to be absolute, but not proxied.
         #
         # We don't want users to stay within Via when clicking on a link,
         # we want clicking a link to take users to the target site directly
         # (not proxied by Via).
-        if tag == "a":
-            context = self.context
-            rewrites["href"] = lambda value: context.make_absolute(
-                value, proxy=False, rewrite_fragments=False
-            )
-            stop = True
-
-        # Prevent `pywb` rewriting canonical URLs, as the client + h use them
-        # for document equivalence. We want these to appear the same as they
-        # would if the client visited the URL directly.
-        if tag == "link" and ("rel", "canonical") in attrs:
-            stop = True
-
-        if tag == "iframe":
-            # Allow individual iframes to disable proxying via an attribute.
-            if ("data-viahtml-no-proxy", None) in attrs:
-                stop = True
-
-            # Disable proxying for all frames if `via.proxy_frames` query param was set.
-            #
-            # Iframe proxying defaults to true for backwards compatibility.
-            if not query_param_as_bool(
-                self.context.via_config.get("proxy_frames", True)
-            ):
-                stop = True
-
-        if tag == "img":
-            if not query_param_as_bool(
-                self.context.via_config.get("proxy_images", True)
-            ):
-                stop = True
-
-        attrs = [
-            (key, rewrites[key](value) if key in rewrites else value)
-            for key, value in attrs
-        ]
+        return self.context.make_absolute(value, proxy=False, rewrite_fragments=False)
+
+    def _stop_tags(self):
+        """Get the tags we always stop `pywb` rewriting for this request."""
+
+        stop_tags = self._stop_tags_for_context.get()
+        if stop_tags is not None:
+            return stop_tags
+
+        via_config = self.context.via_config
+
+        # Disable pywb rewriting the href URLs of <a> tags, as we do it
+        tags = {"a"}
+
+        # Disable proxying for all frames if `via.proxy_frames` query param
+        # was set. Iframe proxying defaults to true for backwards
+        # compatibility.
+        if not query_param_as_bool(via_config.get("proxy_frames", True)):
+            tags.add("iframe")
+
+        if not query_param_as_bool(via_config.get("proxy_images", True)):
+            tags.add("img")
+
+        stop_tags = frozenset(tags)
+        self._stop_tags_for_context.set(stop_tags)
 
-        return attrs, stop
+        return stop_tags
 
     @classmethod
     def get_upstream_url(cls, doc_url):
@@ -0,0 +1,58 @@
+"""Counters shared between all workers and reported by `bin/report_metrics.py`.
+
+These are stored as uWSGI metrics, which appear in uWSGI's stats output.
+Each metric has to be declared in the uWSGI config like this:
+
+    metric = name=checkmate.circuit.opened,type=counter
+
+Changing a metric which isn't declared, or doing so outside of uWSGI (for
+example in the tests), does nothing.
+"""
+
+from bisect import bisect_left
+
+try:
+    import uwsgi
+except ImportError:
+    # We aren't running inside uWSGI
+    uwsgi = None
+
+
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+"""The upper bounds of the buckets of duration histograms, in milliseconds."""
+
+_BUCKET_SUFFIXES = tuple(f".le_{bound}" for bound in HISTOGRAM_BUCKETS) + (".le_inf",)
+
+
+def increment(name, value=1):
+    """Increment a uWSGI metric.
+
+    :param name: The name of the metric
+    :param value: The amount to increment it by
+    """
+    if uwsgi is not None:
+        uwsgi.metric_inc(name, value)
+
+
+def observe(name, seconds):
+    """Add a duration to a uWSGI histogram.
+
+    A histogram is a counter for each of `HISTOGRAM_BUCKETS`, like
+    `name.le_50` for durations over 20ms and up to 50ms, `name.le_inf` for
+    anything longer, and `name.sum_us` for the total in microseconds. Each
+    has to be declared, which a uWSGI `for` loop can do:
+
+        for = 1 2 5 10 20 50 100 200 500 1000 2000 5000 10000 20000 inf
+        metric = name=timing.upstream.le_%(_),type=counter
+        endfor =
+        metric = name=timing.upstream.sum_us,type=counter
+
+    :param name: The name of the histogram
+    :param seconds: The duration to add
+    """
+    if uwsgi is None:
+        return
+
+    bucket = bisect_left(HISTOGRAM_BUCKETS, seconds * 1000)
+    uwsgi.metric_inc(name + _BUCKET_SUFFIXES[bucket])
+    uwsgi.metric_inc(name + ".sum_us", int(seconds * 1_000_000))
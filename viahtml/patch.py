@@ -1,24 +1,41 @@
 """Tools to apply the hooks to a running `pywb` app."""
 
+from functools import partial, wraps
 from typing import Optional
 
+from pywb.apps import rewriterapp
 from pywb.apps.rewriterapp import RewriterApp
+from pywb.rewrite import content_rewriter
 from pywb.rewrite.default_rewriter import DefaultRewriter
 from pywb.rewrite.html_rewriter import HTMLRewriter
 from pywb.rewrite.url_rewriter import UrlRewriter
+from pywb.warcserver.resource import responseloader
+from warcio import recordloader
 
+from viahtml import metrics
 from viahtml.hooks import Hooks
-
-
-def apply_post_app_hooks(rewriter_app, hooks: Hooks):
+from viahtml.render_cache import RenderCache
+from viahtml.streaming import (
+    ArrivalReader,
+    EagerBufferedReader,
+    EagerChunkedDataReader,
+    stream_iter,
+)
+
+
+def apply_post_app_hooks(
+    rewriter_app, hooks: Hooks, render_cache: Optional[RenderCache] = None
+):
     """Apply hooks after the app has been instantiated."""
-    _PatchedRewriterApp.patch(rewriter_app, hooks)
+    _PatchedRewriterApp.patch(rewriter_app, hooks, render_cache)
 
 
 def apply_pre_app_hooks(hooks: Hooks):
     """Apply hooks before the app has been instantiated."""
 
     _patch_url_rewriter(hooks)
+    _patch_stream_iter(hooks)
+    _patch_buffered_readers(hooks)
     _PatchedHTMLRewriter.patch(hooks)
 
 
@@ -29,6 +46,49 @@ def _patch_url_rewriter(hooks: Hooks):
     UrlRewriter.NO_REWRITE_URI_PREFIX = tuple(prefixes)
 
 
+def _patch_stream_iter(hooks: Hooks):
+    # Bodies which aren't rewritten (images, fonts, video...) are streamed
+    # with `StreamIter` by the live `warcserver`, and again by the rewriter
+    # after it decides from the content type not to rewrite them
+    content_rewriter.StreamIter = stream_iter
+
+    # Everything passes through the `warcserver`, so it has to send the
+    # start of pages on quickly for the rewriter to get the head insert out
+    responseloader.StreamIter = partial(
+        stream_iter, first_size=hooks.head_flush_size or None
+    )
+
+
+def _patch_buffered_readers(hooks: Hooks):
+    if not hooks.head_flush_size:
+        return
+
+    # The rewriter can only send the head insert once it has read the start
+    # of the page, but every layer it reads through waits for 16KB first.
+    #
+    # This swaps the readers for everything these modules read, not just
+    # pages. That's only ever live responses: our one collection is `$live`
+    # (see `pywb_config.yaml`) so we never read records from WARC files. The
+    # readers only differ for the first `eager_size` bytes of each stream,
+    # where `read()` can return fewer bytes than asked for, like any file.
+    EagerBufferedReader.eager_size = hooks.head_flush_size
+    rewriterapp.BufferedReader = EagerBufferedReader
+    content_rewriter.BufferedReader = EagerBufferedReader
+    recordloader.BufferedReader = EagerBufferedReader
+    recordloader.ChunkedDataReader = EagerChunkedDataReader
+
+
+def _timed(hooks, name, function):
+    """Wrap a function to time it as part of the current request."""
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        with hooks.timed(name):
+            return function(*args, **kwargs)
+
+    return timed
+
+
 class _PatchedHTMLRewriter(HTMLRewriter):
     hooks: Optional[Hooks] = None
 
@@ -39,6 +99,17 @@ class _PatchedHTMLRewriter(HTMLRewriter):
         cls.hooks = hooks
         DefaultRewriter.DEFAULT_REWRITERS["html"] = _PatchedHTMLRewriter
 
+    def rewrite(self, string):
+        # This is decoded text, so it's characters rather than bytes
+        metrics.increment("rewrite.characters", len(string))
+
+        with self.hooks.timed("rewrite"):
+            return super().rewrite(string)
+
+    def final_read(self):
+        with self.hooks.timed("rewrite"):
+            return super().final_read()
+
     def _rewrite_link_href(self, attr_value, tag_attrs, rw_mod):
         # Prevent `pywb` from attempting to insert Javascript style rewriting
         # stuff into "<link rel='manifest'>" items. This fixes a bug with
@@ -79,26 +150,78 @@ class _PatchedHTMLRewriter(HTMLRewriter):
 
 class _PatchedRewriterApp(RewriterApp):
     hooks: Optional[Hooks] = None
+    render_cache: Optional[RenderCache] = None
 
     @classmethod
-    def patch(cls, rewriter, hooks: Hooks):
+    def patch(cls, rewriter, hooks: Hooks, render_cache=None):
         """Patch the rewriter object."""
 
         # Change the class of the rewriter to be this class, forcibly casting
         # it to be an instance of this class
         rewriter.__class__ = cls
         rewriter.hooks = hooks
+        rewriter.render_cache = render_cache
 
         # Update the Jinja environment to have the vars we want
         rewriter.jinja_env.jinja_env.globals.update(hooks.template_vars)
 
-    def render_content(self, wb_url, kwargs, environ):  # pragma: no cover
+        cls._precompile_templates(rewriter)
+        cls._time_templates(rewriter, hooks)
+
+    @staticmethod
+    def _precompile_templates(rewriter):
+        """Compile the templates rendered for every page, once, up front.
+
+        Templates are read once when we start, so restart to see any changes.
+        """
+        jinja_env = rewriter.jinja_env.jinja_env
+
+        # Otherwise Jinja checks whether the file has changed on every render
+        jinja_env.auto_reload = False
+
+        head_insert_view = rewriter.head_insert_view
+        for view in (head_insert_view, head_insert_view.banner_view):
+            if view:
+                template = jinja_env.get_template(view.insert_file)
+                # Globals are a `ChainMap` over the environment's, which Jinja
+                # copies into a new `dict` on every render. They're all set by
+                # now, so we can copy them once instead
+                template.globals = dict(template.globals)
+
+    @staticmethod
+    def _time_templates(rewriter, hooks):
+        head_insert_view = rewriter.head_insert_view
+        for view in (head_insert_view, head_insert_view.banner_view):
+            if view:
+                view.render_to_string = _timed(hooks, "template", view.render_to_string)
+
+    def render_content(self, wb_url, kwargs, environ):
+        if self.render_cache:
+            return self.render_cache(
+                partial(self._render_content, wb_url, kwargs), environ
+            )
+
+        return self._render_content(wb_url, kwargs, environ)
+
+    def _render_content(self, wb_url, kwargs, environ):
         response = super().render_content(wb_url, kwargs, environ)
 
         response = self.hooks.modify_render_response(response)
 
         return response
 
+    def _do_req(self, inputreq, wb_url, kwargs, skip_record):
+        # Fetching the page from the site, up to the start of the body
+        with self.hooks.timed("upstream"):
+            response = super()._do_req(inputreq, wb_url, kwargs, skip_record)
+
+        if self.hooks.head_flush_size:
+            # `pywb` reads the `warcserver` response 16KB at a time, waiting
+            # for each block to fill before parsing or rewriting any of it
+            response.raw = ArrivalReader(response.raw)
+
+        return response
+
     def get_upstream_url(self, wb_url, kwargs, params):  # pragma: no cover
         params["url"] = self.hooks.get_upstream_url(doc_url=params["url"])
 
@@ -0,0 +1,418 @@
+"""A cache of proxied HTML pages after `pywb` has rewritten them."""
+
+from functools import partial
+from time import monotonic
+from typing import NamedTuple
+from urllib.parse import parse_qsl
+
+from gevent.event import Event
+from gevent.lock import Semaphore
+from pywb.apps.wbrequestresponse import WbResponse
+from warcio.statusandheaders import StatusAndHeaders
+
+from viahtml import metrics
+from viahtml.cache import LRUCache
+
+
+class _Page(NamedTuple):
+    status_headers: StatusAndHeaders
+    body: bytes
+    etag: str
+    fresh_until: float
+
+
+def _close(body):
+    if hasattr(body, "close"):
+        body.close()
+
+
+class _SharedBody:  # pylint:disable=too-many-instance-attributes
+    """A response body which several requests can read, keeping a copy.
+
+    Whichever reader gets to the end of what has been read so far reads the
+    next chunk for everyone, so readers only wait for each other while a
+    chunk is being read. Readers can join until the body gets bigger than we
+    would keep a copy of.
+    """
+
+    def __init__(self, body, max_size, on_read, on_done):
+        """Wrap a response body.
+
+        :param body: The response body to read
+        :param max_size: The most bytes to keep a copy of
+        :param on_read: Called with the whole body once it has been read, if
+            it's no bigger than `max_size`
+        :param on_done: Called once no more readers can join, because the
+            body has been read, closed, failed or got too big
+        """
+        self._body = body
+        self._chunks = iter(body)
+        self._max_size = max_size
+        self._on_read = on_read
+        self._on_done = on_done
+
+        # What has been read so far, with `_start` the position of the first
+        # chunk we still have
+        self._read = []
+        self._start = 0
+        self._size = 0
+
+        self._readers = set()
+        self._reading = Semaphore()
+        self._joinable = True
+        self._finished = False
+        self._closed = False
+        self._failed = False
+
+    def reader(self):
+        """Get a reader for the body from the start.
+
+        :return: An iterable body, or None if it's too late to join
+        """
+        if not self._joinable:
+            return None
+
+        reader = _Reader(self)
+        self._readers.add(reader)
+        return reader
+
+    def read(self, reader):
+        """Get the chunks of the body for a reader."""
+        while True:
+            chunk = self._chunk(reader.position)
+            if chunk is None:
+                break
+
+            reader.position += 1
+            self._forget_read_chunks()
+            yield chunk
+
+        self.leave(reader)
+
+    def leave(self, reader):
+        """Stop reading, closing the body once nobody is reading it."""
+        self._readers.discard(reader)
+
+        if not self._readers and not self._closed:
+            self._closed = True
+            _close(self._body)
+            self._done()
+
+    def _chunk(self, position):
+        while position >= self._start + len(self._read):
+            if self._failed:
+                raise IOError("The response this was sharing failed")
+
+            with self._reading:
+                # Someone else might have read it while we were waiting
+                if position >= self._start + len(self._read):
+                    if not self._read_chunk():
+                        return None
+
+        return self._read[position - self._start]
+
+    def _read_chunk(self):
+        if self._finished or self._closed:
+            return False
+
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._finished = True
+            if self._size <= self._max_size:
+                self._on_read(b"".join(self._read))
+            self._done()
+            return False
+        except BaseException:
+            self._failed = True
+            self._done()
+            raise
+
+        self._read.append(chunk)
+        self._size += len(chunk)
+        if self._size > self._max_size:
+            # It won't be stored, so there's no point anyone waiting for it
+            self._done()
+
+        return True
+
+    def _forget_read_chunks(self):
+        if self._joinable:
+            # We need them all for anyone joining, or to store the page
+            return
+
+        position = min(
+            (reader.position for reader in self._readers),
+            default=self._start + len(self._read),
+        )
+        del self._read[: position - self._start]
+        self._start = position
+
+    def _done(self):
+        if self._joinable:
+            self._joinable = False
+            self._on_done()
+
+
+class _Reader:
+    """One request's response body, reading from a `_SharedBody`."""
+
+    def __init__(self, shared):
+        self._shared = shared
+        self.position = 0
+
+    def __iter__(self):
+        return self._shared.read(self)
+
+    def close(self):
+        """Stop reading the body, for WSGI servers."""
+        self._shared.leave(self)
+
+
+class _Fetching:
+    """A page being fetched, which other requests for it can share."""
+
+    def __init__(self):
+        # Set once the response has started, or we know it can't be shared
+        self.started = Event()
+        self.status_headers = None
+        self.body = None
+        self.done = None
+
+    def share(self):
+        """Get a response reading along with the fetch, if we still can.
+
+        :return: A `WbResponse`, or None if the response can't be shared
+        """
+        if self.body is None:
+            return None
+
+        reader = self.body.reader()
+        if reader is None:
+            return None
+
+        return WbResponse(_copy(self.status_headers), reader)
+
+
+def _copy(status_headers):
+    return StatusAndHeaders(
+        status_headers.statusline,
+        list(status_headers.headers),
+        status_headers.protocol,
+    )
+
+
+class RenderCache:
+    """Keep rewritten HTML pages, so popular pages are only rewritten once.
+
+    A page is served from the cache without asking its site for `fresh_ttl`
+    seconds. After that, if the site gave it an `ETag`, we send that with
+    the next request for the page and only rewrite it again if it changed.
+    Pages are kept for revalidation like this for up to `stale_ttl` seconds.
+
+    Only anonymous `GET` requests for HTML pages which the site doesn't mark
+    as private are cached, and pages vary by everything about the request
+    which can change what `pywb` renders. This sits behind all of our views
+    and before our own headers are added, so responses look exactly the same
+    to the browser whether they come from the cache or not.
+
+    When lots of requests for a page arrive at once (like when a teacher
+    shares a link with a class) only the first fetches and rewrites it. The
+    rest wait for its response to start, and are sent the page as it's read.
+    """
+
+    # Requests with these can get a personal or partial response from the
+    # site, or a different rendering from `pywb`
+    UNCACHEABLE_REQUEST_HEADERS = (
+        "HTTP_AUTHORIZATION",
+        "HTTP_COOKIE",
+        "HTTP_IF_NONE_MATCH",
+        "HTTP_RANGE",
+        "HTTP_ACCEPT_DATETIME",
+        "HTTP_X_REQUESTED_WITH",
+        "HTTP_X_PYWB_REQUESTED_WITH",
+        "HTTP_X_WOMBAT_HISTORY_PAGE",
+    )
+
+    # Request headers sites commonly serve different pages for
+    VARY_REQUEST_HEADERS = ("HTTP_USER_AGENT", "HTTP_ACCEPT_LANGUAGE")
+
+    # `pywb` keeps the site's headers with this prefix
+    ORIGINAL_HEADER_PREFIX = "X-Archive-Orig-"
+
+    UNCACHEABLE_DIRECTIVES = ("no-store", "no-cache", "private")
+
+    WAIT_TIMEOUT = 10
+    """Seconds to wait for a response to start for another request."""
+
+    def __init__(self, max_size, fresh_ttl, stale_ttl):
+        """Create a new empty cache.
+
+        :param max_size: The total number of bytes of pages to keep. Pages
+            bigger than an eighth of this aren't cached.
+        :param fresh_ttl: Seconds to serve a page for without asking the site
+        :param stale_ttl: Seconds to keep pages with an `ETag` for
+        """
+        self._cache = LRUCache(max_size, size_of=lambda page: len(page.body))
+        self._max_page_size = max_size // 8
+        self._fresh_ttl = fresh_ttl
+        self._stale_ttl = max(stale_ttl, fresh_ttl)
+
+        # Pages being fetched right now, which other requests can share
+        self._fetching = {}
+
+    def __call__(self, render, environ):
+        """Render a page, or get it from the cache.
+
+        :param render: A function taking the WSGI environ and returning a
+            `WbResponse` with the rendered page
+        :param environ: The WSGI environ of the request
+        :return: A `WbResponse`
+        """
+        key = self.cache_key(environ)
+        if key is None:
+            return render(environ)
+
+        page = self._cache.get(key)
+
+        fetching = self._fetching.get(key)
+        if self._needs_fetching(page) and fetching:
+            # Another request is fetching this page right now. Rather than
+            # asking the site for it again, read it along with that one.
+            fetching.started.wait(self.WAIT_TIMEOUT)
+            response = fetching.share()
+            if response is not None:
+                metrics.increment("render_cache.hits")
+                return response
+
+            # It might have been revalidated
+            page = self._cache.get(key)
+
+        if not self._needs_fetching(page):
+            metrics.increment("render_cache.hits")
+            return self._response(page)
+
+        fetching = self._fetching[key] = _Fetching()
+        fetching.done = partial(self._done_fetching, key, fetching)
+        try:
+            return self._fetch(key, page, render, environ, fetching)
+        except BaseException:
+            fetching.done()
+            raise
+
+    def _fetch(self, key, page, render, environ, fetching):
+        # pylint:disable=too-many-arguments,too-many-positional-arguments
+        if page is None:
+            metrics.increment("render_cache.misses")
+            return self._read_through(key, render(environ), fetching)
+
+        # Ask the site whether the page has changed since we rendered it.
+        # `pywb` passes this straight on to the site.
+        environ["HTTP_IF_NONE_MATCH"] = page.etag
+        try:
+            response = render(environ)
+        finally:
+            environ.pop("HTTP_IF_NONE_MATCH", None)
+
+        if response.status_headers.get_statuscode() != "304":
+            metrics.increment("render_cache.misses")
+            return self._read_through(key, response, fetching)
+
+        metrics.increment("render_cache.revalidated")
+        _close(response.body)
+        self._store(key, page)
+        fetching.done()
+
+        return self._response(page)
+
+    def _done_fetching(self, key, fetching):
+        # We might have been given up on and replaced by another request
+        if self._fetching.get(key) is fetching:
+            del self._fetching[key]
+
+        fetching.started.set()
+
+    @staticmethod
+    def _needs_fetching(page):
+        return page is None or bool(page.etag and page.fresh_until <= monotonic())
+
+    @classmethod
+    def cache_key(cls, environ):
+        """Get the key to store the page for a request under.
+
+        :return: A hashable key, or None if the request can't be cached
+        """
+        if environ.get("REQUEST_METHOD") != "GET":
+            return None
+
+        for header in cls.UNCACHEABLE_REQUEST_HEADERS:
+            if header in environ:
+                return None
+
+        # Our own params can come in any order, but the rest belong to the
+        # proxied URL and their order might matter
+        params = parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True)
+        via_params = sorted(param for param in params if param[0].startswith("via."))
+        other_params = [param for param in params if not param[0].startswith("via.")]
+
+        return (
+            environ.get("wsgi.url_scheme"),
+            environ.get("HTTP_HOST"),
+            environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", ""),
+            tuple(other_params),
+            tuple(via_params),
+        ) + tuple(environ.get(header) for header in cls.VARY_REQUEST_HEADERS)
+
+    def _read_through(self, key, response, fetching):
+        if not self._is_cacheable(response.status_headers):
+            fetching.done()
+            return response
+
+        # Copy the headers now, as they are added to as the response is sent
+        status_headers = _copy(response.status_headers)
+        etag = status_headers.get_header(self.ORIGINAL_HEADER_PREFIX + "ETag")
+
+        def store(body):
+            self._store(key, _Page(status_headers, body, etag, 0))
+
+        fetching.status_headers = status_headers
+        fetching.body = _SharedBody(
+            response.body, self._max_page_size, on_read=store, on_done=fetching.done
+        )
+        response.body = fetching.body.reader()
+        fetching.started.set()
+
+        return response
+
+    def _store(self, key, page):
+        self._cache.set(
+            key,
+            page._replace(fresh_until=monotonic() + self._fresh_ttl),
+            ttl=self._stale_ttl if page.etag else self._fresh_ttl,
+        )
+
+    @classmethod
+    def _is_cacheable(cls, status_headers):
+        if status_headers.get_statuscode() != "200":
+            return False
+
+        content_type = status_headers.get_header("Content-Type") or ""
+        if not content_type.startswith("text/html"):
+            return False
+
+        # The site's cookies have been rewritten to be set on our domain
+        if status_headers.get_header("Set-Cookie"):
+            return False
+
+        cache_control = (
+            status_headers.get_header(cls.ORIGINAL_HEADER_PREFIX + "Cache-Control")
+            or ""
+        ).lower()
+
+        return not any(
+            directive in cache_control for directive in cls.UNCACHEABLE_DIRECTIVES
+        )
+
+    @staticmethod
+    def _response(page):
+        return WbResponse(_copy(page.status_headers), [page.body])
@@ -0,0 +1,50 @@
+"""The names of the content-hashed copies of our static files."""
+
+import json
+import logging
+import os
+
+
+class StaticManifest:
+    """Find the content-hashed copy of a static file.
+
+    `bin/build_static.py` adds a copy of each file with a hash of its content
+    in the name, which NGINX lets browsers cache forever. It writes a manifest
+    of them, which this reads.
+    """
+
+    def __init__(self, names=None):
+        """Create a manifest.
+
+        :param names: A dict of file names, to the names of their hashed copies
+        """
+        self._names = names or {}
+
+    @classmethod
+    def load(cls, path):
+        """Load the manifest `bin/build_static.py` writes.
+
+        :param path: The path to the manifest, or None for an empty one
+        """
+        if not path:
+            return cls()
+
+        if not os.path.exists(path):
+            # Like when running locally without having built the static files
+            logging.warning(
+                "Cannot find the static manifest %s, so static files won't be "
+                "cached well",
+                path,
+            )
+            return cls()
+
+        with open(path, encoding="utf-8") as handle:
+            return cls(json.load(handle))
+
+    def __call__(self, name):
+        """Get the name of the hashed copy of a file, if there is one.
+
+        :param name: The path of the file relative to the static prefix
+        :return: The path of the hashed copy or `name` if there isn't one
+        """
+        return self._names.get(name, name)
@@ -6,6 +6,8 @@ from logging import getLogger
 import requests
 from requests import RequestException
 
+from viahtml.metrics import HISTOGRAM_BUCKETS
+
 LOG = getLogger(__name__)
 
 
@@ -42,6 +44,39 @@ class UWSGINewRelicStatsGenerator:
         "vsz": 1 / 1000,
     }
 
+    # Metrics we set ourselves with `viahtml.metrics`
+    METRICS = {
+        "checkmate.circuit.opened": "Checkmate/Circuit/Opened",
+        "checkmate.circuit.rejected": "Checkmate/Circuit/Rejected",
+        "checkmate.circuit.failures": "Checkmate/Failures",
+        "render_cache.hits": "RenderCache/Hits",
+        "render_cache.misses": "RenderCache/Misses",
+        "render_cache.revalidated": "RenderCache/Revalidated",
+        "dns_cache.hits": "DNSCache/Hits",
+        "dns_cache.misses": "DNSCache/Misses",
+        "dns_cache.failures": "DNSCache/Failures",
+        "checkmate.calls": "Checkmate/Calls",
+        "checkmate_cache.hits": "Checkmate/Cache/Hits",
+        "checkmate_cache.misses": "Checkmate/Cache/Misses",
+        "checkmate_shared_cache.hits": "Checkmate/SharedCache/Hits",
+        "checkmate_shared_cache.misses": "Checkmate/SharedCache/Misses",
+        "rewrite.characters": "Rewrite/Characters",
+    }
+
+    # Histograms we keep with `viahtml.metrics.observe()`
+    HISTOGRAMS = {
+        "latency.document": "Latency/Document",
+        "latency.subresource": "Latency/Subresource",
+        "latency.status": "Latency/Status",
+        "latency.blocked": "Latency/Blocked",
+        "timing.views": "Timing/Views",
+        "timing.deferred": "Timing/Deferred",
+        "timing.upstream": "Timing/Upstream",
+        "timing.template": "Timing/Template",
+        "timing.rewrite": "Timing/Rewrite",
+    }
+    PERCENTILES = (50, 95, 99)
+
     SOCKET_STATS = {
         "queue": "Queue/Socket/Size",
         "max_queue": "Queue/Socket/Max",
@@ -54,6 +89,10 @@ class UWSGINewRelicStatsGenerator:
         """
         self._stats_endpoint = stats_endpoint
 
+        # The histogram counts we last saw, so we can report on the durations
+        # since then, rather than since uWSGI started
+        self._last_histograms = {}
+
     def __call__(self):
         """Generate stat name value pairs."""
 
@@ -79,6 +118,14 @@ class UWSGINewRelicStatsGenerator:
         for key, stat_name in self.ROOT_STATS.items():
             yield stat_name, raw_stats[key]
 
+        # Our own metrics, if uWSGI is configured to collect them
+        metrics = raw_stats.get("metrics", {})
+        for key, stat_name in self.METRICS.items():
+            if key in metrics:
+                yield stat_name, metrics[key]["value"]
+
+        yield from self._get_histogram_stats(metrics)
+
         # Socket metrics
         yield from self._stats_from_items(
             raw_stats["sockets"], stat_mapping=self.SOCKET_STATS
@@ -86,6 +133,29 @@ class UWSGINewRelicStatsGenerator:
 
         yield from self._get_worker_stats(raw_stats)
 
+    def _get_histogram_stats(self, metrics):
+        for key, stat_name in self.HISTOGRAMS.items():
+            histogram = _histogram_counts(metrics, key)
+            if histogram is None:
+                continue
+
+            last = self._last_histograms.get(key)
+            self._last_histograms[key] = histogram
+            # The counts go back to zero when uWSGI restarts
+            if last and all(now >= then for now, then in zip(histogram, last)):
+                histogram = tuple(now - then for now, then in zip(histogram, last))
+
+            *counts, sum_us = histogram
+            count = sum(counts)
+            yield f"{stat_name}/Count", count
+            if not count:
+                continue
+
+            yield f"{stat_name}/Average[ms]", int(sum_us / count / 10) / 100
+            for percentile in self.PERCENTILES:
+                value = _percentile(counts, percentile / 100)
+                yield f"{stat_name}/P{percentile}[ms]", int(100 * value) / 100
+
     def _get_worker_stats(self, raw_stats):
         workers = raw_stats["workers"]
         accepting_workers = [worker for worker in workers if worker["accepting"]]
@@ -142,3 +212,311 @@ class UWSGINewRelicStatsGenerator:
                 # It'll be close enough for metrics purposes
                 "sum_of_squares": int(sum(value**2 for value in values)),
             }
+
+
+def _histogram_counts(metrics, name):
+    """Get the counts of a histogram kept with `viahtml.metrics.observe()`.
+
+    :param metrics: The `metrics` part of the uWSGI stats
+    :param name: The name of the histogram
+    :return: A tuple of the count in each of `HISTOGRAM_BUCKETS` and then
+        over the last of them, followed by the total in microseconds, or None
+        if the histogram isn't configured
+    """
+    keys = [f"{name}.le_{bound}" for bound in HISTOGRAM_BUCKETS]
+    keys += [f"{name}.le_inf", f"{name}.sum_us"]
+
+    try:
+        return tuple(metrics[key]["value"] for key in keys)
+    except KeyError:
+        return None
+
+
+def _percentile(counts, fraction):
+    """Estimate a percentile in milliseconds from histogram bucket counts.
+
+    This assumes the durations in a bucket are spread evenly across it. The
+    last bucket has no upper bound, so anything in it is reported as the
+    lower one.
+    """
+    rank = fraction * sum(counts)
+    seen = 0
+    lower = 0
+
+    for upper, count in zip(HISTOGRAM_BUCKETS, counts):
+        if count and seen + count >= rank:
+            return lower + (upper - lower) * (rank - seen) / count
+
+        seen += count
+        lower = upper
+
+    return lower
+
+
+class UWSGIOpenMetricsGenerator:
+    """A callable which returns uWSGI stats in the OpenMetrics text format.
+
+    This reads the stats afresh each time it's called, so it can be scraped
+    as often as needed. Each worker's numbers are labelled with its id, and
+    there are totals across all of the workers too.
+    """
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    # Mappings from the JSON structure we get back from the uWSGI stats
+    # end-point to metric families, as: (name, type, help, scale)
+    ROOT_STATS = {
+        "load": (
+            "uwsgi_load",
+            "gauge",
+            "Requests waiting or being handled",
+            1,
+        ),
+        "listen_queue": (
+            "uwsgi_listen_queue",
+            "gauge",
+            "Connections waiting to be accepted",
+            1,
+        ),
+        "listen_queue_errors": (
+            "uwsgi_listen_queue_errors",
+            "counter",
+            "Connections refused because the listen queue was full",
+            1,
+        ),
+        "signal_queue": (
+            "uwsgi_signal_queue",
+            "gauge",
+            "Signals waiting to be handled",
+            1,
+        ),
+    }
+
+    SOCKET_STATS = {
+        "queue": ("uwsgi_socket_queue", "gauge", "Connections waiting", 1),
+        "max_queue": (
+            "uwsgi_socket_max_queue",
+            "gauge",
+            "Connections which can wait",
+            1,
+        ),
+    }
+
+    WORKER_STATS = {
+        "requests": ("uwsgi_worker_requests", "counter", "Requests handled", 1),
+        "exceptions": (
+            "uwsgi_worker_exceptions",
+            "counter",
+            "Requests which raised an exception",
+            1,
+        ),
+        "harakiri_count": (
+            "uwsgi_worker_harakiri",
+            "counter",
+            "Requests killed for taking too long",
+            1,
+        ),
+        "respawn_count": (
+            "uwsgi_worker_respawns",
+            "counter",
+            "Times the worker has been restarted",
+            1,
+        ),
+        "tx": ("uwsgi_worker_transmitted_bytes", "counter", "Bytes sent", 1),
+        "avg_rt": (
+            "uwsgi_worker_average_response_time_seconds",
+            "gauge",
+            "Average time to handle a request",
+            1 / 1_000_000,
+        ),
+        "running_time": (
+            "uwsgi_worker_running_time_seconds",
+            "counter",
+            "Time spent handling requests",
+            1 / 1_000_000,
+        ),
+        "rss": (
+            "uwsgi_worker_resident_memory_bytes",
+            "gauge",
+            "Resident memory",
+            1,
+        ),
+        "vsz": (
+            "uwsgi_worker_virtual_memory_bytes",
+            "gauge",
+            "Virtual memory",
+            1,
+        ),
+        "accepting": (
+            "uwsgi_worker_accepting",
+            "gauge",
+            "Whether the worker is accepting requests",
+            1,
+        ),
+    }
+
+    # Worker stats to also give the total of across all workers, like
+    # `uwsgi_requests_total`
+    WORKER_TOTALS = ("requests", "exceptions", "harakiri_count", "rss")
+
+    # Histograms we keep with `viahtml.metrics.observe()` are named like
+    # `latency.document`. These are the label each family puts the second
+    # part in, and its help text
+    HISTOGRAMS = {
+        "latency": ("route", "Time taken to respond to requests by route class"),
+        "timing": ("part", "Time spent on parts of requests"),
+    }
+
+    # uWSGI's own metrics, which repeat what's in the rest of the stats
+    UWSGI_METRIC_PREFIXES = ("core.", "worker.", "socket.")
+
+    def __init__(self, stats_endpoint, prefix="viahtml_"):
+        """Create a callable metrics generator.
+
+        :param stats_endpoint: The uWSGI stats end-point to call
+        :param prefix: A prefix for the names of all of the metrics
+        """
+        self._stats_endpoint = stats_endpoint
+        self._prefix = prefix
+
+    def __call__(self):
+        """Get the stats as an OpenMetrics text exposition."""
+        lines = []
+
+        for name, metric_type, help_text, samples in self._get_families():
+            name = self._prefix + name
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"# HELP {name} {help_text}")
+
+            for suffix, labels, value in samples:
+                lines.append(f"{name}{suffix}{_labels(labels)} {value}")
+
+        lines.append("# EOF\n")
+
+        return "\n".join(lines)
+
+    def _get_families(self):
+        try:
+            raw_stats = requests.get(url=self._stats_endpoint, timeout=1).json()
+        except RequestException as err:
+            LOG.debug("Stats collection from uWSGI failed with error: %s", err)
+
+            yield "uwsgi_up", "gauge", "Whether uWSGI answered", [("", {}, 0)]
+            return
+
+        yield "uwsgi_up", "gauge", "Whether uWSGI answered", [("", {}, 1)]
+
+        for key, family in self.ROOT_STATS.items():
+            yield self._family(family, [({}, raw_stats[key])])
+
+        for key, family in self.SOCKET_STATS.items():
+            yield self._family(
+                family,
+                [
+                    ({"socket": socket["name"]}, socket[key])
+                    for socket in raw_stats["sockets"]
+                ],
+            )
+
+        yield from self._get_worker_families(raw_stats["workers"])
+        yield from self._get_app_families(raw_stats.get("metrics", {}))
+
+    def _get_worker_families(self, workers):
+        for key, family in self.WORKER_STATS.items():
+            yield self._family(
+                family, [({"worker": worker["id"]}, worker[key]) for worker in workers]
+            )
+
+        # Totals across all of the workers, so nothing has to add them up
+        for key in self.WORKER_TOTALS:
+            name, metric_type, help_text, scale = self.WORKER_STATS[key]
+            yield self._family(
+                (
+                    name.replace("uwsgi_worker_", "uwsgi_"),
+                    metric_type,
+                    f"{help_text} by all workers",
+                    scale,
+                ),
+                [({}, sum(worker[key] for worker in workers))],
+            )
+
+        status = Counter(worker["status"] for worker in workers)
+        yield self._family(
+            ("uwsgi_workers", "gauge", "Workers by status", 1),
+            [({"status": name}, count) for name, count in sorted(status.items())],
+        )
+
+    def _get_app_families(self, metrics):
+        histograms = defaultdict(list)
+
+        for key, metric in metrics.items():
+            if key.startswith(self.UWSGI_METRIC_PREFIXES):
+                continue
+
+            if key.endswith(".sum_us"):
+                family, _, label = key[: -len(".sum_us")].partition(".")
+                if family in self.HISTOGRAMS:
+                    histograms[family].append(label)
+                continue
+
+            if ".le_" in key:
+                continue
+
+            metric_type = "gauge" if metric["type"] == 1 else "counter"
+            yield self._family(
+                (key.replace(".", "_"), metric_type, f"The {key} metric", 1),
+                [({}, metric["value"])],
+            )
+
+        for family, labels in histograms.items():
+            label_name, help_text = self.HISTOGRAMS[family]
+            samples = []
+            for label in labels:
+                histogram = _histogram_counts(metrics, f"{family}.{label}")
+                if histogram is not None:
+                    samples.extend(
+                        self._histogram_samples(histogram, {label_name: label})
+                    )
+
+            yield f"{family}_seconds", "histogram", help_text, samples
+
+    @staticmethod
+    def _histogram_samples(histogram, labels):
+        *counts, sum_us = histogram
+
+        # OpenMetrics buckets count everything up to their bound, and ours
+        # only count what's over the one before
+        total = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS + (None,), counts):
+            total += count
+            le = "+Inf" if bound is None else str(bound / 1000)
+            yield "_bucket", dict(labels, le=le), total
+
+        yield "_count", labels, total
+        yield "_sum", labels, sum_us / 1_000_000
+
+    @staticmethod
+    def _family(family, samples):
+        name, metric_type, help_text, scale = family
+        suffix = "_total" if metric_type == "counter" else ""
+
+        return (
+            name,
+            metric_type,
+            help_text,
+            [(suffix, labels, value * scale) for labels, value in samples],
+        )
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return (
+        "{"
+        + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+        + "}"
+    )
@@ -0,0 +1,122 @@
+"""Stream response bodies through `pywb`."""
+
+from contextlib import closing
+from time import monotonic
+
+from pywb.utils.io import BUFF_SIZE
+from warcio.bufferedreaders import BufferedReader, ChunkedDataReader
+
+MAX_CHUNK_SIZE = 256 * 1024
+"""The largest chunk we'll read from a stream at once."""
+
+FAST_READ = 0.005
+"""Seconds a read can take for us to read a bigger chunk next time."""
+
+
+def stream_iter(  # pylint:disable=too-many-arguments,too-many-positional-arguments
+    stream, header1=None, header2=None, size=BUFF_SIZE, closer=closing, first_size=None
+):
+    """Iterate over a stream in chunks which grow while the data keeps up.
+
+    This can replace `pywb.utils.io.StreamIter`, which reads 16KB at a time.
+    That's slow for big images and videos, where each chunk goes through a
+    few layers of generators and the WSGI server. Reads block until they get
+    all the bytes asked for though, so reading big chunks from a slow stream
+    (like live audio) would hold the data back instead.
+
+    So, like TCP slow start, we start with `size` and double the chunk size
+    each time a read fills up quickly, up to `MAX_CHUNK_SIZE`. A slow read
+    drops it back to `size`. A smaller `first_size` gets the start of the
+    stream sent on sooner.
+    """
+    chunk_size = first_size or size
+
+    with closer(stream):
+        if header1:
+            yield header1
+
+        if header2:
+            yield header2
+
+        while True:
+            start = monotonic()
+            buff = stream.read(chunk_size)
+            if not buff:
+                break
+
+            if monotonic() - start > FAST_READ:
+                chunk_size = size
+            elif len(buff) == chunk_size:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+
+            yield buff
+
+
+class ArrivalReader:
+    """Read from a `urllib3` response without waiting for reads to fill.
+
+    A `read(size)` on a response blocks until `size` bytes have arrived, so
+    the start of a page which arrives quickly is held up by the rest of it.
+    This returns whatever has arrived instead, as long as there's some.
+    """
+
+    def __init__(self, response):
+        """Wrap a response.
+
+        :param response: A `urllib3.response.HTTPResponse` to read from
+        """
+        self._response = response
+        self._chunks = response.stream(MAX_CHUNK_SIZE)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        """Read up to `size` bytes, or everything left if `size` is negative."""
+        if size is None or size < 0:
+            data = self._buffer + b"".join(self._chunks)
+            self._buffer = b""
+            return data
+
+        if not self._buffer:
+            self._buffer = next(self._chunks, b"")
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def __getattr__(self, name):
+        # For `close()`, `release_conn()` and anything else `pywb` wants
+        return getattr(self._response, name)
+
+
+class EagerBufferedReader(BufferedReader):
+    """A `warcio` buffered reader which doesn't wait for the start to fill.
+
+    `pywb` reads pages through a few of these, each of which loops until it
+    has all of the bytes asked for. For the first `eager_size` bytes, this
+    returns whatever it has buffered instead, so the start of a page can be
+    parsed and rewritten before the rest of it arrives.
+    """
+
+    eager_size = 0
+    """Bytes at the start of each stream to read eagerly."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._eager_remaining = self.eager_size
+
+    def read(self, length=None):
+        """Read up to `length` bytes, or fewer if that's all there is yet."""
+        if length is None or self._eager_remaining <= 0:
+            return super().read(length)
+
+        self._fillbuff()
+        data = b"" if self.empty() else self.buff.read(length)
+        self._eager_remaining -= len(data)
+
+        return data
+
+
+class EagerChunkedDataReader(EagerBufferedReader, ChunkedDataReader):
+    """A `warcio` chunked data reader which doesn't wait for the start to fill.
+
+    See `EagerBufferedReader`.
+    """
@@ -0,0 +1,172 @@
+"""Connections to the sites we proxy."""
+
+import socket
+from functools import partial
+from time import monotonic
+
+from pywb.warcserver.http import DefaultAdapters, PywbHttpAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+
+class _HTTPConnection(HTTPConnection):
+    """A connection which looks up its host in a `DNSCache`."""
+
+    def __init__(self, *args, dns_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dns_cache = dns_cache
+
+    def _new_conn(self):
+        # `_dns_host` belongs to `urllib3`, which sets it with the host
+        # pylint:disable=attribute-defined-outside-init
+        if self.dns_cache is None:
+            return super()._new_conn()
+
+        host = self._dns_host
+        addresses = self._resolve(host)
+
+        error = None
+        for address in addresses:
+            # Only the socket connects to the address. The `Host` header and
+            # TLS certificate checks still use the host name.
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except NewConnectionError as err:
+                error = err
+            finally:
+                self._dns_host = host
+
+        if error is None:
+            # There were no addresses to try. This is what `urllib3` raises
+            # when its own lookup finds nothing.
+            error = NewConnectionError(
+                self,
+                "Failed to establish a new connection: "
+                "getaddrinfo returns an empty list",
+            )
+
+        # The host might have moved, so look it up again next time
+        self.dns_cache.forget(host, self.port)
+        raise error
+
+    def _resolve(self, host):
+        try:
+            return self.dns_cache.resolve(host, self.port)
+        except socket.gaierror as err:
+            # What `urllib3` raises when it can't find a host itself
+            raise NewConnectionError(
+                self, f"Failed to establish a new connection: {err}"
+            ) from err
+
+
+class _HTTPSConnection(_HTTPConnection, HTTPSConnection):
+    pass
+
+
+class _HTTPPool(HTTPConnectionPool):
+    """A connection pool which drops connections left idle for too long.
+
+    Sites close idle keep-alive connections after a while, and only find
+    out when we try to reuse one, which costs a failed request and a retry.
+    """
+
+    ConnectionCls = _HTTPConnection
+
+    def __init__(self, *args, idle_timeout, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle_timeout = idle_timeout
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+
+        last_used = getattr(conn, "via_last_used", None)
+        if last_used is not None and monotonic() - last_used > self.idle_timeout:
+            # This makes it reconnect when it's next used
+            conn.close()
+
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.via_last_used = monotonic()
+
+        super()._put_conn(conn)
+
+
+class _HTTPSPool(_HTTPPool, HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class UpstreamPool(PywbHttpAdapter):
+    """The connections `pywb` uses to fetch pages from the sites we proxy.
+
+    This keeps connections to more sites, and more connections to each, than
+    `pywb` does by default, so pages with lots of subresources from the same
+    few hosts don't pay for a new TCP and TLS handshake for each one.
+
+    Pools use `gevent` friendly queues once `gevent` has monkey patched the
+    standard library, and never make a request wait for a connection.
+    """
+
+    def __init__(
+        self, max_hosts, max_connections_per_host, idle_timeout, dns_cache=None
+    ):
+        """Create a new pool.
+
+        :param max_hosts: How many hosts to keep connections to
+        :param max_connections_per_host: How many idle connections to keep to
+            each host. More are made if needed, but aren't kept.
+        :param idle_timeout: Seconds before an idle connection is dropped
+        :param dns_cache: A `DNSCache` to look up hosts with
+        """
+        self.idle_timeout = idle_timeout
+        self.dns_cache = dns_cache
+
+        super().__init__(
+            max_retries=Retry(3),
+            pool_connections=max_hosts,
+            pool_maxsize=max_connections_per_host,
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Create the pool manager, with our own types of pool."""
+        super().init_poolmanager(*args, **kwargs)
+
+        # Other keyword arguments are passed on to each connection
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": partial(
+                _HTTPPool, idle_timeout=self.idle_timeout, dns_cache=self.dns_cache
+            ),
+            "https": partial(
+                _HTTPSPool, idle_timeout=self.idle_timeout, dns_cache=self.dns_cache
+            ),
+        }
+
+    def install(self):
+        """Make `pywb` use this pool to fetch pages.
+
+        This must be called before the `pywb` app is created.
+        """
+        DefaultAdapters.live_adapter = self
+
+    @property
+    def stats(self):
+        """Get a dict of stats about how the pool is being used."""
+
+        pools = self.poolmanager.pools
+        with pools.lock:
+            # pylint:disable=protected-access
+            host_pools = list(pools._container.values())
+
+        return {
+            "hosts": len(host_pools),
+            "connections_made": sum(pool.num_connections for pool in host_pools),
+            "requests": sum(pool.num_requests for pool in host_pools),
+            # Empty slots in the queue are filled with `None`
+            "idle_connections": sum(
+                1 for pool in host_pools for conn in pool.pool.queue if conn is not None
+            ),
+        }
@@ -0,0 +1,76 @@
+"""Hand big binary subresources off to nginx to fetch."""
+
+import re
+from http import HTTPStatus
+from urllib.parse import urlsplit
+
+
+class AccelRedirectView:
+    """Have nginx fetch images, fonts and media instead of us.
+
+    These aren't rewritten, so there's no need for `pywb` to see them, but
+    they tie up a worker for as long as they take to send. Instead we answer
+    with an `X-Accel-Redirect` to an internal nginx location, which fetches
+    them from the site directly. See `conf/nginx/viahtml/accel_redirect.conf`.
+
+    This must come after `SecurityView` so Checkmate has approved the URL.
+    """
+
+    OFFLOAD_DESTINATIONS = {"audio", "embed", "font", "image", "object", "video"}
+    """`Sec-Fetch-Dest` values for the requests we offload."""
+
+    OFFLOAD_MODIFIERS = {"im_", "oe_"}
+    """`pywb` URL modifiers for images, and objects and embeds."""
+
+    LOCATION = "/_upstream/"
+    """The internal nginx location which fetches the URL."""
+
+    ROUTE = "subresource"
+    """The route class to report the latency of our responses under."""
+
+    _PREFIX_PATTERN = re.compile(r"^/proxy/(?:([a-z]{2}_)/)?")
+
+    def __call__(self, context):
+        """Offload the request to nginx if it's for a binary subresource.
+
+        :param context: Context object relating to this call
+        :return: An iterator of content if required or None
+        """
+        if context.http_environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+            return None
+
+        url = context.proxied_url
+        prefix = self._PREFIX_PATTERN.match(context.path)
+        if not url or not prefix:
+            return None
+
+        scheme, netloc, *_ = urlsplit(url)
+        # nginx sends the URL as it is, so it has to be ready to go
+        if scheme not in ("http", "https") or not url.isascii():
+            return None
+
+        if (
+            prefix.group(1) not in self.OFFLOAD_MODIFIERS
+            and context.get_header("Sec-Fetch-Dest") not in self.OFFLOAD_DESTINATIONS
+        ):
+            return None
+
+        # If Checkmate was asked speculatively, we have to wait for the answer
+        # now, as we won't see the response go by
+        for deferred in context.deferred:
+            response = deferred()
+            if response is not None:
+                return response
+        context.deferred.clear()
+
+        return context.make_response(
+            HTTPStatus.OK,
+            headers={
+                "X-Accel-Redirect": self.LOCATION,
+                "X-Via-Upstream-Url": url,
+                # For nginx to keep redirects going through us
+                "X-Via-Upstream-Prefix": prefix.group(0),
+                "X-Via-Upstream-Origin": f"{scheme}://{netloc}",
+                "X-Via-Upstream-Referer": context.proxied_referrer or "",
+            },
+        )
@@ -11,6 +11,9 @@ class RoutingView:
     MAX_AGE = 300
     STALE_WHILE_REVALIDATE = 86400
 
+    ROUTE = "document"
+    """The route class to report the latency of our responses under."""
+
     def __init__(self, routing_host):
         """Create a view for routing requests to present content.
 
@@ -1,20 +1,52 @@
 import logging
 from http import HTTPStatus
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit
 
+import gevent
 from checkmatelib import BadURL, CheckmateException
 
+from viahtml.checkmate import CircuitOpen, DocumentTokens, check_public_url
+
 
 class SecurityView:
-    def __init__(
-        self, allow_all, allowed_referrers, authentication_required, check_url
+    DOCUMENT_DESTINATIONS = {"document", "frame", "iframe"}
+    """`Sec-Fetch-Dest` values for pages we hand out document tokens for."""
+
+    SUBRESOURCE_DESTINATIONS = {
+        "audio",
+        "font",
+        "image",
+        "manifest",
+        "script",
+        "style",
+        "track",
+        "video",
+    }
+    """`Sec-Fetch-Dest` values for requests a document token can admit."""
+
+    ROUTE = "blocked"
+    """The route class to report the latency of our responses under."""
+
+    def __init__(  # pylint:disable=too-many-arguments,too-many-positional-arguments
+        self,
+        allow_all,
+        allowed_referrers,
+        authentication_required,
+        check_url,
+        document_tokens=None,
+        fail_closed=False,
+        speculative=False,
     ):
         self._allow_all = allow_all
         self._allowed_referrers = allowed_referrers
         self._authentication_required = authentication_required
         self._check_url = check_url
+        self._document_tokens = document_tokens
+        self._fail_closed = fail_closed
+        self._speculative = speculative
 
     def __call__(self, context):
+        cookie_header = self._strip_document_tokens(context)
         authorization_reason, allow_all = self._is_authorized(context)
 
         if not authorization_reason:
@@ -27,27 +59,161 @@ class SecurityView:
         if context.debug:
             context.headers.append(("X-Via-Authorized-Because", authorization_reason))
 
+        if self._has_verified_document(context, cookie_header):
+            # We don't ask Checkmate, but still never fetch private URLs
+            response = self._refuse_private_url(context)
+            if response is None and context.debug:
+                context.headers.append(("X-Via-Checkmate-Skipped", "Document token"))
+
+            return response
+
+        if self._speculative and context.proxied_url:
+            # The proxied request goes out before Checkmate answers, so URLs
+            # we can refuse without asking it have to be refused now
+            response = self._refuse_private_url(context)
+            if response is not None:
+                return response
+
+            # Start checking now, but don't wait for the answer until the
+            # proxied response is ready to go. See `Context.deferred`.
+            check = gevent.spawn(self._check, context, allow_all)
+            context.deferred.append(lambda: self._respond(context, *check.get()))
+            return None
+
+        return self._respond(context, *self._check(context, allow_all))
+
+    def _check(self, context, allow_all):
+        """Check the requested URL, catching any errors.
+
+        :return: A tuple of the result of `_is_blocked()` and any
+            `CheckmateException` it raised
+        """
         try:
-            blocked = self._is_blocked(
-                context.proxied_url,
-                context.query_params.get("via.blocked_for"),
-                allow_all,
+            return (
+                self._is_blocked(
+                    context.proxied_url,
+                    context.query_params.get("via.blocked_for"),
+                    allow_all,
+                ),
+                None,
             )
+        except CheckmateException as exc:
+            return False, exc
+
+    def _refuse_private_url(self, context):
+        """Refuse URLs we can tell are bad without asking Checkmate.
+
+        :return: A response if the URL is bad, otherwise None
+        """
+        try:
+            check_public_url(context.proxied_url)
         except BadURL as exc:
+            return self._respond(context, False, exc)
+
+        return None
+
+    def _respond(self, context, blocked, error):
+        """Create a response for the result of a check, if required."""
+        if isinstance(error, BadURL):
             return context.make_response(
                 HTTPStatus.BAD_REQUEST,
-                lines=[self._error_template(f"Bad URL: {exc}: {context.proxied_url}")],
+                lines=[
+                    self._error_template(f"Bad URL: {error}: {context.proxied_url}")
+                ],
                 headers={"Content-Type": "text/html; charset=utf-8"},
             )
 
+        if error:
+            # We only get here if we are configured to fail closed
+            return context.make_response(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                lines=[
+                    self._error_template(
+                        "We can't check this URL right now, please try again later",
+                        http_status=HTTPStatus.SERVICE_UNAVAILABLE,
+                    )
+                ],
+                headers={
+                    "Content-Type": "text/html; charset=utf-8",
+                    "Retry-After": "30",
+                },
+            )
+
         if blocked:
             return context.make_response(
                 HTTPStatus.TEMPORARY_REDIRECT,
                 headers={"Location": blocked.presentation_url},
             )
 
+        self._add_document_token(context)
+
         return None
 
+    def _strip_document_tokens(self, context):
+        """Remove our document tokens from the request's cookies.
+
+        The tokens are for us only, so they shouldn't be passed on to the
+        sites we proxy.
+
+        :return: The original `Cookie` header
+        """
+        cookie_header = context.get_header("Cookie")
+        if not self._document_tokens or not cookie_header:
+            return cookie_header
+
+        stripped = DocumentTokens.strip(cookie_header)
+        if stripped:
+            context.http_environ["HTTP_COOKIE"] = stripped
+        else:
+            context.http_environ.pop("HTTP_COOKIE", None)
+
+        return cookie_header
+
+    def _add_document_token(self, context):
+        """Give allowed documents a token their subresources can use."""
+        if not self._document_tokens or not context.proxied_url:
+            return
+
+        if context.get_header("Sec-Fetch-Dest") in self.DOCUMENT_DESTINATIONS:
+            context.headers.append(
+                ("Set-Cookie", self._document_tokens.make_cookie(context.proxied_url))
+            )
+
+    def _has_verified_document(self, context, cookie_header):
+        """Return True if this is a subresource of a recently checked page.
+
+        Only same-origin subresources qualify, never documents or frames,
+        and only with a valid token for the page in the `Referer`.
+        """
+        if not self._document_tokens:
+            return False
+
+        if context.get_header("Sec-Fetch-Dest") not in self.SUBRESOURCE_DESTINATIONS:
+            return False
+
+        if not self._is_same_origin_url(context.proxied_url, context.proxied_referrer):
+            return False
+
+        return self._document_tokens.is_verified(
+            context.proxied_referrer, cookie_header
+        )
+
+    @staticmethod
+    def _is_same_origin_url(url, other_url):
+        """Return True if two proxied URLs have the same scheme and host."""
+        if not url or not other_url:
+            return False
+
+        try:
+            url, other_url = urlsplit(url), urlsplit(other_url)
+        except ValueError:
+            return False
+
+        return (url.scheme.lower(), url.netloc.lower()) == (
+            other_url.scheme.lower(),
+            other_url.netloc.lower(),
+        )
+
     def _is_authorized(self, context):
         """Decide whether or not the request should be authorized.
 
@@ -132,6 +298,8 @@ class SecurityView:
             blocked
 
         :raises BadURL: For malformed or private URLs
+        :raises CheckmateException: If Checkmate fails and we are configured
+            to fail closed
         """
         if not url:
             return False
@@ -142,12 +310,19 @@ class SecurityView:
             )
         except BadURL:
             raise
-        except CheckmateException:
-            logging.exception("Failed to check URL against Checkmate")
+        except CheckmateException as exc:
+            # An open circuit was logged when it opened, there's no need to
+            # repeat that for every request
+            if not isinstance(exc, CircuitOpen):
+                logging.exception("Failed to check URL against Checkmate")
+
+            if self._fail_closed:
+                raise
+
             return False
 
     @staticmethod
-    def _error_template(exception):
+    def _error_template(exception, http_status=HTTPStatus.UNAUTHORIZED):
         # We add a fake favicon here, to prevent the browser from requesting
         # one, as this can trigger `pywb` to issue a redirect which effectively
         # logs the user in by setting a `via.sec` cookie in the response.
@@ -158,7 +333,7 @@ class SecurityView:
                 <link rel="icon" href="data:,">
             </head>
             <body>
-                <h1>401 Unauthorized</h1>
+                <h1>{http_status.value} {http_status.phrase}</h1>
                 <p>{exception}</p>
             </body>
         </html>
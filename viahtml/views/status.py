@@ -10,8 +10,13 @@ LOG = logging.getLogger(__name__)
 
 
 class StatusView:
-    def __init__(self, checkmate):
+    ROUTE = "status"
+    """The route class to report the latency of our responses under."""
+
+    def __init__(self, checkmate, circuit_breaker=None, upstream_pool=None):
         self._checkmate = checkmate
+        self._circuit_breaker = circuit_breaker
+        self._upstream_pool = upstream_pool
 
     def __call__(self, context):
         """Provide a status response if required.
@@ -29,6 +34,14 @@ class StatusView:
         if "include-checkmate" in context.query_params:
             self._check_checkmate(body)
 
+        # An open circuit doesn't make us "down": we can still serve pages
+        # while Checkmate recovers
+        if self._circuit_breaker:
+            body["checkmate_circuit"] = self._circuit_breaker.status
+
+        if self._upstream_pool:
+            body["upstream_pool"] = self._upstream_pool.stats
+
         # If any of the components checked above were down then report the
         # status check as a whole as being down.
         # pylint:disable=redefined-variable-type